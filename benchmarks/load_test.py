@@ -0,0 +1,412 @@
+"""
+Concurrent load test for the chatbot backend.
+
+Two modes:
+
+- `ask`: fires `--requests` stateless POST /ask calls with `--concurrency` in
+  flight.
+- `scenarios`: runs `--conversations` scripted multi-turn conversations from
+  `--scenarios` (Hebrew and English) through the session endpoints. Each
+  conversation collects the user's details, confirms them and asks follow-up
+  questions, optionally over the streaming endpoints.
+
+The report is JSON: throughput, p50/p95/p99 latency overall and per endpoint,
+and, when the stub server is reachable, the upstream calls and prompt tokens
+per turn. `--baseline` compares the run with an earlier report and exits with
+status 1 on a regression beyond `--tolerance`, so it can gate CI.
+
+With `--spawn`, a stub Azure server and the backend are started locally first,
+so no Azure quota is used:
+
+    python load_test.py --spawn --concurrency 100 --requests 500
+    python load_test.py --spawn --mode scenarios --conversations 200 --stream --output run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(HERE, "..", "phase2_solution", "backend")
+DEFAULT_SCENARIOS = os.path.join(HERE, "scenarios.json")
+
+USER_INFO = {
+    "first_name": "Dana", "last_name": "Levi", "id_number": "123456789", "gender": "female",
+    "age": 34, "hmo": "מכבי", "card_number": "987654321", "tier": "זהב",
+}
+
+# Metrics compared against a baseline, and whether higher values are better
+GATED_METRICS = {
+    "requests_per_s": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "upstream.calls_per_turn": False,
+    "upstream.prompt_tokens_per_turn": False,
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+    }
+
+
+def _wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+@contextmanager
+def spawn_stub(port: int, stub_args: List[str]) -> Iterator[str]:
+    """Start the stub Azure server as a subprocess and yield its URL."""
+    stub = subprocess.Popen([sys.executable, os.path.join(HERE, "stub_llm_server.py"), "--port", str(port)] + stub_args)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_until_up(f"{url}/docs")
+        yield url
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+
+
+@contextmanager
+def spawn_stack(backend_port: int, stub_port: int, stub_args: List[str],
+                backend_env: Optional[Dict[str, str]] = None) -> Iterator[None]:
+    """Start the stub server and the backend (pointed at it) as subprocesses."""
+    with spawn_stub(stub_port, stub_args) as stub_url:
+        env = dict(os.environ,
+                   AZURE_OPENAI_ENDPOINT=stub_url,
+                   AZURE_OPENAI_API_KEY="stub",
+                   LLM_MAX_RETRIES="0",
+                   **(backend_env or {}))
+        backend = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(backend_port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            _wait_until_up(f"http://127.0.0.1:{backend_port}/docs")
+            yield
+        finally:
+            backend.terminate()
+            backend.wait(timeout=10)
+
+
+def stub_stats(stub_url: Optional[str]) -> Optional[Dict[str, int]]:
+    if not stub_url:
+        return None
+    try:
+        res = httpx.get(f"{stub_url}/stub/stats", timeout=5.0)
+        res.raise_for_status()
+        return res.json()
+    except httpx.HTTPError:
+        return None
+
+
+def upstream_report(before: Optional[Dict[str, int]], after: Optional[Dict[str, int]],
+                    turns: int) -> Optional[Dict[str, float]]:
+    """Upstream calls and tokens the backend made during the run, in total and per turn."""
+    if before is None or after is None:
+        return None
+    delta = {key: value - before.get(key, 0) for key, value in after.items()}
+    report: Dict[str, float] = dict(sorted(delta.items()))
+    # Failed (injected) calls count too: they cost a round-trip and, on the real service, quota
+    calls = delta.get("chat_calls", 0) + delta.get("chat_errors_injected", 0)
+    report["calls_per_turn"] = round(calls / turns, 3) if turns else 0.0
+    report["prompt_tokens_per_turn"] = round(delta.get("prompt_tokens", 0) / turns, 1) if turns else 0.0
+    report["cached_tokens_per_turn"] = round(delta.get("cached_tokens", 0) / turns, 1) if turns else 0.0
+    return report
+
+
+def _metric(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value if isinstance(value, (int, float)) else None
+
+
+def check_regressions(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Gated metrics that are worse than the baseline by more than `tolerance` (a fraction)."""
+    failures = []
+    for path, higher_is_better in GATED_METRICS.items():
+        current, previous = _metric(result, path), _metric(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            failures.append(f"{path}: {previous} -> {current} ({change:+.1%})")
+    return failures
+
+
+# --- Stateless /ask load ---
+async def run_load(url: str, concurrency: int, total: int, question: str) -> Dict[str, Any]:
+    payload = {"user_info": USER_INFO, "history": [], "new_message": question, "language": "en"}
+    latencies: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120.0) as client:
+        async def worker():
+            nonlocal errors
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                try:
+                    res = await client.post("/ask", json=payload)
+                    res.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": "ask",
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "turns": total,
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        **latency_summary(latencies),
+    }
+
+
+# --- Scripted conversations ---
+class ConversationFailed(Exception):
+    pass
+
+
+class ScenarioRunner:
+    """Plays scripted conversations against the session endpoints and records per-endpoint latency."""
+
+    def __init__(self, client: httpx.AsyncClient, stream: bool):
+        self.client = client
+        self.stream = stream
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_token: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.turns = 0
+
+    def _record(self, endpoint: str, seconds: float) -> None:
+        self.latencies.setdefault(endpoint, []).append(seconds)
+
+    def _fail(self, endpoint: str, reason: str) -> ConversationFailed:
+        self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return ConversationFailed(f"{endpoint}: {reason}")
+
+    async def _post(self, endpoint: str, path: str, payload: dict) -> dict:
+        start = time.perf_counter()
+        try:
+            res = await self.client.post(path, json=payload)
+            res.raise_for_status()
+        except httpx.HTTPError as e:
+            raise self._fail(endpoint, str(e))
+        self._record(endpoint, time.perf_counter() - start)
+        return res.json()
+
+    async def _post_stream(self, endpoint: str, path: str, payload: dict) -> dict:
+        """POST to a Server-Sent Events endpoint; returns the `meta` event."""
+        start = time.perf_counter()
+        meta: dict = {}
+        event, first = "message", True
+        try:
+            async with self.client.stream("POST", path, json=payload) as res:
+                res.raise_for_status()
+                async for line in res.aiter_lines():
+                    if not line:
+                        event = "message"
+                    elif line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data = json.loads(line[len("data:"):].strip())
+                        if event == "meta":
+                            meta = data
+                        elif event == "error":
+                            raise self._fail(endpoint, data.get("detail", "stream error"))
+                        elif event == "message" and first:
+                            first = False
+                            self.first_token.append(time.perf_counter() - start)
+        except httpx.HTTPError as e:
+            raise self._fail(endpoint, str(e))
+        self._record(endpoint, time.perf_counter() - start)
+        return meta
+
+    async def _turn(self, endpoint: str, session_id: str, message: str) -> dict:
+        self.turns += 1
+        path = f"/sessions/{session_id}/{endpoint}"
+        if self.stream:
+            return await self._post_stream(endpoint, f"{path}/stream", {"message": message})
+        return await self._post(endpoint, path, {"message": message})
+
+    async def run(self, scenario: dict) -> None:
+        session_id = (await self._post("session", "/sessions", {"language": scenario["language"]}))["session_id"]
+        try:
+            phase = "collecting"
+            for message in scenario["collect"]:
+                phase = (await self._turn("chat", session_id, message)).get("phase", phase)
+            if phase != "confirming":
+                raise self._fail("chat", f"scenario {scenario['name']} did not reach confirmation")
+            await self._post("confirm", f"/sessions/{session_id}/confirm", {"messages": []})
+            for question in scenario["questions"]:
+                await self._turn("ask", session_id, question)
+        finally:
+            try:
+                await self.client.delete(f"/sessions/{session_id}")
+            except httpx.HTTPError:
+                pass
+
+
+async def run_scenarios(url: str, concurrency: int, conversations: int, scenarios: List[dict],
+                        stream: bool) -> Dict[str, Any]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(conversations):
+        queue.put_nowait(scenarios[index % len(scenarios)])
+    failed = 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120.0) as client:
+        runner = ScenarioRunner(client, stream)
+
+        async def worker():
+            nonlocal failed
+            while True:
+                try:
+                    scenario = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await runner.run(scenario)
+                except ConversationFailed:
+                    failed += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    turn_latencies = runner.latencies.get("chat", []) + runner.latencies.get("ask", [])
+    result: Dict[str, Any] = {
+        "mode": "scenarios",
+        "conversations": conversations,
+        "failed_conversations": failed,
+        "concurrency": concurrency,
+        "stream": stream,
+        "errors": sum(runner.errors.values()),
+        "errors_by_endpoint": runner.errors,
+        "elapsed_s": round(elapsed, 3),
+        "turns": runner.turns,
+        # A turn is one user message: a /chat or /ask request
+        "requests_per_s": round(len(turn_latencies) / elapsed, 2) if elapsed else 0.0,
+        **latency_summary(turn_latencies),
+        "endpoints": {endpoint: latency_summary(values) for endpoint, values in sorted(runner.latencies.items())},
+    }
+    if stream:
+        result["first_token"] = latency_summary(runner.first_token)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=("ask", "scenarios"), default="ask")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="Number of /ask calls (ask mode)")
+    parser.add_argument("--question", default="What discount do I get on glasses?")
+    parser.add_argument("--conversations", type=int, default=100, help="Number of conversations (scenarios mode)")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help="JSON file with scripted conversations")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming endpoints (scenarios mode)")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression of gated metrics (default: 0.2)")
+    parser.add_argument("--spawn", action="store_true", help="Start a stub Azure server and the backend locally")
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--stub-url", help="Stub server to read upstream call counts from "
+                                           "(default: the spawned one, or http://127.0.0.1:<stub-port>)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub LLM latency in seconds (with --spawn)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Stub latency jitter fraction (with --spawn)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Stub error rate (with --spawn)")
+    parser.add_argument("--error-status", type=int, default=429, help="Stub error status (with --spawn)")
+    parser.add_argument("--backend-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the spawned backend, e.g. RESPONSE_CACHE=off")
+    args = parser.parse_args()
+
+    stub_url = args.stub_url or f"http://127.0.0.1:{args.stub_port}"
+    scenarios: List[dict] = []
+    if args.mode == "scenarios":
+        with open(args.scenarios, "r", encoding="utf-8") as f:
+            scenarios = json.load(f)
+
+    def run() -> Dict[str, Any]:
+        before = stub_stats(stub_url)
+        if args.mode == "scenarios":
+            result = asyncio.run(run_scenarios(args.url, args.concurrency, args.conversations, scenarios, args.stream))
+        else:
+            result = asyncio.run(run_load(args.url, args.concurrency, args.requests, args.question))
+        upstream = upstream_report(before, stub_stats(stub_url), result["turns"])
+        if upstream is not None:
+            result["upstream"] = upstream
+        return result
+
+    if args.spawn:
+        port = int(args.url.rsplit(":", 1)[-1])
+        stub_args = ["--latency", str(args.latency), "--jitter", str(args.jitter),
+                     "--error-rate", str(args.error_rate), "--error-status", str(args.error_status)]
+        backend_env = dict(item.split("=", 1) for item in args.backend_env)
+        with spawn_stack(port, args.stub_port, stub_args, backend_env):
+            result = run()
+    else:
+        result = run()
+
+    report = json.dumps(result, indent=2, ensure_ascii=False)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            failures = check_regressions(result, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Throughput and latency of the Phase 1 form extraction pipeline.
+
+Generates `--documents` synthetic multi-page PDFs and runs them through
+`batch_extract.run_batch` (OCR, local pre-extraction and field extraction)
+against the stub Azure server, so no Document Intelligence or OpenAI quota is
+used. The result cache is disabled so every document reaches the stub.
+
+The JSON report has the same shape as `load_test.py`: documents per second,
+p50/p95/p99 of the per-document OCR + extraction time, per-stage latency, and
+the upstream calls and prompt tokens per document. `--baseline` gates
+regressions the same way.
+
+    python phase1_load_test.py --spawn --documents 40 --pages 3 --ocr-workers 8 --llm-workers 4
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from load_test import check_regressions, latency_summary, spawn_stub, stub_stats, upstream_report
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PHASE1_DIR = os.path.join(HERE, "..", "phase1_solution")
+
+
+def write_documents(directory: str, count: int, pages: int) -> List[str]:
+    """Blank PDFs with `pages` pages each; the stub returns the form text regardless of the content."""
+    from pypdf import PdfWriter  # phase1 optional dependency, required here
+
+    paths = []
+    for index in range(count):
+        writer = PdfWriter()
+        for _ in range(pages):
+            writer.add_blank_page(width=595, height=842)
+        # Distinct bytes per document, so nothing is deduplicated by content hash
+        writer.add_metadata({"/Title": f"benchmark-{index}"})
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        path = os.path.join(directory, f"form_{index:04d}.pdf")
+        with open(path, "wb") as f:
+            f.write(buffer.getvalue())
+        paths.append(path)
+    return paths
+
+
+def run_pipeline(stub_url: str, documents: int, pages: int, ocr_workers: int, llm_workers: int) -> Dict[str, Any]:
+    # extractor_core reads its configuration at import time
+    os.environ.update({
+        "AZURE_FORM_RECOGNIZER_ENDPOINT": stub_url,
+        "AZURE_FORM_RECOGNIZER_KEY": "stub",
+        "AZURE_OPENAI_ENDPOINT": stub_url,
+        "AZURE_OPENAI_API_KEY": "stub",
+        "EXTRACTOR_CACHE": "off",
+    })
+    sys.path.insert(0, PHASE1_DIR)
+    from batch_extract import run_batch
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_documents(directory, documents, pages)
+        output = os.path.join(directory, "results.jsonl")
+        started = time.perf_counter()
+        counts = run_batch(paths, output, ocr_workers, llm_workers)
+        elapsed = time.perf_counter() - started
+        with open(output, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+
+    ok = [record for record in records if record["status"] == "ok"]
+    ocr = [record["ocr_seconds"] for record in ok]
+    extract = [record["extract_seconds"] for record in ok]
+    return {
+        "mode": "phase1",
+        "documents": documents,
+        "pages_per_document": pages,
+        "ocr_workers": ocr_workers,
+        "llm_workers": llm_workers,
+        "errors": counts["error"],
+        "elapsed_s": round(elapsed, 3),
+        # A turn is one document, so the upstream figures are per document
+        "turns": documents,
+        "requests_per_s": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        **latency_summary([o + e for o, e in zip(ocr, extract)]),
+        "stages": {"ocr": latency_summary(ocr), "extract": latency_summary(extract)},
+        "llm_called": sum(1 for record in ok if record.get("llm", {}).get("llm_called")),
+        "prompt_tokens": sum(record.get("llm", {}).get("prompt_tokens", 0) for record in ok),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3, help="Pages per synthetic document")
+    parser.add_argument("--ocr-workers", type=int, default=8)
+    parser.add_argument("--llm-workers", type=int, default=4)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression of gated metrics (default: 0.2)")
+    parser.add_argument("--spawn", action="store_true", help="Start a stub Azure server locally")
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--stub-url", help="Stub server to use without --spawn (default: http://127.0.0.1:<stub-port>)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub LLM latency in seconds (with --spawn)")
+    parser.add_argument("--ocr-latency", type=float, default=1.0,
+                        help="Stub analyze operation latency in seconds (with --spawn)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Stub latency jitter fraction (with --spawn)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Stub error rate (with --spawn)")
+    parser.add_argument("--error-status", type=int, default=429, help="Stub error status (with --spawn)")
+    args = parser.parse_args()
+
+    def run(stub_url: str) -> Dict[str, Any]:
+        before = stub_stats(stub_url)
+        result = run_pipeline(stub_url, args.documents, args.pages, args.ocr_workers, args.llm_workers)
+        upstream = upstream_report(before, stub_stats(stub_url), result["turns"])
+        if upstream is not None:
+            result["upstream"] = upstream
+        return result
+
+    if args.spawn:
+        stub_args = ["--latency", str(args.latency), "--ocr-latency", str(args.ocr_latency),
+                     "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+                     "--error-status", str(args.error_status)]
+        with spawn_stub(args.stub_port, stub_args) as stub_url:
+            result = run(stub_url)
+    else:
+        result = run(args.stub_url or f"http://127.0.0.1:{args.stub_port}")
+
+    report = json.dumps(result, indent=2, ensure_ascii=False)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            failures = check_regressions(result, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
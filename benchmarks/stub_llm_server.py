@@ -0,0 +1,349 @@
+"""
+Local stand-in for the Azure OpenAI chat-completions API and the Azure
+Document Intelligence analyze API.
+
+Chat completions reply after a configurable delay with a canned answer
+(streamed as Server-Sent Events when `stream` is set, with a final usage chunk
+when `stream_options.include_usage` is set). Repeated prompt prefixes are
+reported as cached tokens, like the provider's prompt cache. Analyze requests
+return a long-running operation whose result is a small synthetic Hebrew form
+with one result page per requested page.
+
+Latency jitter and error injection (429 with a retry hint, or 500) are
+configurable, and GET /stub/stats counts the upstream calls and tokens the
+backend made, so the backend can be load tested without calling (or paying
+for) the real services. With `--rpm-limit` / `--tpm-limit`, each deployment
+enforces per-minute quotas like Azure OpenAI: responses carry
+`x-ratelimit-remaining-requests` / `-tokens`, and requests over quota get a
+429 with `retry-after-ms`.
+
+    python stub_llm_server.py --port 9100 --latency 0.5 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+LATENCY = float(os.getenv("STUB_LATENCY", "0.5"))
+# Uniform +/- jitter added to every delay, as a fraction of it
+JITTER = float(os.getenv("STUB_JITTER", "0.0"))
+# Delay between streamed chunks after the first one
+TOKEN_DELAY = float(os.getenv("STUB_TOKEN_DELAY", "0.02"))
+# Seconds an analyze operation stays "running" before its result is ready
+OCR_LATENCY = float(os.getenv("STUB_OCR_LATENCY", "1.0"))
+# Fraction of requests that fail, and how: 429 (throttled, with a retry hint) or 500
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0.0"))
+ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", "429"))
+# Per-deployment quotas over a sliding minute (0: unlimited); max_tokens counts against TPM, as on Azure
+RPM_LIMIT = int(os.getenv("STUB_RPM_LIMIT", "0"))
+TPM_LIMIT = int(os.getenv("STUB_TPM_LIMIT", "0"))
+# Prompt caching applies to prefixes of at least this many tokens, in steps of 128, as on Azure OpenAI
+CACHE_MIN_TOKENS = 1024
+
+app = FastAPI(title="Stub Azure OpenAI / Document Intelligence")
+
+_stats: Dict[str, int] = {}
+_prefixes: "OrderedDict[str, None]" = OrderedDict()
+# operation id -> (ready at, model id, page numbers)
+_operations: Dict[str, tuple] = {}
+# deployment -> (time, tokens) of the requests admitted in the last minute
+_windows: Dict[str, Deque[Tuple[float, int]]] = {}
+
+# (line, x, y) on an A4 page in inches; labels are followed by their value on the same row
+FORM_LINES = [
+    ("המוסד לביטוח לאומי", 3.0, 0.6),
+    ("בקשה למתן טיפול רפואי לנפגע עבודה - עצמאי", 2.0, 1.0),
+    ("שם משפחה", 6.5, 2.0), ("כהן", 5.5, 2.0),
+    ("שם פרטי", 4.0, 2.0), ("דוד", 3.2, 2.0),
+    ("מספר זהות", 6.5, 2.5), ("123456782", 5.0, 2.5),
+    ("תאריך לידה", 3.5, 2.5), ("01/02/1980", 2.2, 2.5),
+    ("טלפון נייד", 6.5, 3.0), ("0521234567", 5.0, 3.0),
+    ("תאריך הפגיעה", 6.5, 3.5), ("12/03/2024", 5.0, 3.5),
+    ("שעת הפגיעה", 3.5, 3.5), ("08:30", 2.6, 3.5),
+    ("תיאור התאונה", 6.5, 4.0), ("החלקתי במדרגות במפעל", 4.0, 4.0),
+]
+
+
+def _count(name: str, amount: int = 1) -> None:
+    _stats[name] = _stats.get(name, 0) + amount
+
+
+def _delay(seconds: float) -> float:
+    return max(0.0, seconds * (1 + random.uniform(-JITTER, JITTER)))
+
+
+def _injected_error(kind: str) -> Optional[JSONResponse]:
+    if ERROR_RATE <= 0 or random.random() >= ERROR_RATE:
+        return None
+    _count(f"{kind}_errors_injected")
+    if ERROR_STATUS == 429:
+        return JSONResponse(
+            {"error": {"code": "429", "message": "Rate limit is exceeded (stub)."}},
+            status_code=429, headers={"retry-after-ms": "200", "retry-after": "1"},
+        )
+    return JSONResponse({"error": {"code": "InternalServerError", "message": "Injected failure (stub)."}},
+                        status_code=ERROR_STATUS)
+
+
+def _rate_limit(deployment: str, tokens: int) -> Tuple[Dict[str, str], Optional[JSONResponse]]:
+    """Admit the request against the deployment's quota; returns its headers, or a 429 when over quota."""
+    if not RPM_LIMIT and not TPM_LIMIT:
+        return {}, None
+    now = time.monotonic()
+    window = _windows.setdefault(deployment, deque())
+    while window and window[0][0] <= now - 60:
+        window.popleft()
+    used_requests, used_tokens = len(window), sum(t for _, t in window)
+    over_rpm = RPM_LIMIT and used_requests + 1 > RPM_LIMIT
+    over_tpm = TPM_LIMIT and used_tokens + tokens > TPM_LIMIT and window
+    if over_rpm or over_tpm:
+        # Until enough of the window expires (the oldest request, at least)
+        wait = max(0.05, window[0][0] + 60 - now)
+        _count("chat_throttled")
+        return {}, JSONResponse(
+            {"error": {"code": "429", "message": "Requests to this deployment have exceeded the rate limit (stub)."}},
+            status_code=429, headers={"retry-after-ms": str(int(wait * 1000)), "retry-after": str(int(wait) + 1)},
+        )
+    window.append((now, tokens))
+    headers = {}
+    if RPM_LIMIT:
+        headers["x-ratelimit-remaining-requests"] = str(RPM_LIMIT - used_requests - 1)
+    if TPM_LIMIT:
+        headers["x-ratelimit-remaining-tokens"] = str(max(0, TPM_LIMIT - used_tokens - tokens))
+    return headers, None
+
+
+def _tokens(text: str) -> int:
+    # Same estimate the backend uses without tiktoken: about 4 UTF-8 bytes per token
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def _cached_tokens(messages: List[dict]) -> int:
+    """Tokens of the first message if an identical one was seen before (the provider's prompt cache)."""
+    if not messages:
+        return 0
+    first = str(messages[0].get("content", ""))
+    tokens = _tokens(first)
+    if tokens < CACHE_MIN_TOKENS:
+        return 0
+    key = hashlib.sha256(first.encode("utf-8")).hexdigest()
+    seen = key in _prefixes
+    _prefixes[key] = None
+    _prefixes.move_to_end(key)
+    while len(_prefixes) > 1000:
+        _prefixes.popitem(last=False)
+    return tokens // 128 * 128 if seen else 0
+
+
+def _usage(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def _completion(model: str, content: str, usage: dict) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": usage,
+    }
+
+
+async def _stream(model: str, content: str, usage: Optional[dict]):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    await asyncio.sleep(_delay(LATENCY))
+    for index, word in enumerate(content.split(" ")):
+        if index:
+            await asyncio.sleep(_delay(TOKEN_DELAY))
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": None,
+                         "delta": {"content": word if index == 0 else f" {word}"}}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    if usage is not None:
+        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": model, "choices": [], "usage": usage}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def _reply(body: dict) -> str:
+    if (body.get("response_format") or {}).get("type") in ("json_object", "json_schema"):
+        last = str((body.get("messages") or [{}])[-1].get("content", ""))
+        # Form extraction (Phase 1) expects an object; user detail extraction (Phase 2) answers "None"
+        return "{}" if "Schema:" in last else "None"
+    return "This is a stub answer from the local test server."
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    error = _injected_error("chat")
+    if error is not None:
+        await asyncio.sleep(_delay(LATENCY) / 10)
+        return error
+    messages = body.get("messages", [])
+    prompt_tokens = sum(_tokens(str(m.get("content", ""))) + 4 for m in messages)
+    headers, throttled = _rate_limit(deployment, prompt_tokens + (body.get("max_tokens") or 0))
+    if throttled is not None:
+        return throttled
+    cached_tokens = _cached_tokens(messages)
+    content = _reply(body)
+    usage = _usage(prompt_tokens, cached_tokens, _tokens(content))
+    _count("chat_calls")
+    _count(f"chat_calls:{deployment}")
+    _count("prompt_tokens", prompt_tokens)
+    _count("cached_tokens", cached_tokens)
+    if body.get("stream"):
+        _count("chat_streams")
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        return StreamingResponse(_stream(deployment, content, usage if include_usage else None),
+                                 media_type="text/event-stream", headers=headers)
+    await asyncio.sleep(_delay(LATENCY))
+    return JSONResponse(_completion(deployment, content, usage), headers=headers)
+
+
+@app.get("/openai/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "created": 0, "owned_by": "stub"}]}
+
+
+# --- Document Intelligence ---
+def _page_numbers(document: bytes, pages: Optional[str]) -> List[int]:
+    """Pages named by the `pages` parameter ("1-2,4"), or every page of the PDF."""
+    if pages:
+        numbers = []
+        for part in pages.split(","):
+            first, _, last = part.partition("-")
+            numbers.extend(range(int(first), int(last or first) + 1))
+        return numbers
+    count = len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", document)) if document.startswith(b"%PDF") else 0
+    return list(range(1, max(1, count) + 1))
+
+
+def _polygon(x: float, y: float, width: float) -> List[float]:
+    return [x, y, x + width, y, x + width, y + 0.2, x, y + 0.2]
+
+
+def _analyze_result(model_id: str, page_numbers: List[int]) -> dict:
+    pages, content = [], []
+    for number in page_numbers:
+        lines = []
+        for text, x, y in FORM_LINES:
+            span = {"offset": sum(len(part) + 1 for part in content), "length": len(text)}
+            content.append(text)
+            lines.append({"content": text, "polygon": _polygon(x, y, 0.12 * len(text)), "spans": [span]})
+        pages.append({
+            "pageNumber": number, "angle": 0, "width": 8.2639, "height": 11.6944, "unit": "inch",
+            "words": [], "lines": lines, "spans": [],
+            "selectionMarks": [{"state": "selected", "polygon": _polygon(6.8, 4.5, 0.15), "confidence": 0.9,
+                                "span": {"offset": 0, "length": 1}}],
+        })
+    return {
+        "apiVersion": "2023-07-31", "modelId": model_id, "stringIndexType": "textElements",
+        "content": "\n".join(content), "pages": pages, "paragraphs": [], "tables": [],
+        "keyValuePairs": [], "styles": [], "languages": [],
+    }
+
+
+@app.post("/formrecognizer/documentModels/{model_id}:analyze")
+async def analyze_document(model_id: str, request: Request, pages: Optional[str] = None):
+    document = await request.body()
+    error = _injected_error("analyze")
+    if error is not None:
+        return error
+    operation_id = uuid.uuid4().hex
+    _operations[operation_id] = (time.time() + _delay(OCR_LATENCY), model_id, _page_numbers(document, pages))
+    _count("analyze_calls")
+    location = f"{request.base_url}formrecognizer/documentModels/{model_id}/analyzeResults/{operation_id}"
+    # retry-after-ms lets the SDK poll faster than its default of every 5 seconds
+    return Response(status_code=202, headers={"operation-location": location, "retry-after-ms": "100"})
+
+
+@app.get("/formrecognizer/documentModels/{model_id}/analyzeResults/{operation_id}")
+async def analyze_result(model_id: str, operation_id: str):
+    _count("analyze_polls")
+    operation = _operations.get(operation_id)
+    if operation is None:
+        return JSONResponse({"error": {"code": "NotFound", "message": "Unknown operation."}}, status_code=404)
+    ready_at, model, page_numbers = operation
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    if time.time() < ready_at:
+        return JSONResponse({"status": "running", "createdDateTime": now, "lastUpdatedDateTime": now},
+                            headers={"retry-after-ms": "100"})
+    del _operations[operation_id]
+    _count("analyze_pages", len(page_numbers))
+    return {"status": "succeeded", "createdDateTime": now, "lastUpdatedDateTime": now,
+            "analyzeResult": _analyze_result(model, page_numbers)}
+
+
+@app.get("/formrecognizer/documentModels/{model_id}")
+async def get_document_model(model_id: str):
+    return {"modelId": model_id, "createdDateTime": "2023-07-31T00:00:00Z", "apiVersion": "2023-07-31",
+            "docTypes": {}}
+
+
+# --- Counters for the load driver ---
+@app.get("/stub/stats")
+async def stub_stats():
+    return dict(_stats)
+
+
+@app.post("/stub/reset")
+async def stub_reset():
+    _stats.clear()
+    _prefixes.clear()
+    _windows.clear()
+    return {"reset": True}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Seconds to wait before replying")
+    parser.add_argument("--jitter", type=float, default=JITTER,
+                        help="Random +/- variation of every delay, as a fraction of it")
+    parser.add_argument("--token-delay", type=float, default=TOKEN_DELAY, help="Seconds between streamed chunks")
+    parser.add_argument("--ocr-latency", type=float, default=OCR_LATENCY,
+                        help="Seconds before an analyze operation succeeds")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=ERROR_STATUS, choices=(429, 500, 503),
+                        help="Status code of injected failures")
+    parser.add_argument("--rpm-limit", type=int, default=RPM_LIMIT, help="Requests per minute per deployment (0: no limit)")
+    parser.add_argument("--tpm-limit", type=int, default=TPM_LIMIT, help="Tokens per minute per deployment (0: no limit)")
+    args = parser.parse_args()
+    RPM_LIMIT = args.rpm_limit
+    TPM_LIMIT = args.tpm_limit
+    LATENCY = args.latency
+    JITTER = args.jitter
+    TOKEN_DELAY = args.token_delay
+    OCR_LATENCY = args.ocr_latency
+    ERROR_RATE = args.error_rate
+    ERROR_STATUS = args.error_status
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
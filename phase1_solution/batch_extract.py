@@ -0,0 +1,213 @@
+"""
+Headless batch extraction of National Insurance forms.
+
+Reads PDFs/images from directories, glob patterns or a list of paths on stdin
+(one per line, so it can be fed from a queue consumer), runs OCR and field
+extraction concurrently and appends one JSON record per form to a JSONL file.
+
+The output file doubles as the checkpoint: records already written with
+status "ok" are skipped when the same command is run again, so an interrupted
+run resumes where it stopped.
+
+    python batch_extract.py forms/ --output results.jsonl --ocr-workers 8 --llm-workers 4
+    find /incoming -name '*.pdf' | python batch_extract.py - --output results.jsonl
+"""
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Iterable, Iterator, Optional, Set, Any
+from extractor_core import (
+    check_config,
+    analyze_layout,
+    extract_fields,
+    detect_language,
+    validate_data,
+    OCR_RELEVANT_PAGES_ONLY,
+    LOCAL_PREFILL,
+)
+from result_cache import ResultCache
+from ocr_pipeline import pages_to_text
+from form_template import prefill_fields
+from clients import get_registry
+from upstream import PRIORITY_BATCH
+from telemetry import DOCUMENTS, init_tracing, shutdown_tracing, span, start_metrics_server
+
+logger = logging.getLogger("form_extractor.batch")
+
+SUPPORTED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png")
+
+
+def iter_inputs(sources: Iterable[str]) -> Iterator[str]:
+    """Expand directories, glob patterns and "-" (paths on stdin) into file paths."""
+    for source in sources:
+        if source == "-":
+            for line in sys.stdin:
+                path = line.strip()
+                if path:
+                    yield path
+        elif os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for name in sorted(files):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif glob.has_magic(source):
+            for path in sorted(glob.glob(source, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+        else:
+            yield source
+
+
+def load_checkpoint(output_path: str) -> Set[str]:
+    """Sources that already have a successful record in the output file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if record.get("status") == "ok":
+                done.add(record["source"])
+    return done
+
+
+class JsonlWriter:
+    """Thread-safe, line-buffered JSONL appender; every record is flushed as soon as it is written."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def run_batch(paths: Iterable[str], output_path: str, ocr_workers: int, llm_workers: int,
+              include_ocr_text: bool = False, only_relevant: bool = False) -> Dict[str, int]:
+    # One pooled connection per worker thread
+    form_client, openai_client = get_registry(min_pool_size=max(ocr_workers, llm_workers)).clients()
+    cache = ResultCache.from_env()
+    done = load_checkpoint(output_path)
+    writer = JsonlWriter(output_path)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    counts_lock = threading.Lock()
+    # Bound the number of documents held in memory between the two stages
+    in_flight = threading.BoundedSemaphore(2 * (ocr_workers + llm_workers))
+
+    def finish(record: Dict[str, Any]) -> None:
+        # A failed write must not keep the slot, or the OCR stage eventually blocks for good
+        try:
+            DOCUMENTS.inc(outcome=record["status"])
+            with counts_lock:
+                counts[record["status"]] += 1
+            writer.write(record)
+        finally:
+            in_flight.release()
+
+    def extract_stage(record: Dict[str, Any], ocr_text: str, prefilled: Optional[Dict[str, Any]]) -> None:
+        try:
+            started = time.perf_counter()
+            usage: Dict[str, Any] = {}
+            data = extract_fields(openai_client, ocr_text, language=record["language"], cache=cache,
+                                  prefilled=prefilled, stats=usage, priority=PRIORITY_BATCH)
+            record["extract_seconds"] = round(time.perf_counter() - started, 3)
+            record["llm"] = usage
+            record["data"] = data
+            record["missing"] = validate_data(data, language=record["language"])
+            record["status"] = "ok"
+        except Exception as e:
+            logger.error(f"Extraction failed for {record['source']}: {e}")
+            record["status"], record["error"] = "error", f"extraction: {e}"
+        finish(record)
+
+    def ocr_stage(path: str) -> None:
+        record: Dict[str, Any] = {"source": path}
+        try:
+            with open(path, "rb") as f:
+                file_bytes = f.read()
+            record["sha256"] = hashlib.sha256(file_bytes).hexdigest()
+            started = time.perf_counter()
+            pages = analyze_layout(form_client, file_bytes, cache=cache, only_relevant=only_relevant)
+            ocr_text = pages_to_text(pages)
+            record["ocr_seconds"] = round(time.perf_counter() - started, 3)
+            record["language"] = detect_language(ocr_text)
+            prefilled = None
+            if LOCAL_PREFILL:
+                with span("prefill"):
+                    prefilled = prefill_fields(pages, record["language"])
+            if include_ocr_text:
+                record["ocr_text"] = ocr_text
+        except Exception as e:
+            logger.error(f"OCR failed for {path}: {e}")
+            record["status"], record["error"] = "error", f"ocr: {e}"
+            finish(record)
+            return
+        llm_pool.submit(extract_stage, record, ocr_text, prefilled)
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="extract") as llm_pool, \
+            ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix="ocr") as ocr_pool:
+        for path in paths:
+            if path in done:
+                counts["skipped"] += 1
+                continue
+            in_flight.acquire()
+            futures.append(ocr_pool.submit(ocr_stage, path))
+        # The OCR pool shuts down first (it is the inner context), so every
+        # extraction job has been submitted before the extraction pool drains.
+    writer.close()
+    for future in futures:
+        _raise_unexpected(future)
+    return counts
+
+
+def _raise_unexpected(future: Future) -> None:
+    error = future.exception()
+    if error is not None:
+        raise error
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Files, directories, glob patterns, or - to read paths from stdin")
+    parser.add_argument("--output", "-o", required=True, help="JSONL file to append results to (also the checkpoint)")
+    parser.add_argument("--ocr-workers", type=int, default=int(os.getenv("BATCH_OCR_WORKERS", "8")))
+    parser.add_argument("--llm-workers", type=int, default=int(os.getenv("BATCH_LLM_WORKERS", "4")))
+    parser.add_argument("--include-ocr-text", action="store_true", help="Store the OCR text in each record")
+    parser.add_argument("--relevant-pages-only", action="store_true", default=OCR_RELEVANT_PAGES_ONLY,
+                        help="OCR only the PDF pages whose text layer shows they belong to the form (needs pypdf)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("EXTRACTOR_METRICS_PORT", "0")),
+                        help="Serve Prometheus metrics on this port while the batch runs (default: off)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s %(message)s', level=logging.INFO)
+    check_config()
+    init_tracing()
+    start_metrics_server(args.metrics_port)
+    started = time.perf_counter()
+    counts = run_batch(iter_inputs(args.inputs), args.output, args.ocr_workers, args.llm_workers,
+                       include_ocr_text=args.include_ocr_text, only_relevant=args.relevant_pages_only)
+    shutdown_tracing()
+    logger.info(f"Finished in {time.perf_counter() - started:.1f}s: {counts['ok']} ok, "
+                f"{counts['error']} failed, {counts['skipped']} already done")
+
+
+if __name__ == "__main__":
+    main()
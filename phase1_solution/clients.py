@@ -0,0 +1,151 @@
+"""
+Process-wide registry of Azure clients.
+
+Both SDK clients are built once per process on first use and then shared by
+every Streamlit rerun, session and batch worker, so connections (and their TLS
+handshakes) are kept alive and reused. The SDKs are imported lazily: importing
+this module, or `extractor_core`, does not load `azure` or `openai`.
+"""
+import os
+import time
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+from extractor_core import (
+    AZURE_FORM_RECOGNIZER_ENDPOINT,
+    AZURE_FORM_RECOGNIZER_KEY,
+    AZURE_OPENAI_ENDPOINT,
+    AZURE_OPENAI_API_KEY,
+    OCR_MODEL,
+)
+from upstream import scheduler
+
+if TYPE_CHECKING:
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from openai import AzureOpenAI
+
+logger = logging.getLogger("form_extractor.clients")
+
+OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-07-01-preview")
+# Keep-alive connections held per upstream; raise them for wide batch runs
+POOL_CONNECTIONS = int(os.getenv("EXTRACTOR_POOL_CONNECTIONS", "10"))
+POOL_MAXSIZE = int(os.getenv("EXTRACTOR_POOL_MAXSIZE", "20"))
+CONNECT_TIMEOUT = float(os.getenv("EXTRACTOR_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("EXTRACTOR_READ_TIMEOUT", "120"))
+
+
+class ClientRegistry:
+    """Lazily built, thread-safe holder for the Document Intelligence and OpenAI clients."""
+
+    def __init__(self, pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._session = None
+        self._form_client: Optional["DocumentAnalysisClient"] = None
+        self._admin_client = None
+        self._openai_client: Optional["AzureOpenAI"] = None
+
+    def _requests_session(self):
+        if self._session is None:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                    pool_maxsize=self.pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    def _azure_kwargs(self) -> Dict[str, Any]:
+        from azure.core.credentials import AzureKeyCredential
+        from azure.core.pipeline.transport import RequestsTransport
+        transport = RequestsTransport(session=self._requests_session(), session_owner=False,
+                                      connection_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT)
+        return {
+            "endpoint": AZURE_FORM_RECOGNIZER_ENDPOINT,
+            "credential": AzureKeyCredential(AZURE_FORM_RECOGNIZER_KEY),
+            "transport": transport,
+        }
+
+    def form_recognizer(self) -> "DocumentAnalysisClient":
+        with self._lock:
+            if self._form_client is None:
+                logger.info("Initializing Document Intelligence client...")
+                from azure.ai.formrecognizer import DocumentAnalysisClient
+                self._form_client = DocumentAnalysisClient(**self._azure_kwargs())
+            return self._form_client
+
+    def openai(self) -> "AzureOpenAI":
+        with self._lock:
+            if self._openai_client is None:
+                logger.info("Initializing Azure OpenAI client...")
+                import httpx
+                from openai import AzureOpenAI, DefaultHttpxClient
+                http_client = DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=self.pool_maxsize,
+                                        max_keepalive_connections=self.pool_connections),
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    # Every response updates the rate-limit budget of its deployment
+                    event_hooks={"response": [scheduler.observe_response]},
+                )
+                self._openai_client = AzureOpenAI(
+                    api_key=AZURE_OPENAI_API_KEY,
+                    api_version=OPENAI_API_VERSION,
+                    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+                    http_client=http_client,
+                    # Retries are handled by extractor_core.with_retries
+                    max_retries=0,
+                )
+            return self._openai_client
+
+    def clients(self) -> Tuple["DocumentAnalysisClient", "AzureOpenAI"]:
+        return self.form_recognizer(), self.openai()
+
+    def health_check(self) -> Dict[str, Dict[str, Any]]:
+        """Make one cheap authenticated call to each upstream and report latency or the error."""
+        def probe(fn) -> Dict[str, Any]:
+            started = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+        def document_intelligence():
+            with self._lock:
+                if self._admin_client is None:
+                    from azure.ai.formrecognizer import DocumentModelAdministrationClient
+                    self._admin_client = DocumentModelAdministrationClient(**self._azure_kwargs())
+            self._admin_client.get_document_model(OCR_MODEL)
+
+        return {
+            "document_intelligence": probe(document_intelligence),
+            "openai": probe(lambda: self.openai().models.list()),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for client in (self._form_client, self._admin_client, self._openai_client):
+                if client is not None:
+                    client.close()
+            if self._session is not None:
+                self._session.close()
+            self._session = self._form_client = self._admin_client = self._openai_client = None
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(min_pool_size: int = 0) -> ClientRegistry:
+    """
+    The shared registry. `min_pool_size` lets a caller that runs many threads
+    (the batch CLI) ask for enough connections; it only applies on first use.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry(pool_connections=max(POOL_CONNECTIONS, min_pool_size),
+                                       pool_maxsize=max(POOL_MAXSIZE, min_pool_size))
+        return _registry
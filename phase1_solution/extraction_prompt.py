@@ -0,0 +1,198 @@
+"""
+Prompt construction and response parsing for the field-extraction call.
+
+Keeps the request small (compact schema, OCR text trimmed to the regions that
+mention the requested fields under a token budget), asks for schema-shaped
+JSON via JSON mode or structured outputs, and repairs truncated or fenced JSON
+locally instead of paying for another round-trip.
+"""
+import re
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("form_extractor.prompt")
+
+INSTRUCTIONS = ("Extract the following fields from the given form text. Return only JSON with keys exactly "
+                "as in the schema. Use empty string for missing fields.")
+
+_encoder = None
+_encoder_loaded = False
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when it is installed, otherwise a UTF-8 byte estimate (about 4 bytes per token)."""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken  # optional dependency
+            _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            logger.info("tiktoken is not available; estimating token counts from text length")
+    if _encoder is not None:
+        return len(_encoder.encode(text))
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def _label_words(key: str) -> str:
+    # "dateOfInjury" -> "date of injury"; Hebrew keys are the printed labels already
+    return re.sub(r"(?<=[a-z])(?=[A-Z])", " ", key).lower()
+
+
+def field_labels(schema: Dict[str, Any]) -> List[str]:
+    """Every field name of `schema` as printed on the form ("houseNumber" -> "house number")."""
+    labels = []
+    for key, val in schema.items():
+        labels.append(_label_words(key))
+        if isinstance(val, dict):
+            labels.extend(field_labels(val))
+    return [label for label in labels if len(label) > 2]
+
+
+def trim_to_budget(ocr_text: str, schema: Dict[str, Any], budget: int, window: int = 2) -> Tuple[str, int]:
+    """
+    Keep the OCR text within `budget` tokens. Lines near a label of a requested
+    field are kept first, then the remaining lines in reading order; the result
+    keeps the original order. Returns the text and the number of dropped lines.
+    """
+    if budget <= 0 or count_tokens(ocr_text) <= budget:
+        return ocr_text, 0
+    lines = ocr_text.splitlines()
+    labels = field_labels(schema)
+    near_label = set()
+    for index, line in enumerate(lines):
+        lowered = line.lower()
+        if any(label in lowered for label in labels):
+            near_label.update(range(max(0, index - window), min(len(lines), index + window + 1)))
+
+    kept, used = set(), 0
+    for index in sorted(near_label) + [i for i in range(len(lines)) if i not in near_label]:
+        cost = count_tokens(lines[index]) + 1
+        if used + cost > budget:
+            continue
+        kept.add(index)
+        used += cost
+    trimmed = "\n".join(line for index, line in enumerate(lines) if index in kept)
+    return trimmed, len(lines) - len(kept)
+
+
+def json_schema_for(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Strict JSON Schema for structured outputs: every key required, every leaf a string."""
+    return {
+        "type": "object",
+        "properties": {
+            key: json_schema_for(val) if isinstance(val, dict) else {"type": "string"}
+            for key, val in schema.items()
+        },
+        "required": list(schema),
+        "additionalProperties": False,
+    }
+
+
+def build_request(schema: Dict[str, Any], ocr_text: str, response_format: str) -> Dict[str, Any]:
+    """Keyword arguments for chat.completions.create (without model / max_tokens)."""
+    prompt = f"{INSTRUCTIONS}\nSchema: {json.dumps(schema, ensure_ascii=False, separators=(',', ':'))}\n\nForm Text:\n{ocr_text}"
+    request: Dict[str, Any] = {"messages": [{"role": "user", "content": prompt}]}
+    if response_format == "json_schema":
+        request["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "form_fields", "strict": True, "schema": json_schema_for(schema)},
+        }
+    elif response_format == "json_object":
+        request["response_format"] = {"type": "json_object"}
+    return request
+
+
+_TRAILING_COMMA = re.compile(r",\s*[}\]]")
+
+
+def _strings(text: str) -> List[bool]:
+    """For each character, whether it is inside a JSON string (quotes included)."""
+    inside, in_string, escaped = [], False, False
+    for char in text:
+        if in_string:
+            inside.append(True)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        else:
+            in_string = char == '"'
+            inside.append(in_string)
+    return inside
+
+
+def _drop_trailing_commas(text: str) -> str:
+    """Remove commas directly before a closing brace or bracket, leaving string values alone."""
+    inside = _strings(text)
+    return "".join(
+        char for i, char in enumerate(text)
+        if not (char == "," and not inside[i] and _TRAILING_COMMA.match(text, i))
+    )
+
+
+def _close(fragment: str) -> Optional[str]:
+    """Close any open objects/arrays at the end of `fragment`; None if it ends inside a string."""
+    stack, in_string, escaped = [], False, False
+    for char in fragment:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        # A string cut off by the token limit holds a partial value; never keep it
+        return None
+    return fragment + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> Optional[Any]:
+    """
+    Parse model output that may be wrapped in code fences, be followed by prose,
+    have trailing commas, or be cut off by the token limit. Returns None if
+    nothing usable is left.
+    """
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = _drop_trailing_commas(text[start:])
+    try:
+        return json.JSONDecoder().raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+    # Truncated output: close what is open, cutting back one item at a time until it parses
+    cut = len(text)
+    while cut > 0:
+        closed = _close(text[:cut].rstrip().rstrip(","))
+        try:
+            if closed is not None:
+                return json.loads(closed)
+        except json.JSONDecodeError:
+            pass
+        cut = text.rfind(",", 0, cut)
+    return None
+
+
+def conform_to_schema(schema: Dict[str, Any], data: Any) -> Dict[str, Any]:
+    """Keep only schema keys, fill missing ones with empty strings and stringify leaf values."""
+    data = data if isinstance(data, dict) else {}
+    result = {}
+    for key, val in schema.items():
+        if isinstance(val, dict):
+            result[key] = conform_to_schema(val, data.get(key))
+        else:
+            value = data.get(key, "")
+            result[key] = "" if value is None or isinstance(value, (dict, list)) else str(value)
+    return result
@@ -0,0 +1,369 @@
+import os
+import json
+import time
+import logging
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Dict, List, Any, Callable, Iterator, Optional, TypeVar
+from dotenv import load_dotenv
+from result_cache import ResultCache, sha256_hex, timed_get
+from ocr_pipeline import OcrPage, plan_jobs, pages_from_result, pages_to_text
+from extraction_prompt import build_request, conform_to_schema, count_tokens, repair_json, trim_to_budget
+from telemetry import FALLBACKS, LLM_TOKENS, RETRIES, span
+from upstream import PRIORITY_INTERACTIVE, backoff, retry_after, scheduler
+
+# The Azure and OpenAI SDKs are slow to import; they are loaded on first use
+# (see clients.py) so the Streamlit UI can paint before they are needed
+if TYPE_CHECKING:
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from openai import AzureOpenAI
+
+load_dotenv()
+
+logger = logging.getLogger("form_extractor")
+
+T = TypeVar("T")
+
+# Configuration - set these environment variables
+AZURE_FORM_RECOGNIZER_ENDPOINT = os.getenv("AZURE_FORM_RECOGNIZER_ENDPOINT")
+AZURE_FORM_RECOGNIZER_KEY = os.getenv("AZURE_FORM_RECOGNIZER_KEY")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+
+REQUIRED_CONFIG = ["AZURE_FORM_RECOGNIZER_ENDPOINT", "AZURE_FORM_RECOGNIZER_KEY",
+                   "AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY"]
+
+# Retry settings for throttled or transient upstream failures
+MAX_RETRIES = int(os.getenv("EXTRACTOR_MAX_RETRIES", "5"))
+RETRY_BASE_DELAY = float(os.getenv("EXTRACTOR_RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("EXTRACTOR_RETRY_MAX_DELAY", "60.0"))
+
+# Models and prompt version are part of every cache key; bump PROMPT_VERSION
+# whenever the extraction prompt or schema changes so stale results are not reused
+OCR_MODEL = "prebuilt-layout"
+EXTRACTION_MODEL = "gpt-4o"
+# Cheaper/faster deployment used when EXTRACTION_MODEL is out of budget, and for retries
+FALLBACK_MODEL = os.getenv("EXTRACTOR_FALLBACK_MODEL", "")
+PROMPT_VERSION = "2"
+
+# Extraction request shape: "json_schema" (structured outputs, needs API version
+# 2024-08-01-preview or later), "json_object" (JSON mode) or "text"
+EXTRACTION_RESPONSE_FORMAT = os.getenv("EXTRACTOR_RESPONSE_FORMAT", "json_object")
+# OCR text sent to the LLM is trimmed to the lines around the requested fields beyond this many tokens
+EXTRACTION_TOKEN_BUDGET = int(os.getenv("EXTRACTOR_PROMPT_TOKEN_BUDGET", "3000"))
+EXTRACTION_MAX_OUTPUT_TOKENS = int(os.getenv("EXTRACTOR_MAX_OUTPUT_TOKENS", "1024"))
+
+# Page-parallel OCR: PDFs are split into ranges of this many pages, analyzed concurrently
+OCR_PAGES_PER_JOB = int(os.getenv("EXTRACTOR_OCR_PAGES_PER_JOB", "2"))
+OCR_PARALLELISM = int(os.getenv("EXTRACTOR_OCR_PARALLELISM", "4"))
+# Skip pages whose text layer shows they are not part of the form (needs pypdf)
+OCR_RELEVANT_PAGES_ONLY = os.getenv("EXTRACTOR_OCR_RELEVANT_PAGES_ONLY", "false").lower() == "true"
+# Read validated fields (names, numbers, dates, checkboxes) from the layout before calling the LLM
+LOCAL_PREFILL = os.getenv("EXTRACTOR_LOCAL_PREFILL", "true").lower() == "true"
+# The keyValuePairs add-on improves local pre-extraction but is billed separately
+OCR_FEATURES = ["keyValuePairs"] if os.getenv("EXTRACTOR_OCR_KEY_VALUE_PAIRS", "false").lower() == "true" else []
+
+
+def check_config() -> None:
+    """Exit with a clear message if any required environment variable is missing."""
+    for var in REQUIRED_CONFIG:
+        if not globals().get(var):
+            logger.error(f"Environment variable {var} is not set.")
+            raise SystemExit(f"Missing config: {var}")
+
+# Retries with jittered exponential backoff
+def _retry_after(error: Exception) -> float:
+    response = getattr(error, "response", None)
+    return retry_after(getattr(response, "headers", None))
+
+
+def is_retryable(error: Exception) -> bool:
+    # Only called after a failed SDK call, so both SDKs are already imported
+    from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+    from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+    if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError,
+                          ServiceRequestError, ServiceResponseError)):
+        return True
+    if isinstance(error, HttpResponseError):
+        return error.status_code in (408, 429, 500, 502, 503, 504)
+    return False
+
+
+def with_retries(fn: Callable[[], T], what: str, max_retries: int = MAX_RETRIES,
+                 honor_retry_after: bool = True) -> T:
+    """
+    Call `fn`, retrying throttled and transient failures with jittered exponential
+    backoff. Calls made through the upstream scheduler pass `honor_retry_after=False`:
+    a 429 already pauses that deployment there, and a fallback deployment need not wait.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            hint = _retry_after(e) if honor_retry_after else 0.0
+            delay = backoff(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, hint)
+            attempt += 1
+            RETRIES.inc(call=what)
+            logger.warning(f"{what} failed ({type(e).__name__}), retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+# OCR via Azure Document Intelligence
+def iter_ocr_pages(client: "DocumentAnalysisClient", file_bytes: bytes,
+                   pages_per_job: int = OCR_PAGES_PER_JOB, parallelism: int = OCR_PARALLELISM,
+                   only_relevant: bool = OCR_RELEVANT_PAGES_ONLY) -> Iterator[OcrPage]:
+    """Yield OCR pages as soon as the job that contains them finishes (not in page order)."""
+    jobs = plan_jobs(file_bytes, pages_per_job, only_relevant)
+    logger.info(f"Submitting document for OCR in {len(jobs)} job(s)...")
+
+    def run_job(document: bytes, page_numbers: tuple) -> List[OcrPage]:
+        def run():
+            kwargs = {"features": OCR_FEATURES} if OCR_FEATURES else {}
+            with span("ocr_submit", pages=len(page_numbers)):
+                poller = client.begin_analyze_document(OCR_MODEL, document=document, **kwargs)
+            # Waiting for the analyze operation; the SDK polls until it completes
+            with span("ocr_poll", pages=len(page_numbers)):
+                return poller.result()
+        return pages_from_result(with_retries(run, "OCR"), page_numbers)
+
+    if len(jobs) == 1:
+        yield from run_job(*jobs[0])
+        return
+    pool = ThreadPoolExecutor(max_workers=min(parallelism, len(jobs)), thread_name_prefix="ocr-page")
+    try:
+        futures = [pool.submit(run_job, *job) for job in jobs]
+        for future in as_completed(futures):
+            yield from future.result()
+    finally:
+        # Do not start the remaining jobs if the caller stopped early or a job failed
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def analyze_layout(client: "DocumentAnalysisClient", file_bytes: bytes,
+                   cache: Optional[ResultCache] = None,
+                   on_page: Optional[Callable[[OcrPage], None]] = None,
+                   only_relevant: bool = OCR_RELEVANT_PAGES_ONLY) -> List[OcrPage]:
+    """
+    OCR a document and return its pages (lines, boxes, checkboxes) in page order.
+    `on_page` is called as each page lands; the return waits for the last page,
+    since the extraction reads the whole document in one call.
+    """
+    key = ResultCache.make_key("layout", sha256_hex(file_bytes), OCR_MODEL, ",".join(OCR_FEATURES),
+                               "relevant" if only_relevant else "all")
+    with span("cache_lookup"):
+        cached = timed_get(cache, key, "OCR")
+    if cached is not None:
+        return [OcrPage.from_dict(page) for page in cached["pages"]]
+    pages = []
+    for page in iter_ocr_pages(client, file_bytes, only_relevant=only_relevant):
+        pages.append(page)
+        if on_page is not None:
+            on_page(page)
+    pages.sort(key=lambda p: p.number)
+    logger.debug(f"OCR extracted {sum(len(p.lines) for p in pages)} lines from {len(pages)} page(s)")
+    if cache is not None:
+        cache.set(key, {"pages": [asdict(page) for page in pages]})
+    return pages
+
+
+def analyze_document(client: "DocumentAnalysisClient", file_bytes: bytes,
+                     cache: Optional[ResultCache] = None,
+                     on_page: Optional[Callable[[OcrPage], None]] = None,
+                     only_relevant: bool = OCR_RELEVANT_PAGES_ONLY) -> str:
+    """OCR a document and return its text in page order."""
+    return pages_to_text(analyze_layout(client, file_bytes, cache, on_page, only_relevant))
+
+# Generate JSON via Azure OpenAI
+def extract_fields(openai_client: "AzureOpenAI", ocr_text: str, language: str = "en",
+                   cache: Optional[ResultCache] = None,
+                   prefilled: Optional[Dict[str, Any]] = None,
+                   stats: Optional[Dict[str, Any]] = None,
+                   priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+    """
+    Extract the schema fields from OCR text. Fields already present in
+    `prefilled` (read locally from the layout) are kept as they are; the LLM is
+    only asked for the empty ones, and not called at all when none are left.
+    If given, `stats` is filled with the token counts and timing of the call.
+    The call waits in the upstream scheduler at `priority`.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(llm_called=False, prompt_tokens=0, completion_tokens=0)
+    schema = get_schema(language)
+    todo = empty_fields(schema, prefilled) if prefilled else schema
+    if not todo:
+        logger.info("All fields were filled locally; skipping the LLM call.")
+        return prefilled
+    # The OCR text is a pure function of the file bytes, so keying on it keeps
+    # the cache content-addressed without threading the file hash through
+    key = ResultCache.make_key("fields", sha256_hex(ocr_text.encode("utf-8")),
+                               EXTRACTION_MODEL, PROMPT_VERSION, language,
+                               EXTRACTION_RESPONSE_FORMAT, str(EXTRACTION_TOKEN_BUDGET),
+                               json.dumps(prefilled or {}, ensure_ascii=False, sort_keys=True))
+    with span("cache_lookup"):
+        cached = timed_get(cache, key, "Field extraction")
+    if cached is not None:
+        stats["cached"] = True
+        return cached
+    logger.info("Calling OpenAI for field extraction...")
+    # choose model
+    model = EXTRACTION_MODEL
+    # build prompt
+    with span("prompt_build"):
+        form_text, dropped = trim_to_budget(ocr_text, todo, EXTRACTION_TOKEN_BUDGET)
+        request = build_request(todo, form_text, EXTRACTION_RESPONSE_FORMAT)
+    stats.update(
+        prompt_tokens_estimate=count_tokens(request["messages"][0]["content"]),
+        dropped_lines=dropped,
+        requested_fields=count_fields(todo),
+    )
+    # Counted against the TPM budget the way Azure does: the prompt plus max_tokens
+    tokens = stats["prompt_tokens_estimate"] + EXTRACTION_MAX_OUTPUT_TOKENS
+    attempts = 0
+
+    def call():
+        nonlocal model, attempts
+        model = FALLBACK_MODEL if FALLBACK_MODEL and attempts else scheduler.choose(EXTRACTION_MODEL, tokens, FALLBACK_MODEL)
+        attempts += 1
+        if model != EXTRACTION_MODEL:
+            FALLBACKS.inc(model=EXTRACTION_MODEL, fallback=model)
+        with span("llm_queue"):
+            scheduler.acquire(model, tokens, priority)
+        try:
+            return openai_client.chat.completions.create(
+                model=model,
+                max_tokens=EXTRACTION_MAX_OUTPUT_TOKENS,
+                temperature=0,
+                **request
+            )
+        finally:
+            scheduler.release()
+
+    started = time.perf_counter()
+    with span("llm") as llm_span:
+        response = with_retries(call, "Field extraction", honor_retry_after=False)
+        stats["llm_called"] = True
+        stats["model"] = model
+        stats["llm_seconds"] = round(time.perf_counter() - started, 3)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            stats["prompt_tokens"] = usage.prompt_tokens
+            stats["completion_tokens"] = usage.completion_tokens
+            LLM_TOKENS.inc(usage.prompt_tokens, model=model, type="prompt")
+            LLM_TOKENS.inc(usage.completion_tokens, model=model, type="completion")
+        llm_span.set(model=model, prompt_tokens=stats["prompt_tokens"], completion_tokens=stats["completion_tokens"])
+    logger.info(f"Field extraction used {stats['prompt_tokens']} prompt / {stats['completion_tokens']} completion tokens")
+
+    content = response.choices[0].message.content or ""
+    with span("response_parse"):
+        parsed = repair_json(content)
+    if parsed is None:
+        logger.error(f"Could not parse the extraction response: {content[:200]!r}")
+        return prefilled or schema  # return what we have for resilience
+    try:
+        json.loads(content)
+    except json.JSONDecodeError:
+        stats["repaired"] = True
+        logger.warning("Extraction response was not valid JSON; repaired locally")
+    data = conform_to_schema(todo, parsed)
+    logger.info("Extracted JSON successfully.")
+    data = merge_fields(prefilled, data) if prefilled else conform_to_schema(schema, data)
+    # Truncated (repaired) and fallback answers are not cached, so a later run can get the full result
+    if cache is not None and not stats.get("repaired") and model == EXTRACTION_MODEL:
+        cache.set(key, data)
+    return data
+
+# detect language simple heuristic
+def detect_language(ocr_text: str) -> str:
+    return "he" if any("שם" in line for line in ocr_text.splitlines()) else "en"
+
+# Schema definitions
+def get_schema(language: str) -> Dict[str, Any]:
+    if language == "he":
+        return {
+            "שם משפחה": "",
+            "שם פרטי": "",
+            "מספר זהות": "",
+            "מין": "",
+            "תאריך לידה": {"יום": "", "חודש": "", "שנה": ""},
+            "כתובת": {"רחוב": "", "מספר בית": "", "כניסה": "", "דירה": "", "ישוב": "", "מיקוד": "", "תא דואר": ""},
+            "טלפון קווי": "",
+            "טלפון נייד": "",
+            "סוג העבודה": "",
+            "תאריך הפגיעה": {"יום": "", "חודש": "", "שנה": ""},
+            "שעת הפגיעה": "",
+            "מקום התאונה": "",
+            "כתובת מקום התאונה": "",
+            "תיאור התאונה": "",
+            "האיבר שנפגע": "",
+            "חתימה": "",
+            "תאריך מילוי הטופס": {"יום": "", "חודש": "", "שנה": ""},
+            "תאריך קבלת הטופס בקופה": {"יום": "", "חודש": "", "שנה": ""},
+            "למילוי ע\"י המוסד הרפואי": {"חבר בקופת חולים": "", "מהות התאונה": "", "אבחנות רפואיות": ""}
+        }
+    # default English
+    return {
+        "lastName": "",
+        "firstName": "",
+        "idNumber": "",
+        "gender": "",
+        "dateOfBirth": {"day": "", "month": "", "year": ""},
+        "address": {"street": "", "houseNumber": "", "entrance": "", "apartment": "", "city": "", "postalCode": "", "poBox": ""},
+        "landlinePhone": "",
+        "mobilePhone": "",
+        "jobType": "",
+        "dateOfInjury": {"day": "", "month": "", "year": ""},
+        "timeOfInjury": "",
+        "accidentLocation": "",
+        "accidentAddress": "",
+        "accidentDescription": "",
+        "injuredBodyPart": "",
+        "signature": "",
+        "formFillingDate": {"day": "", "month": "", "year": ""},
+        "formReceiptDateAtClinic": {"day": "", "month": "", "year": ""},
+        "medicalInstitutionFields": {"healthFundMember": "", "natureOfAccident": "", "medicalDiagnoses": ""}
+    }
+
+# Basic validation
+def validate_data(data: Dict[str, Any], language: str = "en") -> List[str]:
+    missing = []
+    def recurse(schema: Dict[str, Any], obj: Dict[str, Any], path: str = ""):
+        for key, val in schema.items():
+            current_path = f"{path}.{key}" if path else key
+            if isinstance(val, dict):
+                recurse(val, obj.get(key, {}), current_path)
+            else:
+                if not obj.get(key):
+                    missing.append(current_path)
+    with span("validation"):
+        recurse(get_schema(language), data)
+    return missing
+
+# Helpers for partially filled results
+def empty_fields(schema: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of `schema` whose values are still empty in `data`."""
+    todo = {}
+    for key, val in schema.items():
+        if isinstance(val, dict):
+            sub = empty_fields(val, data.get(key) or {})
+            if sub:
+                todo[key] = sub
+        elif not data.get(key):
+            todo[key] = val
+    return todo
+
+
+def merge_fields(base: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill the empty values of `base` from `extra`; values already in `base` win."""
+    merged = dict(base)
+    for key, val in extra.items():
+        if isinstance(val, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_fields(merged[key], val)
+        elif not merged.get(key):
+            merged[key] = val
+    return merged
+
+
+def count_fields(schema: Dict[str, Any]) -> int:
+    return sum(count_fields(val) if isinstance(val, dict) else 1 for val in schema.values())
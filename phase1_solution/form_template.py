@@ -0,0 +1,308 @@
+"""
+Template-based local extraction for the National Insurance work-injury form.
+
+Values are read from the Document Intelligence layout instead of asking the
+LLM: a field's value is the text under or next to its printed label (or the
+value of a matching key-value pair), and the gender, accident location and
+health fund checkbox groups are read from selection marks. Only fields whose
+value can be validated locally are filled: ID numbers with a valid check
+digit, phone numbers, postal codes, dates, times and single ticked checkboxes.
+Free text, names included, is left empty for the LLM: any word next to a label
+could pass for a name, and the local value would override the LLM's answer.
+"""
+import re
+import copy
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from extractor_core import get_schema
+from extraction_prompt import field_labels
+from ocr_pipeline import Box, OcrPage
+
+logger = logging.getLogger("form_extractor.template")
+
+Parser = Callable[[str], Optional[Any]]
+
+_DROP = re.compile(r"[.'\"׳״]")
+_BREAK = re.compile(r"[:,()_*|/\\-]")
+_LABEL_SEPARATORS = r"[\s.:'\"׳״,()_*|/\\-]*"
+_SPACES = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d")
+_DATE = re.compile(r"(?<!\d)(\d{1,2})\s*[./-]\s*(\d{1,2})\s*[./-]\s*(\d{4})(?!\d)")
+_TIME = re.compile(r"(?<!\d)(\d{1,2})\s*[:.]\s*(\d{2})(?!\d)")
+
+
+def _normalize(text: str) -> str:
+    return _SPACES.sub(" ", _BREAK.sub(" ", _DROP.sub("", text.lower()))).strip()
+
+
+def _contains(text: str, phrase: str) -> bool:
+    """Whole-word phrase match on normalized text."""
+    return f" {phrase} " in f" {text} "
+
+
+# --- Value parsers ---
+def _digits(text: str) -> str:
+    return "".join(_DIGITS.findall(text))
+
+
+def valid_id_checksum(digits: str) -> bool:
+    """Israeli ID check digit: alternate weights 1 and 2, digits of each product summed, total divisible by 10."""
+    number = digits.lstrip("0").zfill(9)
+    if len(number) != 9:
+        return False
+    total = sum(sum(divmod(int(d) * (1 + i % 2), 10)) for i, d in enumerate(number))
+    return total % 10 == 0
+
+
+def parse_id(text: str) -> Optional[str]:
+    """9 digits, or 10 boxes with a leading zero, holding a valid check digit."""
+    digits = _digits(text)
+    if not 9 <= len(digits) <= 10 or len(digits) != len(re.sub(r"[\s-]", "", text)):
+        return None
+    return digits if valid_id_checksum(digits) else None
+
+
+def parse_landline(text: str) -> Optional[str]:
+    digits = _digits(text)
+    return digits if re.fullmatch(r"0[2-489]\d{7}|07\d{8}", digits) else None
+
+
+def parse_mobile(text: str) -> Optional[str]:
+    digits = _digits(text)
+    return digits if re.fullmatch(r"05\d{8}", digits) else None
+
+
+def parse_postal_code(text: str) -> Optional[str]:
+    digits = _digits(text)
+    return digits if len(digits) in (5, 7) and len(digits) == len(re.sub(r"[\s-]", "", text)) else None
+
+
+def parse_date(text: str) -> Optional[Tuple[str, str, str]]:
+    match = _DATE.search(text)
+    if match:
+        day, month, year = match.groups()
+    else:
+        # Digits written one per box: "0 2 0 2 1 9 9 9"
+        digits = _digits(text)
+        if len(digits) != 8 or len(digits) < len(re.sub(r"\s", "", text)) - 2:
+            return None
+        day, month, year = digits[:2], digits[2:4], digits[4:]
+    if 1 <= int(day) <= 31 and 1 <= int(month) <= 12 and 1900 <= int(year) <= 2100:
+        return day.zfill(2), month.zfill(2), year
+    return None
+
+
+def parse_time(text: str) -> Optional[str]:
+    match = _TIME.search(text)
+    if match:
+        hours, minutes = match.groups()
+    else:
+        digits = _digits(text)
+        if len(digits) != 4 or len(digits) != len(text.strip()):
+            return None
+        hours, minutes = digits[:2], digits[2:]
+    if int(hours) <= 23 and int(minutes) <= 59:
+        return f"{int(hours):02d}:{minutes}"
+    return None
+
+
+# --- Templates ---
+# schema path -> (printed labels, parser); dates are split into the schema's day/month/year keys
+TEXT_FIELDS: Dict[str, Dict[Tuple[str, ...], Tuple[Tuple[str, ...], Parser]]] = {
+    "he": {
+        ("מספר זהות",): (("מספר זהות", "מס זהות", "תז"), parse_id),
+        ("תאריך לידה",): (("תאריך לידה",), parse_date),
+        ("כתובת", "מיקוד"): (("מיקוד",), parse_postal_code),
+        ("טלפון קווי",): (("טלפון קווי",), parse_landline),
+        ("טלפון נייד",): (("טלפון נייד",), parse_mobile),
+        ("תאריך הפגיעה",): (("תאריך הפגיעה",), parse_date),
+        ("שעת הפגיעה",): (("שעת הפגיעה",), parse_time),
+        ("תאריך מילוי הטופס",): (("תאריך מילוי הטופס",), parse_date),
+        ("תאריך קבלת הטופס בקופה",): (("תאריך קבלת הטופס בקופה",), parse_date),
+    },
+    "en": {
+        ("idNumber",): (("id number", "identity number", "id no"), parse_id),
+        ("dateOfBirth",): (("date of birth",), parse_date),
+        ("address", "postalCode"): (("postal code", "zip code"), parse_postal_code),
+        ("landlinePhone",): (("landline phone", "landline"), parse_landline),
+        ("mobilePhone",): (("mobile phone", "mobile"), parse_mobile),
+        ("dateOfInjury",): (("date of injury",), parse_date),
+        ("timeOfInjury",): (("time of injury",), parse_time),
+        ("formFillingDate",): (("date of filling", "form filling date", "date of filling the form"), parse_date),
+        ("formReceiptDateAtClinic",): (("date of receipt", "date the form was received", "receipt date"), parse_date),
+    },
+}
+
+# schema path -> {printed option: value}; the "other" options need free text, so they are left to the LLM
+CHECKBOX_FIELDS: Dict[str, Dict[Tuple[str, ...], Dict[str, str]]] = {
+    "he": {
+        ("מין",): {"זכר": "זכר", "נקבה": "נקבה"},
+        ("מקום התאונה",): {
+            "במפעל": "במפעל",
+            "ת דרכים בעבודה": "ת. דרכים בעבודה",
+            "ת דרכים בדרך לעבודה/מהעבודה": "ת. דרכים בדרך לעבודה/מהעבודה",
+            "תאונה בדרך ללא רכב": "תאונה בדרך ללא רכב",
+        },
+        ("למילוי ע\"י המוסד הרפואי", "חבר בקופת חולים"): {
+            "כללית": "כללית", "מאוחדת": "מאוחדת", "מכבי": "מכבי", "לאומית": "לאומית",
+        },
+    },
+    "en": {
+        ("gender",): {"male": "male", "female": "female"},
+        ("accidentLocation",): {
+            "at the workplace": "at the workplace",
+            "traffic accident at work": "traffic accident at work",
+            "traffic accident on the way to/from work": "traffic accident on the way to/from work",
+            "accident on the way without a vehicle": "accident on the way without a vehicle",
+        },
+        ("medicalInstitutionFields", "healthFundMember"): {
+            "clalit": "clalit", "meuhedet": "meuhedet", "maccabi": "maccabi", "leumit": "leumit",
+        },
+    },
+}
+
+
+# --- Geometry ---
+def _height(box: Box) -> float:
+    return max(box[3] - box[1], 1e-6)
+
+
+def _same_row(a: Box, b: Box) -> bool:
+    overlap = min(a[3], b[3]) - max(a[1], b[1])
+    return overlap > 0.5 * min(_height(a), _height(b))
+
+
+def _horizontal_gap(a: Box, b: Box) -> float:
+    return max(0.0, max(a[0], b[0]) - min(a[2], b[2]))
+
+
+def _after_label(text: str, label: str) -> str:
+    """The original text that follows `label` on the same line ("ת.ז. 123456789" -> "123456789")."""
+    pattern = _LABEL_SEPARATORS.join(re.escape(c) for c in label.replace(" ", ""))
+    match = re.search(pattern + _LABEL_SEPARATORS, text, re.IGNORECASE)
+    return text[match.end():].strip() if match else ""
+
+
+def _candidates(page: OcrPage, index: int, label: str, language: str) -> List[str]:
+    """Text that may hold the value of the label on line `index`, nearest first."""
+    found = []
+    remainder = _after_label(page.lines[index], label)
+    if remainder:
+        found.append(remainder)
+    if not page.boxes:
+        return found
+    box = page.boxes[index]
+    height = _height(box)
+    # Boxes written under the label
+    below = [
+        (other[1] - box[3], i) for i, other in enumerate(page.boxes)
+        if i != index and 0 <= other[1] - box[1] and other[1] - box[3] <= 2 * height
+        and not _same_row(box, other) and _horizontal_gap(box, other) <= height
+    ]
+    # Values on the same row, in reading direction (to the left of a Hebrew label)
+    if language == "he":
+        beside = [(box[0] - other[2], i) for i, other in enumerate(page.boxes)
+                  if i != index and _same_row(box, other) and other[2] <= box[0] + height]
+    else:
+        beside = [(other[0] - box[2], i) for i, other in enumerate(page.boxes)
+                  if i != index and _same_row(box, other) and other[0] >= box[2] - height]
+    found += [page.lines[i] for _, i in sorted(below)]
+    found += [page.lines[i] for _, i in sorted(beside)]
+    return found
+
+
+def _set_path(data: Dict[str, Any], path: Tuple[str, ...], value: Any) -> None:
+    for key in path[:-1]:
+        data = data[key]
+    data[path[-1]] = value
+
+
+class FormTemplate:
+    """Reads the fields of one language version of the form from OCR pages."""
+
+    def __init__(self, language: str):
+        self.language = language
+        self.text_fields = TEXT_FIELDS.get(language, TEXT_FIELDS["en"])
+        self.checkbox_fields = CHECKBOX_FIELDS.get(language, CHECKBOX_FIELDS["en"])
+        self._labels = [label for labels, _ in self.text_fields.values() for label in labels]
+        self._labels += [option for options in self.checkbox_fields.values() for option in options]
+        # The labels of the fields left to the LLM (street, city, first name...) are never values either
+        self._labels += [_normalize(label) for label in field_labels(get_schema(language))]
+
+    def _is_label(self, text: str) -> bool:
+        normalized = _normalize(text)
+        return any(_contains(normalized, label) for label in self._labels)
+
+    def _assign(self, data: Dict[str, Any], path: Tuple[str, ...], value: Any) -> None:
+        if isinstance(value, tuple):
+            # Dates: (day, month, year) into the schema's own sub-keys
+            slot = data
+            for key in path:
+                slot = slot[key]
+            for key, part in zip(slot.keys(), value):
+                slot[key] = part
+        else:
+            _set_path(data, path, value)
+
+    def _read_text_fields(self, pages: Sequence[OcrPage], data: Dict[str, Any]) -> List[Tuple[str, ...]]:
+        filled = []
+        for path, (labels, parser) in self.text_fields.items():
+            value = None
+            # Key-value pairs from Document Intelligence are the most reliable source
+            for page in pages:
+                for key, text in page.key_values:
+                    if value is None and any(_contains(_normalize(key), label) for label in labels):
+                        value = parser(text)
+            for page in pages:
+                for index, line in enumerate(page.lines):
+                    if value is not None:
+                        break
+                    normalized = _normalize(line)
+                    label = next((l for l in labels if _contains(normalized, l)), None)
+                    if label is None:
+                        continue
+                    for candidate in _candidates(page, index, label, self.language):
+                        # Skip neighbouring labels, but not the text after this label on its own line
+                        if self._is_label(candidate) and candidate not in line:
+                            continue
+                        value = parser(candidate)
+                        if value is not None:
+                            break
+            if value is not None:
+                self._assign(data, path, value)
+                filled.append(path)
+        return filled
+
+    def _read_checkboxes(self, pages: Sequence[OcrPage], data: Dict[str, Any]) -> List[Tuple[str, ...]]:
+        selected_labels = []
+        for page in pages:
+            for state, mark in page.marks:
+                if state != "selected" or not page.boxes:
+                    continue
+                row = [(_horizontal_gap(mark, box), i) for i, box in enumerate(page.boxes) if _same_row(mark, box)]
+                if row:
+                    selected_labels.append(_normalize(page.lines[min(row)[1]]))
+
+        filled = []
+        for path, options in self.checkbox_fields.items():
+            chosen = set()
+            for label in selected_labels:
+                matches = [option for option in options if _contains(label, _normalize(option))]
+                # A line holding several options cannot tell which one was ticked
+                if len(matches) == 1:
+                    chosen.add(options[matches[0]])
+            if len(chosen) == 1:
+                _set_path(data, path, chosen.pop())
+                filled.append(path)
+        return filled
+
+    def extract(self, pages: Sequence[OcrPage]) -> Dict[str, Any]:
+        data = copy.deepcopy(get_schema(self.language))
+        filled = self._read_text_fields(pages, data) + self._read_checkboxes(pages, data)
+        logger.info(f"Template filled {len(filled)} field(s) locally: {['.'.join(p) for p in filled]}")
+        return data
+
+
+def prefill_fields(pages: Sequence[OcrPage], language: str) -> Dict[str, Any]:
+    """Schema-shaped dict with every field that could be read locally; the rest are empty strings."""
+    return FormTemplate(language).extract(pages)
@@ -0,0 +1,151 @@
+"""
+Page planning for the OCR pipeline.
+
+Multi-page PDFs are split into small page ranges so Document Intelligence can
+analyze them concurrently. `pypdf` is optional: without it (or for images)
+the document is sent as a single job, exactly as before.
+"""
+import io
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("form_extractor.ocr")
+
+# Text that appears on the pages carrying the form fields (Hebrew and English versions)
+FORM_PAGE_MARKERS = (
+    "ביטוח לאומי", "המוסד לביטוח", "שם משפחה", "מספר זהות", "תאריך הפגיעה", "פגיעה בעבודה",
+    "national insurance", "last name", "id number", "date of injury", "work injury",
+)
+# Pages whose text layer is shorter than this are treated as scanned images
+MIN_TEXT_LAYER_CHARS = 20
+
+
+# (x0, y0, x1, y1) in the page's own unit (pixels or inches)
+Box = Tuple[float, float, float, float]
+
+
+@dataclass
+class OcrPage:
+    """One analyzed page; `number` is 1-based within the original document. JSON-serializable."""
+    number: int
+    lines: List[str]
+    # Parallel to `lines`
+    boxes: List[Box] = field(default_factory=list)
+    # (state, box) of every checkbox on the page; state is "selected" or "unselected"
+    marks: List[Tuple[str, Box]] = field(default_factory=list)
+    # (key, value) pairs from the keyValuePairs add-on, when it is enabled
+    key_values: List[Tuple[str, str]] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "OcrPage":
+        return cls(
+            number=data["number"],
+            lines=data["lines"],
+            boxes=[tuple(b) for b in data.get("boxes", [])],
+            marks=[(state, tuple(b)) for state, b in data.get("marks", [])],
+            key_values=[tuple(kv) for kv in data.get("key_values", [])],
+        )
+
+
+def bounding_box(polygon) -> Box:
+    xs = [p.x for p in polygon] or [0.0]
+    ys = [p.y for p in polygon] or [0.0]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def pages_from_result(result, page_numbers: Sequence[int] = ()) -> List[OcrPage]:
+    """Convert an SDK AnalyzeResult; `page_numbers` maps sub-document pages back to the original."""
+    def original(number: int) -> int:
+        return page_numbers[number - 1] if page_numbers else number
+
+    key_values: Dict[int, List[Tuple[str, str]]] = {}
+    for pair in getattr(result, "key_value_pairs", None) or []:
+        if pair.key is None or pair.value is None or not pair.key.bounding_regions:
+            continue
+        number = original(pair.key.bounding_regions[0].page_number)
+        key_values.setdefault(number, []).append((pair.key.content, pair.value.content))
+
+    pages = []
+    for page in result.pages:
+        number = original(page.page_number)
+        pages.append(OcrPage(
+            number=number,
+            lines=[line.content for line in page.lines],
+            boxes=[bounding_box(line.polygon or []) for line in page.lines],
+            marks=[(mark.state, bounding_box(mark.polygon or [])) for mark in page.selection_marks or []],
+            key_values=key_values.get(number, []),
+        ))
+    return pages
+
+
+def pages_to_text(pages: Sequence[OcrPage]) -> str:
+    return "\n".join(line for page in sorted(pages, key=lambda p: p.number) for line in page.lines)
+
+
+def _load_pdf(file_bytes: bytes):
+    if not file_bytes.startswith(b"%PDF"):
+        return None
+    try:
+        from pypdf import PdfReader  # optional dependency
+    except ImportError:
+        logger.info("pypdf is not installed; sending the PDF as a single OCR job")
+        return None
+    try:
+        return PdfReader(io.BytesIO(file_bytes))
+    except Exception as e:
+        logger.warning(f"Could not read PDF locally ({e}); sending it as a single OCR job")
+        return None
+
+
+def probe_relevant_pages(reader) -> Optional[List[int]]:
+    """
+    Cheap local probe of the PDF text layer. Returns the 1-based pages that
+    mention the form, plus pages without a usable text layer (scans, which
+    cannot be judged locally). Returns None when nothing can be decided.
+    """
+    relevant, decided = [], False
+    for number, page in enumerate(reader.pages, start=1):
+        try:
+            text = (page.extract_text() or "").lower()
+        except Exception:
+            text = ""
+        if len(text.strip()) < MIN_TEXT_LAYER_CHARS:
+            relevant.append(number)
+        elif any(marker in text for marker in FORM_PAGE_MARKERS):
+            relevant.append(number)
+            decided = True
+    return relevant if decided else None
+
+
+def _ranges(pages: Sequence[int], pages_per_job: int) -> List[Tuple[int, ...]]:
+    return [tuple(pages[i:i + pages_per_job]) for i in range(0, len(pages), pages_per_job)]
+
+
+def plan_jobs(file_bytes: bytes, pages_per_job: int, only_relevant: bool) -> List[Tuple[bytes, Tuple[int, ...]]]:
+    """
+    Split a document into OCR jobs. Each job is (document bytes, original page
+    numbers it contains); an empty page tuple means "the whole document".
+    """
+    reader = _load_pdf(file_bytes)
+    if reader is None:
+        return [(file_bytes, ())]
+    pages = list(range(1, len(reader.pages) + 1))
+    if only_relevant:
+        selected = probe_relevant_pages(reader)
+        if selected:
+            logger.info(f"Text-layer probe selected pages {selected} of {len(pages)}")
+            pages = selected
+    if len(pages) <= pages_per_job and len(pages) == len(reader.pages):
+        return [(file_bytes, ())]
+
+    from pypdf import PdfWriter
+    jobs = []
+    for page_range in _ranges(pages, pages_per_job):
+        writer = PdfWriter()
+        for number in page_range:
+            writer.add_page(reader.pages[number - 1])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        jobs.append((buffer.getvalue(), page_range))
+    return jobs
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Optional
+
+logger = logging.getLogger("form_extractor.cache")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed disk cache for OCR results and field extractions.
+
+    Entries are JSON files named by a SHA-256 key and spread over 256
+    sub-directories. Reads touch the file's mtime, and when the total size
+    goes over `max_bytes` the least recently used entries are deleted.
+    Writes go to a temporary file first, so concurrent readers (Streamlit
+    sessions, batch workers) never see partial entries.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultCache"]:
+        if os.getenv("EXTRACTOR_CACHE", "on") == "off":
+            return None
+        return cls(
+            cache_dir=os.getenv("EXTRACTOR_CACHE_DIR", DEFAULT_CACHE_DIR),
+            max_bytes=int(float(os.getenv("EXTRACTOR_CACHE_MAX_MB", "512")) * 1024 * 1024),
+        )
+
+    @staticmethod
+    def make_key(kind: str, *parts: str) -> str:
+        return sha256_hex("\0".join((kind,) + parts).encode("utf-8"))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def _disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        # Drop least recently used entries until we are 10% under the limit
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._size = total
+        logger.info(f"Evicted {removed} cache entries, {total / 1024 / 1024:.1f} MB in use")
+
+
+def timed_get(cache: Optional[ResultCache], key: str, what: str) -> Optional[Any]:
+    if cache is None:
+        return None
+    started = time.perf_counter()
+    value = cache.get(key)
+    if value is not None:
+        logger.info(f"{what} cache hit ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    return value
@@ -0,0 +1,75 @@
+"""
+Per-stage timing, token and retry metrics for the extractor, in the
+Prometheus text format, with optional OpenTelemetry tracing.
+
+`span("stage")` times a block of work into `extractor_stage_seconds` and, when
+EXTRACTOR_TRACING=otel, into an OpenTelemetry span exported over OTLP. Set
+EXTRACTOR_METRICS_PORT to serve the metrics on `/metrics` from a background
+thread (the Streamlit app and the batch CLI have no HTTP API of their own).
+The metric types are shared with the Phase 2 backend (`shared/telemetry.py`
+at the repository root).
+"""
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from shared.telemetry import DEFAULT_BUCKETS, Registry, Tracer
+
+logger = logging.getLogger("form_extractor.telemetry")
+
+METRICS_ENABLED = os.getenv("EXTRACTOR_METRICS", "true").lower() == "true"
+# "off" or "otel" (needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http)
+TRACING = os.getenv("EXTRACTOR_TRACING", "off")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "form-extractor")
+
+# Up to long OCR jobs
+registry = Registry(enabled=METRICS_ENABLED, buckets=DEFAULT_BUCKETS + (120.0,))
+
+STAGE_SECONDS = registry.histogram(
+    "extractor_stage_seconds", "Time spent in each stage of processing a document", ("stage",))
+LLM_TOKENS = registry.counter(
+    "extractor_llm_tokens_total", "Tokens reported by the provider (type: prompt, completion)", ("model", "type"))
+RETRIES = registry.counter(
+    "extractor_retries_total", "Upstream calls retried after a throttled or transient failure", ("call",))
+FALLBACKS = registry.counter(
+    "extractor_llm_fallbacks_total", "Extraction calls moved to the fallback deployment", ("model", "fallback"))
+DOCUMENTS = registry.counter(
+    "extractor_documents_total", "Documents processed, by outcome", ("outcome",))
+
+tracer = Tracer(TRACING, OTEL_SERVICE_NAME, STAGE_SECONDS, setting="EXTRACTOR_TRACING")
+init_tracing = tracer.init
+shutdown_tracing = tracer.shutdown
+span = tracer.span
+trace = tracer.trace
+
+
+# --- Metrics endpoint ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """Serve `/metrics` on a daemon thread; returns None when metrics are off or the port is 0."""
+    if not METRICS_ENABLED or not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
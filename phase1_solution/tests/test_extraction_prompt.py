@@ -0,0 +1,46 @@
+import pytest
+
+from extraction_prompt import conform_to_schema, repair_json
+
+SCHEMA = {"lastName": "", "dateOfBirth": {"day": "", "month": "", "year": ""}}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": "1"}', {"a": "1"}),
+    ('```json\n{"a": "1"}\n```', {"a": "1"}),
+    ('Here is the JSON:\n{"a": "1"}\nLet me know if you need anything else.', {"a": "1"}),
+    ('{"a": "1", "b": {"c": "2",},}', {"a": "1", "b": {"c": "2"}}),
+    ('{"a": ["1", "2",]}', {"a": ["1", "2"]}),
+    ('{"שם משפחה": "כהן", "שם פרטי": "דנה"}', {"שם משפחה": "כהן", "שם פרטי": "דנה"}),
+])
+def test_repairs_wrapped_and_trailing_comma_output(text, expected):
+    assert repair_json(text) == expected
+
+
+def test_commas_inside_strings_are_kept():
+    text = '{"accidentDescription": "slipped, fell,}", "injuredBodyPart": "hand, wrist",}'
+    assert repair_json(text) == {"accidentDescription": "slipped, fell,}", "injuredBodyPart": "hand, wrist"}
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Cut off inside a value: the partial value is dropped, never kept
+    ('{"lastName": "Cohen", "firstName": "Da', {"lastName": "Cohen"}),
+    ('{"lastName": "Cohen", "dateOfBirth": {"day": "02", "month": "0', {"lastName": "Cohen", "dateOfBirth": {"day": "02"}}),
+    # Cut off after a key or between items
+    ('{"lastName": "Cohen", "firstName":', {"lastName": "Cohen"}),
+    ('{"lastName": "Cohen", "dateOfBirth": {"day": "02"},', {"lastName": "Cohen", "dateOfBirth": {"day": "02"}}),
+    ('{"note": "a, b", "lastName": "Co', {"note": "a, b"}),
+])
+def test_truncated_output_keeps_the_complete_values(text, expected):
+    assert repair_json(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '{"lastName": "Coh', "```json\n```"])
+def test_nothing_usable(text):
+    assert repair_json(text) is None
+
+
+def test_conform_to_schema():
+    data = {"lastName": 42, "extra": "x", "dateOfBirth": {"day": None, "month": ["1"], "year": "1999"}}
+    assert conform_to_schema(SCHEMA, data) == {"lastName": "42", "dateOfBirth": {"day": "", "month": "", "year": "1999"}}
+    assert conform_to_schema(SCHEMA, ["not", "an", "object"]) == {"lastName": "", "dateOfBirth": {"day": "", "month": "", "year": ""}}
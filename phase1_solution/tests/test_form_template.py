@@ -0,0 +1,95 @@
+import pytest
+
+from form_template import FormTemplate, parse_date, parse_id, parse_time, prefill_fields
+from ocr_pipeline import OcrPage
+
+
+def layout(*lines, marks=()):
+    """One page from (text, (x0, y0, x1, y1)) lines, in inches like Document Intelligence's PDF output."""
+    return OcrPage(number=1, lines=[text for text, _ in lines], boxes=[box for _, box in lines], marks=list(marks))
+
+
+# Top of the Hebrew form as Document Intelligence returns it: labels on the right, values under them
+# or to their left, the ID written one digit per box and empty fields followed by the next row's labels
+HEBREW_FORM = layout(
+    ("שם משפחה", (6.2, 1.0, 7.0, 1.2)), ("שם פרטי", (4.6, 1.0, 5.3, 1.2)), ("ת.ז.", (2.6, 1.0, 3.0, 1.2)),
+    ("כהן", (6.3, 1.3, 6.9, 1.5)), ("0 1 2 3 4 5 6 7 8 2", (1.8, 1.3, 3.0, 1.5)),
+    ("רחוב", (6.3, 1.55, 7.0, 1.75)), ("ישוב", (4.7, 1.55, 5.1, 1.75)), ("מיקוד", (2.6, 1.55, 3.0, 1.75)),
+    ("הרצל", (6.3, 1.85, 6.9, 2.05)), ("חיפה", (4.7, 1.85, 5.1, 2.05)), ("3100001", (2.4, 1.85, 3.0, 2.05)),
+    ("תאריך לידה", (6.0, 2.3, 7.0, 2.5)), ("0 2 0 2 1 9 9 9", (4.4, 2.3, 5.8, 2.5)),
+    ("טלפון קווי", (6.0, 2.8, 7.0, 3.0)), ("טלפון נייד", (3.6, 2.8, 4.6, 3.0)),
+    ("0501234567", (3.6, 3.1, 4.5, 3.3)),
+    ("מין", (6.6, 3.5, 7.0, 3.7)), ("זכר", (5.8, 3.5, 6.2, 3.7)), ("נקבה", (4.8, 3.5, 5.3, 3.7)),
+    marks=[("unselected", (6.25, 3.52, 6.4, 3.68)), ("selected", (5.35, 3.52, 5.5, 3.68))],
+)
+
+
+@pytest.fixture(scope="module")
+def hebrew():
+    return prefill_fields([HEBREW_FORM], "he")
+
+
+def test_validated_fields_are_read_from_the_layout(hebrew):
+    assert hebrew["מספר זהות"] == "0123456782"
+    assert hebrew["תאריך לידה"] == {"יום": "02", "חודש": "02", "שנה": "1999"}
+    assert hebrew["כתובת"]["מיקוד"] == "3100001"
+    assert hebrew["טלפון נייד"] == "0501234567"
+    assert hebrew["מין"] == "נקבה"
+
+
+def test_names_and_free_text_are_left_to_the_llm(hebrew):
+    # "כהן" sits under its label and "ישוב" under the empty first name; neither is read locally
+    assert hebrew["שם משפחה"] == hebrew["שם פרטי"] == ""
+    assert hebrew["כתובת"]["רחוב"] == hebrew["כתובת"]["ישוב"] == ""
+
+
+def test_empty_field_does_not_take_the_next_labels_value(hebrew):
+    assert hebrew["טלפון קווי"] == ""
+
+
+@pytest.mark.parametrize("text", ["רחוב", "ישוב", "כניסה", "מספר בית", "שם פרטי"])
+def test_form_words_are_labels(text):
+    assert FormTemplate("he")._is_label(text)
+
+
+def test_english_form_on_one_line_per_field():
+    page = layout(
+        ("First Name", (1.0, 1.0, 1.8, 1.2)), ("Street", (1.0, 1.3, 1.5, 1.5)),
+        ("ID Number: 123456789", (1.0, 1.6, 2.8, 1.8)),
+        ("Date of injury: 14.05.2023", (1.0, 1.9, 3.0, 2.1)),
+        ("Time of injury 9:30", (1.0, 2.2, 2.6, 2.4)),
+    )
+    data = prefill_fields([page], "en")
+    assert data["firstName"] == ""
+    # Fails the check digit, so the LLM reads it from the text instead
+    assert data["idNumber"] == ""
+    assert data["dateOfInjury"] == {"day": "14", "month": "05", "year": "2023"}
+    assert data["timeOfInjury"] == "09:30"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("123456782", "123456782"),
+    ("0 1 2 3 4 5 6 7 8 2", "0123456782"),
+    ("000000018", "000000018"),
+    ("123456789", None),
+    ("12345678", None),
+    ("1234567820", None),
+    ("123456782 רחוב", None),
+])
+def test_parse_id(text, expected):
+    assert parse_id(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("14/05/2023", ("14", "05", "2023")),
+    ("1.5.2023", ("01", "05", "2023")),
+    ("32.05.2023", None),
+    ("יום חודש שנה", None),
+])
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [("9:30", "09:30"), ("2330", "23:30"), ("25:00", None)])
+def test_parse_time(text, expected):
+    assert parse_time(text) == expected
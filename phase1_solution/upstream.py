@@ -0,0 +1,91 @@
+"""
+Scheduling of Azure OpenAI requests across worker threads.
+
+Every call waits for room in its deployment's requests-per-minute and
+tokens-per-minute budgets, kept by `shared/rate_limits.py` exactly as for the
+chatbot backend; this module only adds the thread-based admission.
+Waiting calls are served by priority (the Streamlit app before batch runs),
+then in arrival order.
+"""
+import heapq
+import itertools
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from shared.rate_limits import PRIORITY_BATCH, PRIORITY_INTERACTIVE, RateBudgets, backoff, retry_after
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger("form_extractor.upstream")
+
+# Per-deployment budgets; 0 learns them from the response headers
+RPM_LIMIT = float(os.getenv("EXTRACTOR_RPM_LIMIT", "0"))
+TPM_LIMIT = float(os.getenv("EXTRACTOR_TPM_LIMIT", "0"))
+# Extraction calls in flight per process (0: limited only by the worker threads)
+MAX_CONCURRENCY = int(os.getenv("EXTRACTOR_LLM_CONCURRENCY", "0"))
+
+
+class UpstreamScheduler(RateBudgets):
+    """Admits calls from worker threads by priority, within the concurrency limit and each deployment's budget."""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, rpm: float = RPM_LIMIT, tpm: float = TPM_LIMIT):
+        super().__init__(rpm, tpm)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        # (priority, arrival) of the waiting calls
+        self._queue: List[Tuple[int, int]] = []
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def choose(self, model: str, tokens: int, fallback: Optional[str] = None) -> str:
+        with self._cond:
+            return super().choose(model, tokens, fallback)
+
+    def acquire(self, model: str, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> None:
+        entry = (priority, next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    wait = None
+                    if self._queue[0] == entry and (not self.max_concurrency or self.in_flight < self.max_concurrency):
+                        wait = self.budget(model).delay(tokens)
+                        if wait == 0:
+                            break
+                    # Only the head of the queue waits on the clock; the rest wait for it to go
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            self.in_flight += 1
+            self.budget(model).take(tokens)
+            self._cond.notify_all()
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, model: str, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> Iterator[None]:
+        self.acquire(model, tokens, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def observe_response(self, response: "httpx.Response") -> None:
+        """httpx response hook: update the deployment's budget, and pause it on a 429."""
+        with self._cond:
+            if self.observe(response.request.url.path, response.status_code, response.headers):
+                self._cond.notify_all()
+
+
+scheduler = UpstreamScheduler()
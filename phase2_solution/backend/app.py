@@ -1,40 +1,235 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field, ValidationError
-from typing import List, Literal, Optional
+from typing import AsyncIterator, Dict, List, Literal, Optional, Tuple
+import asyncio
 import logging
 import os
 import json
-import glob
+import signal
+import time
+from contextlib import asynccontextmanager
 from prompts import (
     info_collection_prompt,
     info_confirmation_prompt,
     qa_prompt,
-    extraction_prompt
+    qa_system_prefix,
+    extraction_prompt,
+    summary_prompt
 )
-from openai import AzureOpenAI
 from dotenv import load_dotenv
 from logging_config import configure_logging
+from kb_store import KnowledgeBaseStore, KnowledgeBaseSnapshot, DEFAULT_KB_DIR
+from benefits import BenefitIndex, HMOS, TIERS
+from retrieval import RetrievalIndex, load_or_build, DEFAULT_INDEX_DIR
+from fast_path import FastPathMatcher, mentioned_tiers, snapshot_stats as fast_path_stats
+from slot_extractor import SlotExtractor
+from response_cache import create_response_cache, Scope
+from history_manager import HistoryManager, local_summary
+from upstream import PRIORITY_BACKGROUND
+from session_store import Session, SessionConflict, create_session_store
+from llm import (
+    init_client,
+    warm_client,
+    client_ready,
+    close_client,
+    get_llm_response,
+    stream_llm_response,
+    llm_stats,
+    LLMStream,
+    LLM_FALLBACK_MODEL
+)
+from telemetry import (
+    HTTP_REQUEST_SECONDS,
+    METRICS_ENABLED,
+    METRICS_SHARE_INTERVAL,
+    WORKER_STARTUP_SECONDS,
+    init_tracing,
+    registry,
+    shutdown_tracing,
+    span,
+    trace
+)
 
 # --- Configuration and Initialization ---
 configure_logging()
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+kb_store = KnowledgeBaseStore(
+    kb_dir=os.getenv("KB_DIR", DEFAULT_KB_DIR),
+    poll_interval=float(os.getenv("KB_POLL_INTERVAL", "2.0"))
+)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", DEFAULT_INDEX_DIR)
+# `tier`: the rows of the member's HMO and tier as a static prompt prefix that the provider can cache
+# (every tier of the HMO once the conversation mentions another tier); `hmo`: always every tier;
+# `retrieval`: only the top-k rows for the question (fewest tokens, but no prefix shared between requests)
+QA_KB_CONTEXT = os.getenv("QA_KB_CONTEXT", "tier")
+benefit_index: Optional[BenefitIndex] = None
+retrieval_index: Optional[RetrievalIndex] = None
+# Answer single-service lookups ("what discount do I get on glasses?") straight from the benefit tables
+FAST_PATH = os.getenv("FAST_PATH", "1") == "1"
+fast_path: Optional[FastPathMatcher] = None
+# Knowledge base version the indexes above were built from; prompt prefixes and cached answers are
+# keyed on it rather than on the store's version, which may already be newer while they are rebuilt
+indexed_version = ""
+# (kb version, hmo, tier or "" for every tier) -> first system message of /ask,
+# rebuilt only when the knowledge base changes
+qa_prefixes: Dict[Tuple[str, str, str], str] = {}
+
+def rebuild_indexes(snapshot: KnowledgeBaseSnapshot) -> None:
+    global benefit_index, retrieval_index, fast_path, qa_prefixes, indexed_version
+    with span("kb_index", version=snapshot.version):
+        benefits = BenefitIndex.from_files(snapshot.files)
+        # Only the `retrieval` context reads the BM25 index
+        use_retrieval = QA_KB_CONTEXT == "retrieval" and RETRIEVAL_TOP_K > 0
+        retrieval = load_or_build(snapshot.version, benefits, KB_INDEX_DIR) if use_retrieval else None
+        matcher = FastPathMatcher(benefits)
+    benefit_index, retrieval_index, fast_path, qa_prefixes = benefits, retrieval, matcher, {}
+    indexed_version = snapshot.version
+    chunks = f" and {len(retrieval)} chunks" if retrieval is not None else ""
+    logger.info("Indexed %d benefit entries%s (version %s)", len(benefits), chunks, snapshot.version)
+
+kb_store.subscribe(rebuild_indexes)
+
+# Parse user details locally and only ask the LLM extractor when that is ambiguous
+LOCAL_SLOT_EXTRACTION = os.getenv("LOCAL_SLOT_EXTRACTION", "1") == "1"
+# Deployment for the JSON user-detail extraction; it moves to LLM_FALLBACK_MODEL when throttled
+EXTRACTION_MODEL = os.getenv("EXTRACTION_MODEL", "gpt-4o")
+slot_extractor = SlotExtractor()
+
+# Answers to self-contained questions are shared between members with the same HMO, tier and language
+response_cache = create_response_cache(
+    kind=os.getenv("RESPONSE_CACHE", "memory"),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+    near_duplicates=os.getenv("RESPONSE_CACHE_NEAR_DUPLICATES", "1") == "1",
+    near_threshold=float(os.getenv("RESPONSE_CACHE_NEAR_THRESHOLD", "0.8")),
+    redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+)
+
+# Conversation sent to the model: a rolling window of recent messages plus a summary of older ones
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+ASK_HISTORY_TOKEN_BUDGET = int(os.getenv("ASK_HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "local")
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o")
+
+async def llm_summary(previous: str, messages: List[dict]) -> str:
+    try:
+        # Summaries can wait behind user-facing calls, and do not need the primary deployment
+        return await get_llm_response(summary_prompt(previous, messages), model=HISTORY_SUMMARY_MODEL,
+                                      priority=PRIORITY_BACKGROUND, fallback_model=LLM_FALLBACK_MODEL or None)
+    except HTTPException as e:
+        logger.warning("History summary failed (%s), using the local summary", e.detail)
+        return await local_summary(previous, messages)
+
+history_manager = HistoryManager(
+    window=int(os.getenv("HISTORY_WINDOW", "12")),
+    summarizer={"local": local_summary, "llm": llm_summary}.get(HISTORY_SUMMARY)
+)
+
+# Conversation state kept on the server, so session clients only send the new message each turn
+session_store = create_session_store(
+    kind=os.getenv("SESSION_STORE", "memory"),
+    ttl=float(os.getenv("SESSION_TTL", "3600")),
+    max_entries=int(os.getenv("SESSION_MAX_ENTRIES", "10000")),
+    sqlite_path=os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3"),
+    redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+)
+
+# --- Worker Lifecycle ---
+# Seconds after SIGTERM during which /ready fails but requests are still accepted,
+# so the load balancer stops routing to this worker before it closes its socket
+DRAIN_DELAY = float(os.getenv("DRAIN_DELAY", "0"))
+# Start of this process, or of this worker when forked from a preloaded gunicorn master
+worker_started = time.perf_counter()
+# Seconds from then until the worker was ready; None while starting
+worker_startup: Optional[float] = None
+draining = False
+
+def reset_worker_state() -> None:
+    global worker_started, worker_startup, draining
+    worker_started, worker_startup, draining = time.perf_counter(), None, False
+
+os.register_at_fork(after_in_child=reset_worker_state)
+
+def preload() -> None:
+    """
+    Load the knowledge base and build its indexes and prompt prefixes in this
+    process. The gunicorn master calls this before forking, so every worker
+    starts with them (shared copy-on-write) instead of building its own.
+    """
+    warm_client()
+    kb_store.reload()
+    benefits = benefit_index
+    if benefits is None or not len(benefits):
+        return
+    for hmo in HMOS:
+        cached_qa_prefix(hmo, "")
+        for tier in TIERS:
+            cached_qa_prefix(hmo, tier)
+
+def install_drain_handler() -> None:
+    """On SIGTERM, fail /ready at once and pass the signal on to the server after DRAIN_DELAY."""
+    loop = asyncio.get_running_loop()
+    server_handler = signal.getsignal(signal.SIGTERM)
+    if not callable(server_handler):
+        return
+
+    def handle_sigterm(signum, frame):
+        global draining
+        if draining:
+            # A second SIGTERM stops without waiting
+            server_handler(signum, frame)
+            return
+        draining = True
+        logger.info("Draining worker %d: not ready, shutting down in %gs", os.getpid(), DRAIN_DELAY)
+        loop.call_soon_threadsafe(loop.call_later, DRAIN_DELAY, server_handler, signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global worker_startup
+    init_tracing()
+    registry.share(METRICS_SHARE_INTERVAL)
+    # Load the knowledge base once and keep it in memory for every request
+    # (a preloaded master has already indexed it; unchanged files are not re-indexed)
+    kb_store.start()
+    init_client()
+    install_drain_handler()
+    worker_startup = time.perf_counter() - worker_started
+    WORKER_STARTUP_SECONDS.observe(worker_startup)
+    logger.info("Worker %d ready in %.0f ms", os.getpid(), worker_startup * 1000)
+    yield
+    await close_client()
+    if response_cache: await response_cache.close()
+    await session_store.close()
+    kb_store.stop()
+    registry.write()
+    shutdown_tracing()
+
 app = FastAPI(
     title="HMO Information Chatbot API",
     description="This API powers a chatbot to collect user information and answer questions based on their HMO plan.",
-    version="1.2.0" 
+    version="1.2.0",
+    lifespan=lifespan
 )
 
-try:
-    client = AzureOpenAI(
-        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-        api_key=os.environ["AZURE_OPENAI_API_KEY"],
-        api_version="2024-02-15-preview"
-    )
-except KeyError as e:
-    logger.error(f"Environment variable not set: {e}")
-    client = None 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        with trace(f"{request.method} {request.url.path}", method=request.method, path=request.url.path):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                     route=route.path if route is not None else "unmatched", status=str(status))
 
 # --- Pydantic Data Models ---
 class UserInfo(BaseModel):
@@ -62,99 +257,441 @@ class QAPayload(BaseModel):
     new_message: str
     language: str = "en"
 
+class SessionCreate(BaseModel):
+    language: str = "en"
+
+class SessionMessage(BaseModel):
+    message: str
+
+class SessionConfirm(BaseModel):
+    # Messages shown in the client when the user confirmed (kept so the history matches what they saw)
+    messages: List[Message] = []
+
 # --- Helper Functions ---
-def get_llm_response(messages: List[dict], model: str = "gpt-4o", as_json: bool = False) -> str:
-    if not client: raise HTTPException(status_code=500, detail="Azure OpenAI client is not configured.")
+def build_kb_context(user_info: UserInfo, history: List[dict], question: str) -> str:
+    """
+    Select the knowledge base context for a question: the top-k retrieved chunks
+    rendered for the member's HMO and tier, or all of that member's benefits
+    when nothing matches lexically. Falls back to the raw HTML if no tables were parsed.
+    """
+    kb_content = kb_store.content
+    benefits, retrieval = benefit_index, retrieval_index
+    if benefits is None or not len(benefits):
+        return kb_content
+
+    selection = None
+    if retrieval is not None and RETRIEVAL_TOP_K > 0:
+        # Include the previous user turn so follow-ups like "and on silver?" keep their topic
+        previous = next((msg["content"] for msg in reversed(history) if msg["role"] == "user"), "")
+        hits = retrieval.search(f"{previous}\n{question}", RETRIEVAL_TOP_K)
+        if hits:
+            selection = [(chunk.category, chunk.service) for chunk, _ in hits]
+    if selection is None:
+        return benefits.render(user_info.hmo, user_info.tier)
+    return benefits.render_selection(user_info.hmo, user_info.tier, selection)
+
+def cached_qa_prefix(hmo: str, tier: str) -> str:
+    """The /ask system prefix with one tier's rows of an HMO, or every tier's when `tier` is empty."""
+    key = (indexed_version, hmo, tier)
+    prefix = qa_prefixes.get(key)
+    if prefix is None:
+        benefits = benefit_index
+        if benefits is None or not len(benefits):
+            kb_content = kb_store.content
+        else:
+            kb_content = benefits.render(hmo, tier) if tier else benefits.render_hmo(hmo)
+        prefix = qa_system_prefix(kb_content)
+        qa_prefixes[key] = prefix
+        logger.info("Built the /ask prompt prefix for %s %s (knowledge base version %s)", hmo, tier or "all tiers", key[0])
+    return prefix
+
+def build_qa_system_prefix(user_info: UserInfo, history: List[dict], question: str) -> str:
+    if QA_KB_CONTEXT == "retrieval":
+        return qa_system_prefix(build_kb_context(user_info, history, question))
+    if QA_KB_CONTEXT == "hmo":
+        return cached_qa_prefix(user_info.hmo, "")
+    # Questions about another tier ("and on silver?") need its rows; the conversation then
+    # keeps the HMO-wide prefix, so later turns still share a cached prefix
+    asked = [msg["content"] for msg in history if msg["role"] == "user"] + [question]
+    if any(mentioned_tiers(text) - {user_info.tier} for text in asked):
+        return cached_qa_prefix(user_info.hmo, "")
+    return cached_qa_prefix(user_info.hmo, user_info.tier)
+
+def cache_scope(user_info: UserInfo, language: str, question: str) -> Scope:
+    matcher = fast_path
+    topic = matcher.topic(question) if matcher is not None else ""
+    return (user_info.hmo, user_info.tier, language, indexed_version, topic)
+
+async def single_delta(text: str) -> AsyncIterator[str]:
+    yield text
+
+async def cache_when_complete(deltas: AsyncIterator[str], scope: Scope, question: str,
+                              in_context: bool) -> AsyncIterator[str]:
+    """Pass a streamed answer through and cache it once it has fully arrived."""
+    parts = []
     try:
-        response_format = {"type": "json_object"} if as_json else {"type": "text"}
-        resp = client.chat.completions.create(model=model, messages=messages, response_format=response_format)
-        return resp.choices[0].message.content
-    except Exception as e:
-        logger.error(f"Error calling Azure OpenAI: {e}")
-        raise HTTPException(status_code=500, detail="Failed to get response from LLM.")
+        async for delta in deltas:
+            parts.append(delta)
+            yield delta
+        await response_cache.set(scope, question, "".join(parts), in_context)
+    finally:
+        await deltas.aclose()
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-def get_all_knowledge_base_content() -> str:
+async def stream_events(deltas: AsyncIterator[str], meta: dict) -> AsyncIterator[str]:
     """
-    Load all knowledge base content from all files. Since each file covers 
-    a different topic, we need to combine all files for comprehensive coverage.
+    Server-Sent Events for a streamed reply: one `meta` event, a data event per
+    text delta, then `done` (or `error` if the upstream stream breaks).
     """
-    kb_dir = "knowledge_base"
-    
-    # Get all HTML files in the directory
-    html_files = glob.glob(os.path.join(kb_dir, "*.html"))
-    
-    if not html_files:
-        raise FileNotFoundError("No HTML files found in knowledge_base directory")
-    
-    combined_content = []
-    
-    for file_path in html_files:
+    try:
+        yield sse_event(meta, "meta")
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                file_content = f.read()
-                filename = os.path.basename(file_path)
-                
-                # Add a header to identify which file this content came from
-                combined_content.append(f"\n\n=== KNOWLEDGE BASE FILE: {filename} ===\n")
-                combined_content.append(file_content)
-                
-                logger.info(f"Loaded knowledge base file: {filename}")
-                
+            async for delta in deltas:
+                yield sse_event({"delta": delta})
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, "error")
+            return
         except Exception as e:
-            logger.warning(f"Failed to load knowledge base file {file_path}: {e}")
-            continue
-    
-    if not combined_content:
-        raise FileNotFoundError("No knowledge base files could be loaded")
-    
-    logger.info(f"Successfully loaded {len(html_files)} knowledge base files")
-    return "\n".join(combined_content)
+            logger.error("Streaming response failed: %s", e)
+            yield sse_event({"detail": "Failed to get response from LLM."}, "error")
+            return
+        yield sse_event({}, "done")
+    finally:
+        await deltas.aclose()
 
-# --- API Endpoints ---
-@app.post("/chat")
-async def chat(payload: ChatPayload):
-    history = [msg.dict() for msg in payload.history]
-    lang = payload.language
-    extraction_messages = extraction_prompt(history)
-    extracted_json_str = get_llm_response(extraction_messages, as_json=True)
+class EventStreamResponse(StreamingResponse):
+    """
+    An SSE response that closes the upstream LLM stream (freeing its scheduler
+    slot) however the response ends: completed, failed, cancelled by a client
+    disconnect, or before the event generator was ever started.
+    """
+
+    def __init__(self, events: AsyncIterator[str], upstream: Optional[LLMStream] = None):
+        super().__init__(
+            events,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        self.upstream = upstream
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.upstream is not None:
+                await self.upstream.aclose()
+
+def event_stream_response(events: AsyncIterator[str], upstream: Optional[LLMStream] = None) -> StreamingResponse:
+    return EventStreamResponse(events, upstream)
+
+async def plan_chat_reply(history: List[dict], lang: str) -> Tuple[str, Optional[UserInfo], List[dict]]:
+    """Work out the phase of a /chat turn and the messages for the assistant's reply."""
+    # Details parsed from the full history survive even when old turns fall out of the window
+    with span("history_compact"):
+        compact = await history_manager.compact(history, CHAT_HISTORY_TOKEN_BUDGET)
+    known = None
+
+    if LOCAL_SLOT_EXTRACTION:
+        with span("slot_extraction"):
+            slots = slot_extractor.extract(history)
+        known = slots.values
+        if slots.complete and slots.guessed:
+            # Bare replies read as names (or ages, genders) are only a prefill for the LLM extractor to check
+            logger.info("Checking %d locally guessed fields with the LLM extractor", len(slots.guessed))
+        elif slots.complete:
+            try:
+                with span("validation"):
+                    user_info = UserInfo(**slots.values)
+                logger.info("Extracted and validated user info locally")
+                return "confirming", user_info, info_confirmation_prompt(user_info, lang)
+            except ValidationError as e:
+                logger.info("Locally extracted user info failed validation (%d errors), asking the LLM", e.error_count())
+        elif not slots.ambiguous:
+            logger.info("Still missing %d fields, continuing conversation", len(slots.missing))
+            return "collecting", None, info_collection_prompt(compact.messages, lang, known, compact.summary)
+
+    extraction_messages = extraction_prompt(compact.messages, known, compact.summary)
+    extracted_json_str = await get_llm_response(extraction_messages, model=EXTRACTION_MODEL, as_json=True,
+                                                fallback_model=LLM_FALLBACK_MODEL or None)
     
     try:
         if extracted_json_str.strip().lower() in ["none", "null", "{}"]: raise ValueError("Not enough info.")
-        user_info = UserInfo(**json.loads(extracted_json_str))
-        logger.info(f"Successfully extracted and validated user info: {user_info.id_number}")
-        confirmation_messages = info_confirmation_prompt(user_info, lang)
-        confirmation_text = get_llm_response(confirmation_messages)
-        return {"phase": "confirming", "assistant": confirmation_text, "user_info": user_info.dict()}
+        with span("validation"):
+            user_info = UserInfo(**json.loads(extracted_json_str))
+        logger.info("Successfully extracted and validated user info: %s", user_info.id_number)
+        return "confirming", user_info, info_confirmation_prompt(user_info, lang)
 
     except (ValueError, ValidationError, json.JSONDecodeError) as e:
-        logger.info(f"Could not extract user info yet, continuing conversation. Reason: {e}")
-        collection_messages = info_collection_prompt(history, lang)
-        assistant_response = get_llm_response(collection_messages)
-        return {"phase": "collecting", "assistant": assistant_response, "user_info": None}
+        logger.info("Could not extract user info yet, continuing conversation. Reason: %s", e)
+        return "collecting", None, info_collection_prompt(compact.messages, lang, known, compact.summary)
 
-@app.post("/ask")
-async def ask(payload: QAPayload):
+async def build_qa_messages(user_info: UserInfo, history: List[dict], question: str, language: str) -> List[dict]:
     try:
-        # Load all knowledge base content from all topic files
-        kb_content = get_all_knowledge_base_content()
+        # The knowledge base is loaded at startup and kept fresh by the store
+        with span("kb_context"):
+            system_prefix = build_qa_system_prefix(user_info, history, question)
             
     except FileNotFoundError as e:
-        logger.error(f"Knowledge base files not found: {e}")
+        logger.error("Knowledge base files not found: %s", e)
         raise HTTPException(
             status_code=404, 
             detail="Knowledge base files not found. Please ensure the knowledge base files are available in the knowledge_base directory."
         )
     except Exception as e:
-        logger.error(f"Error reading knowledge base files: {e}")
+        logger.error("Error reading knowledge base files: %s", e)
         raise HTTPException(status_code=500, detail="Failed to read knowledge base files.")
 
-    qa_messages = qa_prompt(
-        user_info=payload.user_info,
-        history=[msg.dict() for msg in payload.history],
-        new_question=payload.new_message,
-        knowledge_base=kb_content,
-        language=payload.language
+    # The new question counts against the budget too, and is always the last message kept
+    with span("history_compact"):
+        compact = await history_manager.compact(history + [{"role": "user", "content": question}], ASK_HISTORY_TOKEN_BUDGET)
+    with span("prompt_build"):
+        return qa_prompt(
+            user_info=user_info,
+            history=compact.messages[:-1],
+            new_question=compact.messages[-1]["content"],
+            system_prefix=system_prefix,
+            language=language,
+            summary=compact.summary
+        )
+
+def fast_path_answer(user_info: UserInfo, history: List[dict], question: str, language: str) -> Optional[str]:
+    matcher = fast_path
+    if not FAST_PATH or matcher is None:
+        return None
+    with span("fast_path"):
+        answer = matcher.answer(question, user_info.hmo, user_info.tier, language, in_context=bool(history))
+    if answer is not None:
+        logger.info("Answered question for %s from the benefit tables", user_info.id_number)
+    return answer
+
+async def answer_question(user_info: UserInfo, history: List[dict], question: str, language: str) -> str:
+    answer = fast_path_answer(user_info, history, question, language)
+    if answer is not None:
+        return answer
+    scope = cache_scope(user_info, language, question)
+    if response_cache:
+        with span("response_cache"):
+            cached = await response_cache.get(scope, question, bool(history))
+        if cached is not None:
+            logger.info("Served cached answer for %s", user_info.id_number)
+            return cached
+
+    qa_messages = await build_qa_messages(user_info, history, question, language)
+    answer = await get_llm_response(qa_messages)
+    logger.info("Answered question for %s", user_info.id_number)
+    if response_cache: await response_cache.set(scope, question, answer, bool(history))
+    return answer
+
+async def stream_answer(user_info: UserInfo, history: List[dict], question: str,
+                        language: str) -> Tuple[AsyncIterator[str], dict, Optional[LLMStream]]:
+    """
+    The answer's text deltas, the `meta` event to send before them, and the
+    upstream stream that the response must close (None when no LLM call was made).
+    """
+    answer = fast_path_answer(user_info, history, question, language)
+    if answer is not None:
+        return single_delta(answer), {"fast_path": True}, None
+    scope = cache_scope(user_info, language, question)
+    if response_cache:
+        with span("response_cache"):
+            cached = await response_cache.get(scope, question, bool(history))
+        if cached is not None:
+            logger.info("Served cached answer for %s", user_info.id_number)
+            return single_delta(cached), {"cached": True}, None
+
+    qa_messages = await build_qa_messages(user_info, history, question, language)
+    upstream = await stream_llm_response(qa_messages)
+    deltas = cache_when_complete(upstream, scope, question, bool(history)) if response_cache else upstream
+    logger.info("Streaming answer for %s", user_info.id_number)
+    return deltas, {}, upstream
+
+# --- Session Helpers ---
+async def load_session(session_id: str) -> Session:
+    with span("session_load"):
+        session = await session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired.")
+    return session
+
+async def save_session(session: Session) -> None:
+    try:
+        with span("session_save"):
+            await session_store.save(session)
+    except SessionConflict:
+        # Another request for this session was stored first; storing this turn would drop that one
+        raise HTTPException(status_code=409, detail="The session was changed by another request. Please try again.")
+
+def session_user_info(session: Session) -> UserInfo:
+    if session.phase != "qa" or session.user_info is None:
+        raise HTTPException(status_code=409, detail="The user's information has not been confirmed yet.")
+    with span("validation"):
+        return UserInfo(**session.user_info)
+
+def record_chat_turn(session: Session, message: str, reply: str, phase: str, user_info: Optional[UserInfo]) -> None:
+    session.history.append({"role": "user", "content": message})
+    session.history.append({"role": "assistant", "content": reply})
+    session.phase = phase
+    session.pending_info = user_info.dict() if user_info else None
+
+async def save_when_complete(deltas: AsyncIterator[str], session: Session, on_complete) -> AsyncIterator[str]:
+    """Pass a streamed reply through and store the turn in the session once it has fully arrived."""
+    parts = []
+    try:
+        async for delta in deltas:
+            parts.append(delta)
+            yield delta
+        on_complete("".join(parts))
+        await save_session(session)
+    finally:
+        await deltas.aclose()
+
+# --- API Endpoints ---
+@app.post("/chat")
+async def chat(payload: ChatPayload):
+    phase, user_info, messages = await plan_chat_reply([msg.dict() for msg in payload.history], payload.language)
+    assistant_response = await get_llm_response(messages)
+    return {"phase": phase, "assistant": assistant_response, "user_info": user_info.dict() if user_info else None}
+
+@app.post("/chat/stream")
+async def chat_stream(payload: ChatPayload):
+    phase, user_info, messages = await plan_chat_reply([msg.dict() for msg in payload.history], payload.language)
+    upstream = await stream_llm_response(messages)
+    meta = {"phase": phase, "user_info": user_info.dict() if user_info else None}
+    return event_stream_response(stream_events(upstream, meta), upstream)
+
+@app.post("/ask")
+async def ask(payload: QAPayload):
+    history = [msg.dict() for msg in payload.history]
+    answer = await answer_question(payload.user_info, history, payload.new_message, payload.language)
+    return {"assistant": answer}
+
+@app.post("/ask/stream")
+async def ask_stream(payload: QAPayload):
+    history = [msg.dict() for msg in payload.history]
+    deltas, meta, upstream = await stream_answer(payload.user_info, history, payload.new_message, payload.language)
+    return event_stream_response(stream_events(deltas, meta), upstream)
+
+# --- Session Endpoints ---
+@app.post("/sessions")
+async def create_session(payload: SessionCreate):
+    session = await session_store.create(payload.language)
+    return {"session_id": session.id, "phase": session.phase}
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = await load_session(session_id)
+    return {"session_id": session.id, "language": session.language, "phase": session.phase,
+            "history": session.history, "user_info": session.user_info, "pending_info": session.pending_info}
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    await session_store.delete(session_id)
+    return {"deleted": True}
+
+@app.post("/sessions/{session_id}/chat")
+async def session_chat(session_id: str, payload: SessionMessage):
+    session = await load_session(session_id)
+    history = session.history + [{"role": "user", "content": payload.message}]
+    phase, user_info, messages = await plan_chat_reply(history, session.language)
+    assistant_response = await get_llm_response(messages)
+    record_chat_turn(session, payload.message, assistant_response, phase, user_info)
+    await save_session(session)
+    return {"phase": phase, "assistant": assistant_response, "user_info": session.pending_info}
+
+@app.post("/sessions/{session_id}/chat/stream")
+async def session_chat_stream(session_id: str, payload: SessionMessage):
+    session = await load_session(session_id)
+    history = session.history + [{"role": "user", "content": payload.message}]
+    phase, user_info, messages = await plan_chat_reply(history, session.language)
+    upstream = await stream_llm_response(messages)
+    deltas = save_when_complete(
+        upstream, session, lambda reply: record_chat_turn(session, payload.message, reply, phase, user_info)
     )
-    answer = get_llm_response(qa_messages)
-    logger.info("Answered question for %s (%s)", payload.user_info.first_name, payload.user_info.id_number)
-    return {"assistant": answer}
\ No newline at end of file
+    meta = {"phase": phase, "user_info": user_info.dict() if user_info else None}
+    return event_stream_response(stream_events(deltas, meta), upstream)
+
+@app.post("/sessions/{session_id}/confirm")
+async def session_confirm(session_id: str, payload: SessionConfirm):
+    session = await load_session(session_id)
+    if session.phase != "confirming" or session.pending_info is None:
+        raise HTTPException(status_code=409, detail="There is no user information waiting for confirmation.")
+    session.user_info, session.pending_info = session.pending_info, None
+    session.phase = "qa"
+    session.history.extend(msg.dict() for msg in payload.messages)
+    await save_session(session)
+    return {"phase": session.phase, "user_info": session.user_info}
+
+@app.post("/sessions/{session_id}/ask")
+async def session_ask(session_id: str, payload: SessionMessage):
+    session = await load_session(session_id)
+    user_info = session_user_info(session)
+    answer = await answer_question(user_info, session.history, payload.message, session.language)
+    session.history.extend([{"role": "user", "content": payload.message}, {"role": "assistant", "content": answer}])
+    await save_session(session)
+    return {"assistant": answer}
+
+@app.post("/sessions/{session_id}/ask/stream")
+async def session_ask_stream(session_id: str, payload: SessionMessage):
+    session = await load_session(session_id)
+    user_info = session_user_info(session)
+    deltas, meta, upstream = await stream_answer(user_info, session.history, payload.message, session.language)
+    deltas = save_when_complete(deltas, session, lambda answer: session.history.extend(
+        [{"role": "user", "content": payload.message}, {"role": "assistant", "content": answer}]
+    ))
+    return event_stream_response(stream_events(deltas, meta), upstream)
+
+@app.get("/health")
+async def health():
+    """Liveness: the worker's event loop is responding."""
+    return {"status": "ok", "pid": os.getpid()}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: started, knowledge base indexed, LLM client configured and not draining."""
+    problems = []
+    if worker_startup is None:
+        problems.append("starting")
+    if draining:
+        problems.append("draining")
+    if benefit_index is None:
+        problems.append("knowledge base not loaded")
+    if not client_ready():
+        problems.append("LLM client not configured")
+    body = {
+        "status": "not ready" if problems else "ready",
+        "pid": os.getpid(),
+        "kb_version": kb_store.version,
+        "startup_ms": round(worker_startup * 1000) if worker_startup is not None else None,
+    }
+    if problems:
+        body["problems"] = problems
+    return JSONResponse(body, status_code=503 if problems else 200)
+
+@app.get("/llm/stats")
+async def llm_status():
+    # Counters of this worker only; /metrics sums every worker
+    return {"pid": os.getpid(), **llm_stats(), "history": history_manager.snapshot_stats(), "sessions": session_store.snapshot_stats(),
+            "fast_path": {"enabled": FAST_PATH, **fast_path_stats()}}
+
+@app.get("/metrics")
+async def metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache/stats")
+async def cache_status():
+    if not response_cache:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.snapshot_stats()}
+
+@app.get("/kb")
+async def kb_info():
+    try:
+        snapshot = kb_store.snapshot
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Knowledge base is not loaded.")
+    return {"version": snapshot.version, "files": sorted(snapshot.files), "loaded_at": snapshot.loaded_at}
\ No newline at end of file
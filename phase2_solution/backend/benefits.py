@@ -0,0 +1,255 @@
+import logging
+import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+HMOS = ("מכבי", "מאוחדת", "כללית")
+TIERS = ("זהב", "כסף", "ארד")
+
+# (category, service, hmo, tier)
+BenefitKey = Tuple[str, str, str, str]
+
+_TIER_LINE = re.compile(r"^\s*(" + "|".join(TIERS) + r")\s*:\s*(.+?)\s*$")
+_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+
+
+@dataclass(frozen=True)
+class Benefit:
+    category: str
+    service: str
+    hmo: str
+    tier: str
+    text: str
+
+
+@dataclass
+class Category:
+    """Everything parsed from one knowledge base file."""
+    name: str
+    source: str
+    intro: str = ""
+    services: List[str] = field(default_factory=list)
+    descriptions: Dict[str, str] = field(default_factory=dict)
+    # hmo -> contact lines (phone numbers and links)
+    contacts: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def _clean(text: str) -> str:
+    lines = [_WHITESPACE.sub(" ", line).strip() for line in text.split("\n")]
+    return "\n".join(line for line in lines if line)
+
+
+class _BlockParser(HTMLParser):
+    """
+    Flattens a knowledge base HTML file into a list of blocks:
+    ("h2" | "h3" | "p" | "li", text) and ("table", rows of cell texts).
+    `<br>` inside a block is kept as a newline so tier lines stay separate.
+    """
+
+    _TEXT_TAGS = {"h2", "h3", "p", "li"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[Tuple[str, object]] = []
+        self._text_tag: Optional[str] = None
+        self._buffer: List[str] = []
+        self._rows: Optional[List[List[str]]] = None
+        self._row: Optional[List[str]] = None
+        self._in_cell = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self._rows = []
+        elif tag == "tr" and self._rows is not None:
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._in_cell = True
+            self._buffer = []
+        elif tag in self._TEXT_TAGS and not self._in_cell and self._text_tag is None:
+            self._text_tag = tag
+            self._buffer = []
+        elif tag == "br":
+            self._buffer.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._in_cell:
+            self._row.append(_clean("".join(self._buffer)))
+            self._in_cell = False
+        elif tag == "tr" and self._row is not None:
+            self._rows.append(self._row)
+            self._row = None
+        elif tag == "table" and self._rows is not None:
+            self.blocks.append(("table", self._rows))
+            self._rows = None
+        elif tag == self._text_tag:
+            self.blocks.append((tag, _clean("".join(self._buffer))))
+            self._text_tag = None
+
+    def handle_data(self, data):
+        if self._in_cell or self._text_tag is not None:
+            self._buffer.append(data)
+
+
+class BenefitIndex:
+    """
+    Compact in-memory index of the benefit tables in the knowledge base,
+    keyed by (category, service, hmo, tier).
+    """
+
+    def __init__(self, categories: List[Category], benefits: Iterable[Benefit]):
+        self.categories = categories
+        self.entries: Dict[BenefitKey, Benefit] = {}
+        for benefit in benefits:
+            self.entries[(benefit.category, benefit.service, benefit.hmo, benefit.tier)] = benefit
+        self._render_cache: Dict[Tuple[str, str], str] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @classmethod
+    def from_files(cls, files: Dict[str, str]) -> "BenefitIndex":
+        categories: List[Category] = []
+        benefits: List[Benefit] = []
+        for filename, html in files.items():
+            try:
+                category, rows = _parse_file(filename, html)
+            except Exception as e:
+                logger.warning("Failed to parse knowledge base file %s: %s", filename, e)
+                continue
+            categories.append(category)
+            benefits.extend(rows)
+        return cls(categories, benefits)
+
+    def lookup(self, category: str, service: str, hmo: str, tier: str) -> Optional[Benefit]:
+        return self.entries.get((category, service, hmo, tier))
+
+    def for_member(self, hmo: str, tier: str) -> List[Benefit]:
+        return [b for b in self.entries.values() if b.hmo == hmo and b.tier == tier]
+
+    def render(self, hmo: str, tier: str) -> str:
+        """
+        Render only the rows that apply to one HMO and tier, plus that HMO's
+        contact details, as compact plain text for the prompt.
+        """
+        key = (hmo, tier)
+        cached = self._render_cache.get(key)
+        if cached is None:
+            cached = self.render_selection(hmo, tier, None)
+            self._render_cache[key] = cached
+        return cached
+
+    def render_hmo(self, hmo: str) -> str:
+        """
+        Render every tier of one HMO's rows. The text depends only on the HMO and
+        the knowledge base, so all of that HMO's members share it as a prompt prefix.
+        """
+        key = (hmo, "")
+        cached = self._render_cache.get(key)
+        if cached is not None:
+            return cached
+
+        sections = []
+        for category in self.categories:
+            lines = [f"## {category.name}"]
+            if category.intro:
+                lines.append(category.intro)
+            for service in category.services:
+                tiers = [(tier, self.entries.get((category.name, service, hmo, tier))) for tier in TIERS]
+                tiers = [(tier, benefit) for tier, benefit in tiers if benefit is not None]
+                if tiers:
+                    lines.append(f"- {service}")
+                    lines.extend(f"  {tier}: {benefit.text}" for tier, benefit in tiers)
+            for contact in category.contacts.get(hmo, []):
+                lines.append(f"* {contact}")
+            sections.append("\n".join(lines))
+
+        cached = f"HMO: {hmo}\n\n" + "\n\n".join(sections)
+        self._render_cache[key] = cached
+        return cached
+
+    def render_selection(self, hmo: str, tier: str, selection: Optional[Iterable[Tuple[str, str]]]) -> str:
+        """
+        Like `render`, restricted to the given (category, service) pairs. An empty
+        service selects the category overview. `None` selects everything.
+        """
+        wanted: Optional[Dict[str, set]] = None
+        if selection is not None:
+            wanted = {}
+            for category_name, service in selection:
+                wanted.setdefault(category_name, set()).add(service)
+
+        sections = []
+        for category in self.categories:
+            if wanted is not None and category.name not in wanted:
+                continue
+            chosen = wanted.get(category.name) if wanted is not None else None
+            lines = [f"## {category.name}"]
+            if category.intro and (chosen is None or "" in chosen):
+                lines.append(category.intro)
+            for service in category.services:
+                if chosen is not None and service not in chosen:
+                    continue
+                benefit = self.entries.get((category.name, service, hmo, tier))
+                if benefit is not None:
+                    lines.append(f"- {service}: {benefit.text}")
+            for contact in category.contacts.get(hmo, []):
+                lines.append(f"* {contact}")
+            sections.append("\n".join(lines))
+
+        return f"HMO: {hmo} | Tier: {tier}\n\n" + "\n\n".join(sections)
+
+
+def _parse_file(filename: str, html: str) -> Tuple[Category, List[Benefit]]:
+    parser = _BlockParser()
+    parser.feed(html)
+    parser.close()
+
+    category = Category(name=filename, source=filename)
+    benefits: List[Benefit] = []
+    seen_table = False
+
+    for kind, value in parser.blocks:
+        if kind == "h2":
+            category.name = value
+        elif kind == "p" and not category.intro:
+            category.intro = value.replace("\n", " ")
+        elif kind == "li" and not seen_table:
+            # Service list above the table: "<service>: <description>"
+            name, sep, description = value.partition(":")
+            if sep:
+                category.descriptions[name.strip()] = description.strip()
+        elif kind == "li":
+            # Contact lists below the table: "<hmo>: <details>"
+            hmo, sep, details = value.partition(":")
+            if sep and hmo.strip() in HMOS:
+                details = " ".join(details.split())
+                category.contacts.setdefault(hmo.strip(), []).append(details)
+        elif kind == "table":
+            seen_table = True
+            benefits.extend(_parse_table(category, value))
+
+    return category, benefits
+
+
+def _parse_table(category: Category, rows: List[List[str]]) -> List[Benefit]:
+    if not rows:
+        return []
+    header = rows[0]
+    columns = {index: name for index, name in enumerate(header) if name in HMOS}
+    benefits = []
+    for row in rows[1:]:
+        if not row:
+            continue
+        service = row[0].replace("\n", " ")
+        category.services.append(service)
+        for index, hmo in columns.items():
+            if index >= len(row):
+                continue
+            for line in row[index].split("\n"):
+                match = _TIER_LINE.match(line)
+                if match:
+                    benefits.append(Benefit(category.name, service, hmo, match.group(1), match.group(2)))
+    return benefits
@@ -0,0 +1,374 @@
+"""
+Deterministic answers to single-service benefit lookups.
+
+Questions such as "what discount do I get on glasses?" are answered by one
+row of the benefit tables for the member's HMO and tier. The matcher maps the
+question's words (Hebrew, or English through `QUERY_SYNONYMS`) onto the
+service names of the knowledge base and, when exactly one service matches,
+nothing else in the question points elsewhere, and the question asks for what
+the table holds (a discount, a price, how many, whether it is covered) or is
+just the service's name, with only question words around it, renders that
+row with a fixed template in the request's language. Anything else (no match,
+several services, other tiers or HMOs, open-ended questions, questions about
+something other than the benefit such as safety or booking, negations and
+conditions, follow-ups that refer to an earlier turn, or an English answer
+whose table text has no translation) is left to the LLM pipeline.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from benefits import BenefitIndex, Benefit, Category
+from response_cache import normalize_question, refers_back
+from retrieval import QUERY_SYNONYMS, tokenize
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+# A service-name word shared by at least this many services (e.g. "טיפול", "בדיקות")
+# does not identify a service on its own
+GENERIC_WORD_SERVICES = 3
+# Longer questions usually carry conditions the template cannot address
+MAX_QUESTION_WORDS = 16
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_HEBREW = re.compile(r"[א-ת]")
+
+# Words that name an HMO or tier, mapped to the knowledge base values
+_HMO_WORDS = {
+    "מכבי": "מכבי", "maccabi": "מכבי",
+    "מאוחדת": "מאוחדת", "meuhedet": "מאוחדת", "meuchedet": "מאוחדת",
+    "כללית": "כללית", "clalit": "כללית", "klalit": "כללית",
+}
+_TIER_WORDS = {
+    "זהב": "זהב", "gold": "זהב", "golden": "זהב",
+    "כסף": "כסף", "silver": "כסף",
+    "ארד": "ארד", "bronze": "ארד",
+}
+# Questions that ask for an explanation, comparison or advice rather than a table value
+_OPEN_ENDED = frozenset({
+    "why", "explain", "difference", "compare", "comparison", "better", "best", "vs", "versus",
+    "recommend", "should", "other", "cheaper", "למה", "הסבר", "ההבדל", "הבדל", "להשוות",
+    "השוואה", "עדיף", "מומלץ", "כדאי", "אחר", "אחרת", "אחרים",
+})
+# Words that ask for what a benefit row holds; a question needs one of them unless it is only a service name.
+# "Is acupuncture dangerous?" or "how do I book acupuncture?" name a service but ask something else
+_LOOKUP_INTENT = frozenset({
+    "discount", "discounts", "cost", "costs", "price", "prices", "pay", "much", "many", "covered", "cover",
+    "coverage", "covers", "entitled", "eligible", "benefit", "benefits", "free", "refund", "reimbursement",
+    "percent", "limit", "included",
+    "הנחה", "הנחות", "עולה", "עולים", "עלות", "מחיר", "לשלם", "משלם", "משלמת", "כמה", "מגיע", "מגיעה",
+    "מגיעות", "מגיעים", "זכאי", "זכאית", "כיסוי", "מכוסה", "מכוסים", "הטבה", "הטבות", "חינם", "החזר", "אחוז",
+})
+# Words that may surround a lookup without changing what it asks. Any other word outside the knowledge
+# base ("without insurance", "at a private clinic", "if I lose them") is a condition the table row does
+# not answer
+_QUESTION_WORDS = frozenset({
+    "what", "how", "do", "does", "did", "i", "im", "me", "my", "we", "our", "us", "get", "gets", "got",
+    "receive", "is", "are", "am", "there", "any", "a", "an", "the", "s", "for", "on", "of", "to", "in",
+    "at", "with", "under", "by", "it", "its", "this", "that", "these", "those", "can", "could", "will",
+    "would", "please", "tell", "know", "want", "give", "offer", "plan", "tier", "level", "hmo", "insurance",
+    "member", "membership",
+    "מה", "כמה", "האם", "אני", "אנחנו", "לי", "לנו", "יש", "על", "של", "שלי", "עבור", "בשביל", "לגבי",
+    "את", "זה", "זו", "אלה", "אצל", "עם", "גם", "אפשר", "ניתן", "מקבל", "מקבלת", "מקבלים", "לקבל",
+    "מסלול", "רובד", "קופה", "קופת", "חולים", "ביטוח",
+})
+# Negations and qualifiers: the question is about an exception to the row, never the row itself
+_QUALIFIERS = frozenset({
+    "not", "no", "without", "except", "excluding", "excluded", "unless", "lose", "lost", "losing", "broken",
+    "private", "outside", "abroad", "wife", "husband", "spouse", "partner", "son", "daughter",
+    "לא", "ללא", "בלי", "אין", "מלבד", "חוץ", "איבדתי", "אבד", "אבדו", "נשבר", "נשברו", "פרטי", "פרטית",
+    "פרטיים", "פרטיות", "אשתי", "בעלי", "אשתו", "בעלה",
+})
+_ALLOWED_WORDS = _QUESTION_WORDS | _LOOKUP_INTENT | frozenset(_HMO_WORDS) | frozenset(_TIER_WORDS)
+
+HMO_NAMES_EN = {"מכבי": "Maccabi", "מאוחדת": "Meuhedet", "כללית": "Clalit"}
+TIER_NAMES_EN = {"זהב": "Gold", "כסף": "Silver", "ארד": "Bronze"}
+SERVICE_NAMES_EN = {
+    "דיקור סיני (אקופונקטורה)": "Acupuncture", "שיאצו": "Shiatsu", "רפלקסולוגיה": "Reflexology",
+    "נטורופתיה": "Naturopathy", "הומאופתיה": "Homeopathy", "כירופרקטיקה": "Chiropractic",
+    "אבחון הפרעות שפה ודיבור": "Speech and language assessment", "טיפול בגמגום": "Stuttering therapy",
+    "טיפול בהפרעות קול": "Voice disorder therapy", "אבחון וטיפול בהפרעות בליעה": "Swallowing disorder care",
+    "טיפול בעיכוב התפתחותי": "Developmental delay therapy", "שיקום שמיעה": "Hearing rehabilitation",
+    "בדיקות וניקוי שיניים": "Dental checkups and cleaning", "סתימות": "Fillings",
+    "טיפולי שורש": "Root canal treatment", "כתרים ושתלים": "Crowns and implants",
+    "יישור שיניים": "Orthodontics", "טיפולים קוסמטיים": "Cosmetic dental treatments",
+    "בדיקות ראייה": "Eye exams", "משקפי ראייה": "Eyeglasses", "עדשות מגע": "Contact lenses",
+    "טיפולים לתיקון ראייה": "Vision correction procedures", "אביזרי ראייה מיוחדים": "Special vision aids",
+    "טיפול בילדים": "Children's eye care",
+    "מעקב הריון": "Pregnancy monitoring", "בדיקות סקר גנטיות": "Genetic screening tests",
+    "סקירות מערכות": "Anatomy scans", "קורס הכנה ללידה": "Childbirth preparation course",
+    "ייעוץ תזונתי": "Nutrition counseling", "טיפול בסיבוכי הריון": "Pregnancy complications care",
+    "הפסקת עישון": "Smoking cessation workshop", "תזונה נכונה": "Healthy eating workshop",
+    "פעילות גופנית": "Physical activity workshop", "ניהול מתח": "Stress management workshop",
+    "סוכרת": "Diabetes workshop", "הריון ולידה": "Pregnancy and childbirth workshop",
+}
+
+# Phrases of the benefit tables and contact lines, most specific first. A text
+# that still contains Hebrew after these is not answered in English.
+_EN_PHRASES: List[Tuple[re.Pattern, str]] = [(re.compile(pattern), replacement) for pattern, replacement in (
+    (r"ללא הנחה", "no discount"),
+    (r"(\d+)% הנחה", r"\1% discount"),
+    (r"(\d+)% כיסוי", r"\1% coverage"),
+    (r"עד (\d+) טיפולים בשנה", r"up to \1 treatments a year"),
+    (r"עד (\d+) ₪", r"up to ₪\1"),
+    (r"החלפה כל (\d+) שנים", r"replacement every \1 years"),
+    (r"החלפה כל שנתיים", "replacement every two years"),
+    (r"החלפה כל שנה וחצי", "replacement every 18 months"),
+    (r"אחריות ל-(\d+) שנים", r"\1-year warranty"),
+    (r"אחריות לשנתיים", "2-year warranty"),
+    (r"אחריות לשנה", "1-year warranty"),
+    (r"(\d+) פגישות חינם", r"\1 free sessions"),
+    (r"פגישה אחת חינם", "one free session"),
+    (r"חינם פעמיים בשנה", "free twice a year"),
+    (r"חינם פעם בשנה", "free once a year"),
+    (r"חינם כל חצי שנה", "free every six months"),
+    (r"חינם כל רבעון", "free every quarter"),
+    (r"חינם כל חודש", "free every month"),
+    (r"חינם עד גיל (\d+)", r"free up to age \1"),
+    (r"חינם", "free"),
+    (r"על ניתוח לייזר", "on laser surgery"),
+    (r"על בדיקה שנתית", "on an annual exam"),
+    (r"על מכשירי ראייה ירודה", "on low-vision devices"),
+    (r"על סקירה רגילה", "on a standard scan"),
+    (r"על סקירה מאוחרת", "on a late scan"),
+    (r"תור תוך שבועיים", "appointment within two weeks"),
+    (r"תור תוך שבוע", "appointment within a week"),
+    (r"תור תוך (\d+) ימים", r"appointment within \1 days"),
+    (r"תור תוך (\d+) שעות", r"appointment within \1 hours"),
+    (r"תור ביום", "same-day appointment"),
+    (r"תור רגיל", "regular appointment"),
+    (r"שעות קליניקה רגילות", "regular clinic hours"),
+    (r"שעות קליניקה מורחבות", "extended clinic hours"),
+    (r"קו חירום", "emergency line"),
+    (r"שלוחה (\d+)", r"ext. \1"),
+    (r"טלפון:", "Phone:"),
+    (r"מידע נוסף:", "More info:"),
+    (r"(?<!\w)או(?!\w)", "or"),
+)]
+
+FAST_PATH_REQUESTS = registry.counter(
+    "chatbot_fast_path_total",
+    "/ask questions seen by the deterministic fast path "
+    "(outcome: hit, no_match, ambiguous, off_topic, no_intent, context, unsupported, untranslated)",
+    ("outcome",))
+
+_stats: Dict[str, int] = {}
+
+
+def _record(outcome: str) -> None:
+    _stats[outcome] = _stats.get(outcome, 0) + 1
+    FAST_PATH_REQUESTS.inc(outcome=outcome)
+
+
+def snapshot_stats() -> Dict[str, float]:
+    stats: Dict[str, float] = dict(_stats)
+    hits = _stats.get("hit", 0)
+    total = sum(_stats.values())
+    stats["misses"] = total - hits
+    stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+    return stats
+
+
+def to_english(text: str) -> Optional[str]:
+    """Translate table or contact text with the phrase table; None when any Hebrew is left."""
+    for pattern, replacement in _EN_PHRASES:
+        text = pattern.sub(replacement, text)
+    return None if _HEBREW.search(text) else text
+
+
+def _word_tokens(word: str) -> FrozenSet[str]:
+    """The word's tokens, plus those of its Hebrew equivalent for English words."""
+    tokens = set(tokenize(word))
+    synonym = QUERY_SYNONYMS.get(word.lower())
+    if synonym:
+        tokens.update(tokenize(synonym))
+    return frozenset(tokens)
+
+
+def _asks_lookup(words: List[str]) -> bool:
+    for word in words:
+        word = word.lower()
+        if word in _LOOKUP_INTENT or (len(word) > 3 and word[0] in "והבלמש" and word[1:] in _LOOKUP_INTENT):
+            return True
+    return False
+
+
+def _listed(word: str, table: FrozenSet[str]) -> bool:
+    """The word, or the word without its Hebrew prefix, is in `table`."""
+    return any(token in table for token in tokenize(word))
+
+
+def _mentions(words: List[str], table: Dict[str, str]) -> Set[str]:
+    found = set()
+    for word in words:
+        word = word.lower()
+        value = table.get(word)
+        if value is None and len(word) > 3 and word[0] in "והבלמש":
+            # Hebrew one-letter prefixes: "בזהב", "למכבי"
+            value = table.get(word[1:])
+        if value is not None:
+            found.add(value)
+    return found
+
+
+def mentioned_tiers(text: str) -> Set[str]:
+    """The insurance tiers a text names, as knowledge base values."""
+    return _mentions(_WORD.findall(text), _TIER_WORDS)
+
+
+@dataclass(frozen=True)
+class _Service:
+    category: Category
+    name: str
+    # Token sets of each word of the name, and the indexes of the words that identify it
+    words: Tuple[FrozenSet[str], ...]
+    distinctive: Tuple[int, ...]
+    # Tokens of the name and of its category's name
+    vocabulary: FrozenSet[str]
+
+    def matches(self, covered: List[int]) -> bool:
+        """One identifying word is enough; a name made only of generic words must be named in full."""
+        if self.distinctive:
+            return any(i in covered for i in self.distinctive)
+        return len(covered) == len(self.words)
+
+
+@dataclass(frozen=True)
+class FastPathMatch:
+    category: Category
+    service: str
+    benefit: Benefit
+
+
+class FastPathMatcher:
+    """Maps a question onto one (category, service) row of a BenefitIndex."""
+
+    def __init__(self, benefits: BenefitIndex):
+        self.benefits = benefits
+        services = []
+        for category in benefits.categories:
+            for name in category.services:
+                words = tuple(frozenset(tokenize(word)) for word in _WORD.findall(name))
+                services.append((category, name, words))
+
+        # In how many services each word's tokens appear
+        def spread(tokens: FrozenSet[str]) -> int:
+            return sum(1 for _, _, words in services if any(tokens & other for other in words))
+
+        self.services: List[_Service] = []
+        for category, name, words in services:
+            distinctive = tuple(i for i, tokens in enumerate(words) if spread(tokens) < GENERIC_WORD_SERVICES)
+            vocabulary = frozenset(tokenize(category.name)).union(*words)
+            self.services.append(_Service(category, name, words, distinctive, vocabulary))
+        self.vocabulary = frozenset().union(*(service.vocabulary for service in self.services))
+
+    def _kb_words(self, words: List[str]) -> List[FrozenSet[str]]:
+        """Token sets of the words that touch the knowledge base vocabulary; only those matter."""
+        return [tokens for tokens in map(_word_tokens, words) if tokens & self.vocabulary]
+
+    def _best_services(self, word_tokens: List[FrozenSet[str]]) -> List[_Service]:
+        """The services named by the most words of the question."""
+        question_tokens = frozenset().union(*word_tokens)
+        best: List[_Service] = []
+        best_score = 0
+        for service in self.services:
+            covered = [i for i, tokens in enumerate(service.words) if tokens & question_tokens]
+            if not service.matches(covered):
+                continue
+            if len(covered) > best_score:
+                best, best_score = [service], len(covered)
+            elif len(covered) == best_score:
+                best.append(service)
+        return best
+
+    def topic(self, question: str) -> str:
+        """
+        What the question is about, for the response cache: "category/service"
+        when it names exactly one service (and nothing outside it), the category
+        name when all its knowledge base words belong to one category, else "".
+        """
+        word_tokens = self._kb_words(_WORD.findall(question))
+        if not word_tokens:
+            return ""
+        best = self._best_services(word_tokens)
+        if len(best) == 1 and all(tokens & best[0].vocabulary for tokens in word_tokens):
+            return f"{best[0].category.name}/{best[0].name}"
+        categories = {service.category.name for service in self.services
+                      if all(tokens & service.vocabulary for tokens in word_tokens)}
+        return categories.pop() if len(categories) == 1 else ""
+
+    def match(self, question: str, hmo: str, tier: str,
+              in_context: bool = False) -> Tuple[Optional[FastPathMatch], str]:
+        """
+        The matched row, or None and the reason it was not answered here.
+        `in_context` is set when the question follows earlier turns.
+        """
+        words = _WORD.findall(question)
+        if not words or len(words) > MAX_QUESTION_WORDS or any(word.isdigit() for word in words):
+            return None, "unsupported"
+        if _mentions(words, _HMO_WORDS) - {hmo} or _mentions(words, _TIER_WORDS) - {tier}:
+            return None, "unsupported"
+        if any(word.lower() in _OPEN_ENDED for word in words):
+            return None, "unsupported"
+
+        word_tokens = self._kb_words(words)
+        if not word_tokens:
+            return None, "no_match"
+        best = self._best_services(word_tokens)
+        if not best:
+            return None, "no_match"
+        if len(best) > 1:
+            return None, "ambiguous"
+
+        service = best[0]
+        # Every knowledge base word must be part of the matched service or its category,
+        # e.g. "glasses for children" names two services and "eye care for my teeth" another category
+        if any(not tokens & service.vocabulary for tokens in word_tokens):
+            return None, "off_topic"
+        # A bare service name ("glasses?") asks for its row; anything more has to ask for a table value,
+        # with nothing around it but question words
+        other_words = [word for word in words if not _word_tokens(word) & self.vocabulary]
+        if other_words and not _asks_lookup(words):
+            return None, "no_intent"
+        if any(_listed(word, _QUALIFIERS) for word in words) or not all(
+                _listed(word, _ALLOWED_WORDS) for word in other_words):
+            return None, "no_intent"
+        # "How many of those do I get?" after another topic is about that topic, not this one
+        if in_context and refers_back(normalize_question(question)):
+            return None, "context"
+        benefit = self.benefits.lookup(service.category.name, service.name, hmo, tier)
+        if benefit is None:
+            return None, "no_match"
+        return FastPathMatch(service.category, service.name, benefit), "hit"
+
+    def render(self, match: FastPathMatch, hmo: str, tier: str, language: str) -> Optional[str]:
+        contacts = match.category.contacts.get(hmo, [])
+        if language == "he":
+            answer = f"במסלול {tier} של {hmo}, ההטבה עבור {match.service} היא: {match.benefit.text}."
+            if contacts:
+                answer += f"\n\nליצירת קשר עם {hmo}:\n" + "\n".join(f"- {line}" for line in contacts)
+            return answer
+
+        service = SERVICE_NAMES_EN.get(match.service)
+        text = to_english(match.benefit.text)
+        contacts = [to_english(line) for line in contacts]
+        if service is None or text is None or None in contacts:
+            return None
+        hmo_name = HMO_NAMES_EN.get(hmo, hmo)
+        answer = (f"{service} ({match.service}) for {hmo_name} {TIER_NAMES_EN.get(tier, tier)} "
+                  f"members: {text}.")
+        if contacts:
+            answer += f"\n\nTo contact {hmo_name}:\n" + "\n".join(f"- {line}" for line in contacts)
+        return answer
+
+    def answer(self, question: str, hmo: str, tier: str, language: str,
+               in_context: bool = False) -> Optional[str]:
+        """A templated answer, or None to use the LLM pipeline. Every call is counted."""
+        match, outcome = self.match(question, hmo, tier, in_context)
+        answer = self.render(match, hmo, tier, language) if match is not None else None
+        if match is not None and answer is None:
+            outcome = "untranslated"
+        _record(outcome)
+        return answer
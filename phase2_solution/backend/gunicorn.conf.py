@@ -0,0 +1,83 @@
+"""
+Production launch mode: several uvicorn workers under gunicorn.
+
+    cd backend && gunicorn app:app
+
+gunicorn reads this file from the working directory. With `preload_app` the
+app is imported, and the knowledge base parsed and indexed, once in the
+master; workers are forked from it and share those objects copy-on-write, so
+starting a worker costs a fork plus its own HTTP client and knowledge base
+watcher, not a re-import and re-index.
+"""
+import gc
+import glob
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = os.getenv("WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+preload_app = True
+# Seconds a worker that is told to stop keeps failing /ready before it stops accepting (see app.DRAIN_DELAY),
+# then how long its in-flight requests and streams get to finish
+DRAIN_DELAY = float(os.getenv("DRAIN_DELAY", "0"))
+graceful_timeout = math.ceil(DRAIN_DELAY) + int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+# Recycle workers after this many requests (0 never); the jitter keeps them from restarting together
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+# Metrics directory created for this master, removed when it exits
+_own_metrics_dir = None
+
+if workers > 1:
+    # In-memory sessions would be split between workers, and size/time rotation
+    # of one log file from several processes loses records
+    os.environ.setdefault("SESSION_STORE", "sqlite")
+    os.environ.setdefault("LOG_ROTATION", "watched")
+    # Each worker publishes its metrics here, so /metrics on any worker reports the whole server
+    if "METRICS_DIR" not in os.environ:
+        os.environ["METRICS_DIR"] = _own_metrics_dir = tempfile.mkdtemp(prefix="chatbot-metrics-")
+    else:
+        # Counters start again from zero with the new master
+        for stale in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json")):
+            os.remove(stale)
+
+
+def when_ready(server):
+    # The app module was imported by preload_app; build what the workers will share
+    started = time.perf_counter()
+    from app import preload
+    from telemetry import registry
+    preload()
+    # What the master recorded while preloading (the knowledge base indexing time)
+    registry.write()
+    # Move everything allocated so far out of the collector's reach: a collection
+    # in a worker would otherwise write to (and so copy) the shared pages
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Preloaded the knowledge base in {(time.perf_counter() - started) * 1000:.0f} ms, "
+                    f"{gc.get_freeze_count()} objects frozen")
+
+
+def pre_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked in {(time.perf_counter() - worker.forked_at) * 1000:.1f} ms")
+
+
+def child_exit(server, worker):
+    # Fold the exited worker's metrics into the retired totals, so recycled workers do not pile up files
+    from telemetry import registry
+    registry.retire(worker.pid)
+
+
+def on_exit(server):
+    if _own_metrics_dir:
+        shutil.rmtree(_own_metrics_dir, ignore_errors=True)
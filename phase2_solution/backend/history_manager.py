@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Chat markup overhead per message (role, separators), as counted by the OpenAI chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+# Each user message is kept to this many characters in the local summary
+SUMMARY_LINE_CHARS = 200
+
+# (previous summary, messages to fold in) -> new summary
+Summarizer = Callable[[str, List[Dict]], Awaitable[str]]
+
+_encoder = None
+_encoder_loaded = False
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when it is installed, otherwise a UTF-8 byte estimate (about 4 bytes per token)."""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken  # optional dependency
+            _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            logger.info("tiktoken is not available; estimating token counts from text length")
+    if _encoder is not None:
+        return len(_encoder.encode(text))
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def message_tokens(msg: Dict) -> int:
+    return count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Keep the end of `text` (the most recent part) within `budget` tokens."""
+    if budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high) // 2
+        if count_tokens(text[middle:]) <= budget:
+            high = middle
+        else:
+            low = middle + 1
+    return "…" + text[low:]
+
+
+def _chain_key(previous: str, msg: Dict) -> str:
+    digest = hashlib.sha1(previous.encode("utf-8"))
+    digest.update(msg["role"].encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(msg["content"].encode("utf-8"))
+    return digest.hexdigest()
+
+
+async def local_summary(previous: str, messages: List[Dict]) -> str:
+    """Deterministic summary: what the user said in the folded turns, one line each."""
+    lines = [previous] if previous else []
+    for msg in messages:
+        if msg["role"] == "user":
+            text = " ".join(msg["content"].split())
+            if len(text) > SUMMARY_LINE_CHARS:
+                text = text[:SUMMARY_LINE_CHARS] + "…"
+            lines.append(f"- User: {text}")
+    return "\n".join(lines)
+
+
+@dataclass(frozen=True)
+class CompactHistory:
+    """A history cut down to its budget: a summary of older turns plus the most recent messages."""
+    summary: str
+    messages: List[Dict]
+    folded: int
+    tokens: int
+
+
+class HistoryManager:
+    """
+    Bounds the conversation sent to the model. The newest messages are kept
+    verbatim (at most `window`, and within the token budget); older ones are
+    folded into a running summary.
+
+    Summaries are memoized under a hash chain of the folded messages, so each
+    turn only summarizes the messages that fell out of the window since the
+    previous turn, and sessions do not need an ID.
+    """
+
+    def __init__(self, window: int = 12, summarizer: Optional[Summarizer] = local_summary,
+                 summary_share: float = 0.3, max_cached: int = 10000):
+        self.window = window
+        self.summarizer = summarizer
+        self.summary_share = summary_share
+        self.max_cached = max_cached
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"compacted": 0, "summaries_built": 0, "summary_cache_hits": 0}
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def _put(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_cached:
+                self._summaries.popitem(last=False)
+
+    async def _summarize(self, folded: List[Dict]) -> str:
+        keys, key = [], ""
+        for msg in folded:
+            key = _chain_key(key, msg)
+            keys.append(key)
+
+        # Resume from the longest folded prefix that already has a summary
+        summary, start = "", 0
+        for index in range(len(keys) - 1, -1, -1):
+            cached = self._get(keys[index])
+            if cached is not None:
+                summary, start = cached, index + 1
+                self.stats["summary_cache_hits"] += 1
+                break
+        if start < len(folded):
+            summary = await self.summarizer(summary, folded[start:])
+            self._put(keys[-1], summary)
+            self.stats["summaries_built"] += 1
+        return summary
+
+    async def compact(self, history: List[Dict], budget: int) -> CompactHistory:
+        """Fit `history` into `budget` tokens (0 or less means unbounded)."""
+        total = sum(message_tokens(msg) for msg in history)
+        if budget <= 0 or (total <= budget and len(history) <= self.window):
+            return CompactHistory("", list(history), 0, total)
+
+        # Newest messages first, while they fit in the window and the budget left for them
+        summary_budget = int(budget * self.summary_share) if self.summarizer else 0
+        recent_budget = budget - summary_budget
+        recent: List[Dict] = []
+        used = 0
+        for msg in reversed(history):
+            cost = message_tokens(msg)
+            if len(recent) >= self.window or used + cost > recent_budget:
+                break
+            recent.append(msg)
+            used += cost
+        recent.reverse()
+        folded = history[:len(history) - len(recent)]
+        if not recent and history:
+            # A single message larger than the budget: keep its end
+            last = history[-1]
+            content = truncate_to_tokens(last["content"], recent_budget - MESSAGE_OVERHEAD_TOKENS)
+            recent = [{"role": last["role"], "content": content}]
+            folded = history[:-1]
+            used = message_tokens(recent[0])
+
+        summary = ""
+        if folded and self.summarizer:
+            summary = truncate_to_tokens(await self._summarize(folded), summary_budget)
+            used += count_tokens(summary) if summary else 0
+        self.stats["compacted"] += 1
+        return CompactHistory(summary, recent, len(folded), used)
+
+    def snapshot_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats["cached_summaries"] = len(self._summaries)
+        return stats
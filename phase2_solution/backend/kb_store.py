@@ -0,0 +1,171 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base")
+
+# (file name, mtime_ns, size) for every HTML file in the directory
+Signature = Tuple[Tuple[str, int, int], ...]
+
+
+@dataclass(frozen=True)
+class KnowledgeBaseSnapshot:
+    """An immutable view of the knowledge base at one point in time."""
+    version: str
+    files: Dict[str, str]
+    content: str
+    signature: Signature
+    loaded_at: float = field(default_factory=time.time)
+
+
+def _scan(kb_dir: str) -> Signature:
+    entries = []
+    for file_path in sorted(glob.glob(os.path.join(kb_dir, "*.html"))):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            continue
+        entries.append((os.path.basename(file_path), st.st_mtime_ns, st.st_size))
+    return tuple(entries)
+
+
+def load_snapshot(kb_dir: str = DEFAULT_KB_DIR) -> KnowledgeBaseSnapshot:
+    """
+    Read every HTML file in `kb_dir` and combine them into a single snapshot.
+    Files are read in name order so the combined content (and its version)
+    is deterministic across processes and restarts.
+    """
+    signature = _scan(kb_dir)
+    if not signature:
+        raise FileNotFoundError("No HTML files found in knowledge_base directory")
+
+    files: Dict[str, str] = {}
+    digest = hashlib.sha256()
+    for filename, _, _ in signature:
+        file_path = os.path.join(kb_dir, filename)
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                files[filename] = f.read()
+        except Exception as e:
+            logger.warning("Failed to load knowledge base file %s: %s", file_path, e)
+            continue
+        digest.update(filename.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(files[filename].encode("utf-8"))
+
+    if not files:
+        raise FileNotFoundError("No knowledge base files could be loaded")
+
+    # Add a header to identify which file each part of the content came from
+    combined_content = []
+    for filename, file_content in files.items():
+        combined_content.append(f"\n\n=== KNOWLEDGE BASE FILE: {filename} ===\n")
+        combined_content.append(file_content)
+
+    return KnowledgeBaseSnapshot(
+        version=digest.hexdigest()[:16],
+        files=files,
+        content="\n".join(combined_content),
+        signature=signature,
+    )
+
+
+class KnowledgeBaseStore:
+    """
+    Holds the parsed knowledge base in memory and keeps it fresh.
+
+    The store is loaded once at application startup. A background thread polls
+    the directory's file mtimes and sizes, and when they change builds a new
+    snapshot off to the side and swaps it in with a single reference
+    assignment, so readers never observe a half-built knowledge base.
+    """
+
+    def __init__(self, kb_dir: str = DEFAULT_KB_DIR, poll_interval: float = 2.0):
+        self.kb_dir = kb_dir
+        self.poll_interval = poll_interval
+        self._snapshot: Optional[KnowledgeBaseSnapshot] = None
+        self._listeners: List[Callable[[KnowledgeBaseSnapshot], None]] = []
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def snapshot(self) -> KnowledgeBaseSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise FileNotFoundError("Knowledge base has not been loaded")
+        return snapshot
+
+    @property
+    def version(self) -> Optional[str]:
+        """Content hash of the current snapshot; usable as a cache key or ETag."""
+        snapshot = self._snapshot
+        return snapshot.version if snapshot else None
+
+    @property
+    def content(self) -> str:
+        return self.snapshot.content
+
+    def subscribe(self, listener: Callable[[KnowledgeBaseSnapshot], None]) -> None:
+        """Register a callback invoked with every newly loaded snapshot."""
+        self._listeners.append(listener)
+        if self._snapshot is not None:
+            listener(self._snapshot)
+
+    def reload(self) -> KnowledgeBaseSnapshot:
+        with self._reload_lock:
+            snapshot = load_snapshot(self.kb_dir)
+            previous = self._snapshot
+            if previous is not None and previous.version == snapshot.version:
+                # Files were touched but their content did not change
+                self._snapshot = snapshot
+                return snapshot
+            # Listeners that read the store see the snapshot they are called with
+            self._snapshot = snapshot
+            try:
+                for listener in self._listeners:
+                    listener(snapshot)
+            except Exception:
+                # Keep the previous snapshot, so the watcher retries the new files
+                self._snapshot = previous
+                raise
+        logger.info("Loaded %d knowledge base files (version %s)", len(snapshot.files), snapshot.version)
+        return snapshot
+
+    def start(self) -> None:
+        """Load the knowledge base and start watching the directory for changes."""
+        try:
+            self.reload()
+        except FileNotFoundError as e:
+            logger.error("Knowledge base files not found: %s", e)
+        if self.poll_interval > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="kb-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            snapshot = self._snapshot
+            signature = _scan(self.kb_dir)
+            if snapshot is not None and signature == snapshot.signature:
+                continue
+            if not signature:
+                continue
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep serving the last good snapshot
+                logger.warning("Failed to reload knowledge base: %s", e)
@@ -0,0 +1,397 @@
+import asyncio
+import logging
+import os
+import ssl
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncAzureOpenAI,
+    DefaultAsyncHttpxClient,
+    InternalServerError,
+    RateLimitError
+)
+from telemetry import (
+    LLM_CALL_SECONDS,
+    LLM_FALLBACKS,
+    LLM_FIRST_TOKEN_SECONDS,
+    LLM_HEDGES,
+    LLM_RETRIES,
+    LLM_TOKENS,
+    span
+)
+from upstream import PRIORITY_INTERACTIVE, UpstreamScheduler, backoff, estimate_tokens
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Configuration ---
+# 2024-10-21 or later reports cached prompt tokens and usage on streamed completions
+API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21")
+# Upstream requests allowed in flight per worker; the rest wait in line
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+# How long a request may wait for a free slot before failing with 503
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+# Retries of throttled (429), timed-out and 5xx calls, with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Per-deployment budgets; 0 learns them from the x-ratelimit-remaining-* response headers
+LLM_RPM_LIMIT = float(os.getenv("LLM_RPM_LIMIT", "0"))
+LLM_TPM_LIMIT = float(os.getenv("LLM_TPM_LIMIT", "0"))
+# Completion tokens counted against the TPM budget for each call
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "500"))
+# Send a second copy of a slow interactive call: seconds, "p95" (of recent calls), or "off"
+LLM_HEDGE_AFTER = os.getenv("LLM_HEDGE_AFTER", "off")
+# Cheaper/faster deployment that callers may opt into when the primary one is throttled or failing
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+# Ask for a final usage chunk on streamed completions (needs a 2024-09-01-preview or later API version)
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "1") == "1"
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+T = TypeVar("T")
+
+client: Optional[AsyncAzureOpenAI] = None
+# TLS settings with the CA bundle loaded, shared by every client in the process (and with forked workers)
+_ssl_context: Optional[ssl.SSLContext] = None
+scheduler = UpstreamScheduler(LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT, LLM_RPM_LIMIT, LLM_TPM_LIMIT)
+# Recent time-to-first-token samples (seconds) of streamed completions
+_ttft_samples: Deque[float] = deque(maxlen=1000)
+# Token usage reported by the provider; cached tokens are prompt tokens served from its prompt cache
+_usage = {"calls_with_usage": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+
+def warm_client() -> None:
+    """
+    Do the parts of building a client that do not depend on the process: the
+    HTTP transport's imports (httpx loads them with the first client) and the
+    TLS context. Called in the gunicorn master, so forked workers skip them.
+    """
+    global _ssl_context
+    import httpcore  # noqa: F401
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+
+
+def init_client() -> Optional[AsyncAzureOpenAI]:
+    """
+    Create the shared async client. All requests reuse one HTTP connection pool,
+    so TLS handshakes are paid once per connection instead of once per call.
+    """
+    global client
+    try:
+        endpoint = os.environ["AZURE_OPENAI_ENDPOINT"]
+        api_key = os.environ["AZURE_OPENAI_API_KEY"]
+    except KeyError as e:
+        logger.error("Environment variable not set: %s", e)
+        client = None
+        return None
+
+    warm_client()
+    http_client = DefaultAsyncHttpxClient(
+        verify=_ssl_context,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        # Every response updates the rate-limit budget of its deployment
+        event_hooks={"response": [scheduler.observe_response]},
+    )
+    client = AsyncAzureOpenAI(
+        azure_endpoint=endpoint,
+        api_key=api_key,
+        api_version=API_VERSION,
+        # Retries go through the scheduler, so they wait for the budget like any other call
+        max_retries=0,
+        http_client=http_client,
+    )
+    return client
+
+
+def client_ready() -> bool:
+    return client is not None
+
+
+async def close_client() -> None:
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+
+def llm_stats() -> Dict[str, float]:
+    stats = {"in_flight": scheduler.in_flight, "waiting": scheduler.waiting, "max_concurrency": LLM_MAX_CONCURRENCY}
+    if _ttft_samples:
+        ordered = sorted(_ttft_samples)
+        stats["ttft_p50_ms"] = round(ordered[len(ordered) // 2] * 1000, 1)
+        stats["ttft_p95_ms"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1)
+        stats["ttft_samples"] = len(ordered)
+    stats.update(_usage)
+    if _usage["prompt_tokens"]:
+        stats["cached_token_ratio"] = round(_usage["cached_tokens"] / _usage["prompt_tokens"], 4)
+    stats["budgets"] = scheduler.snapshot()
+    return stats
+
+
+def _record_usage(usage, model: str, trace_span=None) -> None:
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    _usage["calls_with_usage"] += 1
+    _usage["prompt_tokens"] += usage.prompt_tokens or 0
+    _usage["cached_tokens"] += cached
+    _usage["completion_tokens"] += usage.completion_tokens or 0
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, type="prompt")
+    LLM_TOKENS.inc(cached, model=model, type="cached")
+    LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, type="completion")
+    if trace_span is not None:
+        trace_span.set(prompt_tokens=usage.prompt_tokens, cached_tokens=cached,
+                       completion_tokens=usage.completion_tokens)
+    logger.debug("LLM usage: %d prompt tokens (%d cached), %d completion tokens",
+                 usage.prompt_tokens, cached, usage.completion_tokens)
+
+
+def _outcome(e: Optional[Exception]) -> str:
+    if e is None:
+        return "ok"
+    return "timeout" if isinstance(e, APITimeoutError) else "error"
+
+
+def _to_http_error(e: Exception) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, APITimeoutError):
+        logger.error("Timed out calling Azure OpenAI: %s", e)
+        return HTTPException(status_code=504, detail="The LLM took too long to respond.")
+    if isinstance(e, RateLimitError):
+        logger.error("Azure OpenAI is still throttling after %d retries", LLM_MAX_RETRIES)
+        return HTTPException(status_code=503, detail="The assistant is busy, please try again shortly.")
+    logger.error("Error calling Azure OpenAI: %s", e)
+    return HTTPException(status_code=500, detail="Failed to get response from LLM.")
+
+
+async def _send(call: Callable[[str], Awaitable[T]], model: str, tokens: int, priority: int,
+                fallback_model: Optional[str]) -> Tuple[T, str]:
+    """
+    Run `call(deployment)` once the scheduler admits it, retrying throttled and
+    transient failures with jittered backoff. With `fallback_model`, the call
+    moves to that deployment when `model` is out of budget, and for retries.
+    On success the caller owns the scheduler slot and must release it.
+    """
+    if not client: raise HTTPException(status_code=500, detail="Azure OpenAI client is not configured.")
+    attempt = 0
+    while True:
+        target = fallback_model if fallback_model and attempt else scheduler.choose(model, tokens, fallback_model)
+        if target != model:
+            LLM_FALLBACKS.inc(model=model, fallback=target)
+        with span("llm_queue"):
+            await scheduler.acquire(target, tokens, priority)
+        try:
+            return await call(target), target
+        except RETRYABLE_ERRORS as e:
+            scheduler.release()
+            if attempt >= LLM_MAX_RETRIES:
+                raise _to_http_error(e)
+            # A 429 has already paused the deployment for its retry-after (see
+            # UpstreamScheduler.observe_response), so the retry waits in the queue
+            delay = backoff(attempt, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY)
+            attempt += 1
+            LLM_RETRIES.inc()
+            logger.warning("LLM call failed (%s), retry %d/%d in %.1fs", type(e).__name__, attempt, LLM_MAX_RETRIES, delay)
+            await asyncio.sleep(delay)
+        except BaseException as e:
+            scheduler.release()
+            if isinstance(e, Exception):
+                raise _to_http_error(e)
+            raise
+
+
+def _hedge_delay(model: str, priority: int) -> Optional[float]:
+    if priority != PRIORITY_INTERACTIVE or LLM_HEDGE_AFTER == "off":
+        return None
+    if LLM_HEDGE_AFTER == "p95":
+        return scheduler.latency_quantile(model, 0.95)
+    return float(LLM_HEDGE_AFTER)
+
+
+async def _hedged(call: Callable[[str], Awaitable[T]], model: str, tokens: int, delay: Optional[float]) -> T:
+    """
+    Await `call(model)`; if it is still running after `delay` and a slot and
+    budget are free, send a second copy and return whichever finishes first.
+    """
+    if delay is None:
+        return await call(model)
+    first = asyncio.ensure_future(call(model))
+    pending = {first}
+    hedged = False
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done or not scheduler.try_acquire(model, tokens):
+            pending = set()
+            return await first
+        hedged = True
+        second = asyncio.ensure_future(call(model))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    LLM_HEDGES.inc(model=model, winner="hedge" if task is second else "original")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # The losing copy, or both if the caller was cancelled
+        for task in pending:
+            task.cancel()
+        if hedged:
+            scheduler.release()
+
+
+async def get_llm_response(messages: List[dict], model: str = "gpt-4o", as_json: bool = False,
+                           timeout: Optional[float] = None, priority: int = PRIORITY_INTERACTIVE,
+                           fallback_model: Optional[str] = None) -> str:
+    tokens = estimate_tokens(messages, LLM_EXPECTED_COMPLETION_TOKENS)
+    response_format = {"type": "json_object"} if as_json else {"type": "text"}
+
+    async def create(deployment: str):
+        return await client.chat.completions.create(
+            model=deployment,
+            messages=messages,
+            response_format=response_format,
+            timeout=timeout if timeout is not None else LLM_TIMEOUT,
+        )
+
+    async def call(deployment: str):
+        started = time.perf_counter()
+        error: Optional[Exception] = None
+        try:
+            with span("llm", model=deployment, json=as_json) as trace_span:
+                resp = await _hedged(create, deployment, tokens, _hedge_delay(deployment, priority))
+                _record_usage(resp.usage, deployment, trace_span)
+            scheduler.record_latency(deployment, time.perf_counter() - started)
+            return resp
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            LLM_CALL_SECONDS.observe(time.perf_counter() - started, model=deployment, kind="complete",
+                                     outcome=_outcome(error))
+
+    resp, _ = await _send(call, model, tokens, priority, fallback_model)
+    scheduler.release()
+    return resp.choices[0].message.content
+
+
+async def stream_llm_response(messages: List[dict], model: str = "gpt-4o",
+                              timeout: Optional[float] = None, priority: int = PRIORITY_INTERACTIVE,
+                              fallback_model: Optional[str] = None) -> "LLMStream":
+    """
+    Open a streaming completion and return an iterator over its text deltas,
+    which must be closed with `aclose()`. Failures before the stream opens raise
+    HTTPException like `get_llm_response`, so callers can still return a proper
+    error status.
+    """
+    tokens = estimate_tokens(messages, LLM_EXPECTED_COMPLETION_TOKENS)
+    extra = {"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {}
+    started = time.perf_counter()
+
+    async def open_stream(deployment: str):
+        try:
+            return await client.chat.completions.create(
+                model=deployment,
+                messages=messages,
+                stream=True,
+                timeout=timeout if timeout is not None else LLM_TIMEOUT,
+                **extra,
+            )
+        except Exception as e:
+            LLM_CALL_SECONDS.observe(time.perf_counter() - started, model=deployment, kind="stream",
+                                     outcome=_outcome(e))
+            raise
+
+    # The slot stays taken until the stream is closed
+    stream, deployment = await _send(open_stream, model, tokens, priority, fallback_model)
+    return LLMStream(stream, started, deployment)
+
+
+class LLMStream:
+    """
+    The text deltas of a streamed completion. It holds a scheduler slot and an
+    open HTTP response until `aclose()`, which the caller must await even when it
+    never iterates (a client that disconnects before the first delta, for
+    instance); an async generator that was never started skips its `finally`.
+    """
+
+    def __init__(self, stream, started: float, model: str):
+        self._stream = stream
+        self._started = started
+        self._model = model
+        self._first_token = True
+        self._closed = False
+
+    def __aiter__(self) -> "LLMStream":
+        return self
+
+    async def __anext__(self) -> str:
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            while True:
+                chunk = await self._stream.__anext__()
+                # The usage chunk comes last, with no choices
+                _record_usage(getattr(chunk, "usage", None), self._model)
+                # Azure sends a leading chunk with content-filter results and no choices
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if self._first_token:
+                    self._first_token = False
+                    ttft = time.perf_counter() - self._started
+                    _ttft_samples.append(ttft)
+                    LLM_FIRST_TOKEN_SECONDS.observe(ttft, model=self._model)
+                    logger.debug("LLM time to first token: %.0f ms", ttft * 1000)
+                return delta
+        except StopAsyncIteration:
+            await self.aclose()
+            raise
+        except Exception as e:
+            await self.aclose(e)
+            raise
+
+    def _finish(self, error: Optional[Exception]) -> bool:
+        """Give the slot back (once); False if that already happened."""
+        if self._closed:
+            return False
+        self._closed = True
+        LLM_CALL_SECONDS.observe(time.perf_counter() - self._started, model=self._model, kind="stream",
+                                 outcome=_outcome(error))
+        scheduler.release()
+        return True
+
+    async def aclose(self, error: Optional[Exception] = None) -> None:
+        if not self._finish(error):
+            return
+        # Also runs while the request is being cancelled; the connection must still go back to the pool
+        await asyncio.shield(self._stream.close())
+
+    def __del__(self):
+        # Last resort for a stream that was opened but never handed to a response
+        if self._finish(None):
+            logger.warning("LLM stream on %s was never closed", self._model)
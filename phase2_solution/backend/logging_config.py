@@ -1,11 +1,305 @@
+"""
+Logging setup for the backend.
+
+Request handlers only put records on an in-memory queue; a background thread
+writes them in batches (one flush per batch) to the console and a rotating
+log file. Records can be sampled, rendered as JSON, and have ID, card and
+phone numbers and e-mail addresses masked before they are written.
+
+Warnings and errors are never sampled. When the queue is full, records are
+dropped (and counted) rather than blocking the request. A forked worker
+(gunicorn with `preload_app`) starts its own writer thread.
+"""
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from telemetry import registry
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_FILE = os.getenv("LOG_FILE", "chatbot.log")  # empty disables the file
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "1") == "1"
+# "size", "time", "watched" (reopen after an external logrotate; safe with several workers) or "off"
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.2"))
+# Fraction of INFO/DEBUG records kept per message template, e.g. 0.1 keeps every 10th
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_REDACT_PII = os.getenv("LOG_REDACT_PII", "1") == "1"
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+LOG_RECORDS_DROPPED = registry.counter(
+    "chatbot_log_records_dropped_total", "Log records not written (reason: sampled, queue_full)", ("reason",))
+
+_configured = False
+_front: Optional["NonBlockingQueueHandler"] = None
+_listener: Optional["BatchingQueueListener"] = None
+
+
+# --- PII redaction ---
+# 9-digit ID and HMO card numbers keep their last two digits, so log lines can still be told apart
+_ID_NUMBER = re.compile(r"(?<!\d)\d{7}(\d{2})(?!\d)")
+_PHONE = re.compile(r"(?<![\d+])(?:\+972[- ]?|0)(?:[23489]|5\d|7\d)[- ]?\d{3}[- ]?\d{4}(?!\d)")
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+
+def redact(text: str) -> str:
+    text = _EMAIL.sub("<email>", text)
+    text = _PHONE.sub("<phone>", text)
+    return _ID_NUMBER.sub(r"*******\1", text)
+
+
+class RedactingFilter(logging.Filter):
+    """Masks PII in the rendered message and traceback; runs on the writer thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every 1/rate INFO/DEBUG records per (logger, message template); the first is always kept.
+    Only the most recently seen `max_keys` templates are counted, so messages built with an f-string
+    cannot grow it without bound.
+    """
+
+    def __init__(self, rate: float, max_keys: int = 4096):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.max_keys = max_keys
+        self._seen: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.every == 1:
+            return True
+        if self.every == 0:
+            LOG_RECORDS_DROPPED.inc(reason="sampled")
+            return False
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._seen.get(key, 0)
+            self._seen[key] = count + 1
+            self._seen.move_to_end(key)
+            if len(self._seen) > self.max_keys:
+                self._seen.popitem(last=False)
+        if count % self.every == 0:
+            return True
+        LOG_RECORDS_DROPPED.inc(reason="sampled")
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# --- Handlers ---
+class _DeferredFlush:
+    """Handler mixin: while `deferred` is set, `flush()` is left to the end of the batch."""
+    deferred = False
+
+    def flush(self):
+        if not self.deferred:
+            super().flush()
+
+
+class ConsoleHandler(_DeferredFlush, logging.StreamHandler):
+    pass
+
+
+class PlainFileHandler(_DeferredFlush, logging.FileHandler):
+    pass
+
+
+class SizeRotatingFileHandler(_DeferredFlush, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class TimeRotatingFileHandler(_DeferredFlush, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class WatchedFileHandler(_DeferredFlush, logging.handlers.WatchedFileHandler):
+    pass
+
+
+def build_handlers() -> List[logging.Handler]:
+    handlers: List[logging.Handler] = []
+    if LOG_CONSOLE:
+        handlers.append(ConsoleHandler())
+    if LOG_FILE:
+        if LOG_ROTATION == "size":
+            handlers.append(SizeRotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                                                    backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+        elif LOG_ROTATION == "time":
+            handlers.append(TimeRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN,
+                                                    backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+        elif LOG_ROTATION == "watched":
+            handlers.append(WatchedFileHandler(LOG_FILE, encoding="utf-8"))
+        else:
+            handlers.append(PlainFileHandler(LOG_FILE, encoding="utf-8"))
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        if LOG_REDACT_PII:
+            handler.addFilter(RedactingFilter())
+    return handlers
+
+
+# --- Queue ---
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped and counted."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and traceback now (the arguments may change after
+        # the call returns), but leave formatting and redaction to the writer
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class BatchingQueueListener:
+    """Drains the queue on a background thread, handling up to `batch_size` records per flush."""
+
+    _STOP = None
+
+    def __init__(self, log_queue: queue.Queue, handlers: List[logging.Handler],
+                 batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        # Blocks until there is room, so records queued before the sentinel are written
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = []
+            record = self.queue.get()
+            # Collect what arrives within the flush interval, up to the batch size
+            deadline = time.monotonic() + self.flush_interval
+            while record is not self._STOP:
+                batch.append(record)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            stopping = record is self._STOP
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        for handler in self.handlers:
+            handler.deferred = True
+        try:
+            for record in batch:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+        finally:
+            for handler in self.handlers:
+                handler.deferred = False
+                handler.flush()
+
 
 def configure_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-        handlers=[
-            logging.FileHandler("chatbot.log", encoding="utf-8"),
-            logging.StreamHandler()
-        ]
-    )
+    global _configured, _front, _listener
+    if _configured:
+        return
+    _configured = True
+    handlers = build_handlers()
+    if LOG_ASYNC:
+        front = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = BatchingQueueListener(front.queue, handlers)
+        _listener.start()
+        # Write out what is still queued when the process exits
+        atexit.register(shutdown_logging)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+        _front = front
+        handlers = [front]
+    if LOG_SAMPLE_RATE < 1:
+        # Shared between handlers, so a record is kept or dropped everywhere
+        sampler = SamplingFilter(LOG_SAMPLE_RATE)
+        for handler in handlers:
+            handler.addFilter(sampler)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+
+
+def _restart_after_fork() -> None:
+    """A forked child inherits the queue handler but not the writer thread: give it its own queue and writer."""
+    global _listener
+    if _listener is None or _front is None:
+        return
+    _front.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = BatchingQueueListener(_front.queue, _listener.handlers)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Write out everything still queued; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,10 +1,24 @@
-from typing import List, Dict, Any
+import json
+from typing import List, Dict, Any, Optional
 
 UserInfoDict = Dict[str, Any]
 
-def info_collection_prompt(history: List[Dict], language: str) -> List[Dict]:
+def conversation_context(known: Optional[Dict[str, Any]], summary: str, verify: bool = False) -> str:
+    """Structured state and the summary of older turns that were dropped from the history."""
+    parts = []
+    if known and verify:
+        parts.append("Details parsed automatically from the conversation (check each one against the conversation "
+                     f"and correct or drop it if the user did not say it): {json.dumps(known, ensure_ascii=False)}")
+    elif known:
+        parts.append(f"Details the user has already provided: {json.dumps(known, ensure_ascii=False)}")
+    if summary:
+        parts.append(f"Summary of the earlier conversation:\n{summary}")
+    return "\n\n".join(parts)
+
+def info_collection_prompt(history: List[Dict], language: str, known: Optional[Dict[str, Any]] = None,
+                           summary: str = "") -> List[Dict]:
     lang_instruction = "Hebrew" if language == "he" else "English"
-    return [
+    messages = [
         {
             "role": "system",
             "content": f"""You are a friendly assistant for a health insurance provider. Your goal is to collect user information in a natural, conversational way.
@@ -13,9 +27,18 @@ def info_collection_prompt(history: List[Dict], language: str) -> List[Dict]:
 - The required pieces of information are: first name, last name, 9-digit ID number, gender, age, HMO name (must be one of: מכבי, מאוחדת, כללית), 9-digit HMO card number, and insurance tier (must be one of: זהב, כסף, ארד).
 - Keep the entire conversation in {lang_instruction}."""
         }
-    ] + history
+    ]
+    context = conversation_context(known, summary)
+    if context:
+        messages.append({"role": "system", "content": f"{context}\nDo not ask again for details that were already provided."})
+    return messages + history
 
-def extraction_prompt(history: List[Dict]) -> List[Dict]:
+def format_transcript(history: List[Dict]) -> str:
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in history)
+
+def extraction_prompt(history: List[Dict], known: Optional[Dict[str, Any]] = None, summary: str = "") -> List[Dict]:
+    # The known details come from the local parser, which the model checks rather than copies
+    context = conversation_context(known, summary, verify=True)
     return [
         {
             "role": "system",
@@ -23,7 +46,21 @@ def extraction_prompt(history: List[Dict]) -> List[Dict]:
 The required fields are: `first_name`, `last_name`, `id_number` (9 digits), `gender` ('male', 'female', or 'other'), `age` (0-120), `hmo` ('מכבי', 'מאוחדת', 'כללית'), `card_number` (9 digits), and `tier` ('זהב', 'כסף', 'ארד').
 If any piece of information is missing, respond with the word "None"."""
         },
-        { "role": "user", "content": f"Here is the conversation history:\n\n{history}"}
+        { "role": "user", "content": (f"{context}\n\n" if context else "") + f"Here is the conversation history:\n\n{format_transcript(history)}"}
+    ]
+
+def summary_prompt(previous_summary: str, messages: List[Dict]) -> List[Dict]:
+    return [
+        {
+            "role": "system",
+            "content": "Update the running summary of a conversation between a health insurance member and an assistant. "
+                       "Keep every fact the user stated and every question they asked, drop greetings and repetition, "
+                       "and answer with the new summary only, in at most 120 words."
+        },
+        {
+            "role": "user",
+            "content": f"Current summary:\n{previous_summary or '(empty)'}\n\nNew messages:\n{format_transcript(messages)}"
+        }
     ]
 
 def info_confirmation_prompt(user_info: UserInfoDict, language: str) -> List[Dict]:
@@ -53,18 +90,41 @@ def info_confirmation_prompt(user_info: UserInfoDict, language: str) -> List[Dic
         )
     return [{"role": "system", "content": content}]
 
-def qa_prompt(user_info: UserInfoDict, history: List[Dict], new_question: str, knowledge_base: str, language: str) -> List[Dict]:
-    lang_instruction = "Hebrew" if language == "he" else "English"
-    system_message = (
-        f"You are a helpful assistant for members of {user_info.hmo}. "
-        f"The user's current insurance tier is: {user_info.tier}. "
-        f"Answer the user's questions in {lang_instruction}, based *only* on the information provided in the HTML knowledge base below. "
+def qa_system_prefix(knowledge_base: str) -> str:
+    """
+    The first system message of /ask. It holds nothing user-specific, so it is
+    byte-identical for every member who gets the same knowledge base context and
+    can be served from the provider's prompt cache.
+    """
+    return (
+        "You are a helpful assistant for members of Israeli HMOs (health maintenance organizations). "
+        "Answer the user's questions based *only* on the information provided in the knowledge base below. "
+        "The knowledge base lists services and benefits by HMO and insurance tier; use only what applies to "
+        "the user's HMO and tier, which are given after it. "
         "If the answer is not in the knowledge base, state that you do not have that information.\n\n"
         "--- KNOWLEDGE BASE START ---\n"
         f"{knowledge_base}\n"
         "--- KNOWLEDGE BASE END ---"
     )
-    messages = [{"role": "system", "content": system_message}]
+
+def qa_prompt(user_info: UserInfoDict, history: List[Dict], new_question: str, system_prefix: str, language: str,
+              summary: str = "") -> List[Dict]:
+    """
+    The static `system_prefix` (from `qa_system_prefix`) first, then the member's
+    details, the summary, the history and the question.
+    """
+    lang_instruction = "Hebrew" if language == "he" else "English"
+    member_message = (
+        f"The user is a member of {user_info.hmo}. "
+        f"The user's current insurance tier is: {user_info.tier}. "
+        f"Answer in {lang_instruction}."
+    )
+    if summary:
+        member_message += f"\n\nSummary of the earlier conversation:\n{summary}"
+    messages = [
+        {"role": "system", "content": system_prefix},
+        {"role": "system", "content": member_message},
+    ]
     messages.extend([{"role": msg['role'], "content": msg['content']} for msg in history])
     messages.append({"role": "user", "content": new_question})
-    return messages
\ No newline at end of file
+    return messages
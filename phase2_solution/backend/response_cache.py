@@ -0,0 +1,278 @@
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_NIQQUD = re.compile(r"[֑-ׇ]")
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+# Words whose presence changes the answer even when the rest of the question matches
+_CRITICAL_WORDS = frozenset({
+    "זהב", "כסף", "ארד", "gold", "silver", "bronze",
+    "מכבי", "מאוחדת", "כללית", "maccabi", "meuhedet", "clalit",
+})
+# Openings that refer back to an earlier turn, so the question is not self-contained
+_FOLLOW_UP = re.compile(r"^(and|what about|how about|also|same|ומה|מה לגבי|וגם|ו?באותו)\b")
+# Words that point at something said earlier ("is it covered for kids", "what is the discount for that")
+_REFERRING_WORDS = frozenset({
+    "it", "its", "that", "this", "these", "those", "they", "them", "there", "same", "one", "ones",
+    "זה", "זו", "זאת", "הזה", "הזאת", "אותו", "אותה", "אותם", "אותן", "עליו", "עליה", "שם", "גם", "כזה", "כזאת",
+})
+
+# (hmo, tier, language, kb version, topic): the topic is the knowledge base service
+# ("category/service") or category the question names, or "" when it names none
+Scope = Tuple[str, str, str, str, str]
+
+
+def normalize_question(question: str) -> str:
+    text = _NIQQUD.sub("", question.lower())
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def refers_back(normalized: str) -> bool:
+    """Whether a normalized question points at something said earlier."""
+    for word in normalized.split():
+        if word in _REFERRING_WORDS or (word[0] in "והבלמש" and word[1:] in _REFERRING_WORDS):
+            return True
+    return False
+
+
+def is_cacheable(question: str, topic: str = "", in_context: bool = False) -> bool:
+    """
+    Short or follow-up questions depend on the conversation, so their answers
+    are not shared. Within a conversation (`in_context`) a question is only
+    self-contained when it names its topic itself and refers to nothing earlier;
+    "how many treatments do I get" means something else after each topic.
+    """
+    normalized = normalize_question(question)
+    if len(normalized.split()) < 3 or _FOLLOW_UP.match(normalized):
+        return False
+    return not in_context or (bool(topic) and not refers_back(normalized))
+
+
+def _critical(normalized: str) -> FrozenSet[str]:
+    found = set()
+    for word in normalized.split():
+        if word.isdigit() or word in _CRITICAL_WORDS:
+            found.add(word)
+        elif word[1:] in _CRITICAL_WORDS and word[0] in "והבלמש":
+            # Hebrew one-letter prefixes: "בזהב", "לכסף"
+            found.add(word[1:])
+    return frozenset(found)
+
+
+# --- Storage backends ---
+class InMemoryBackend:
+    """Per-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """
+    Shared store for multi-worker deployments. Works with Redis or any
+    Redis-compatible server (KeyDB, Valkey, ...). Eviction is left to the
+    server's TTLs and `maxmemory-policy allkeys-lru`.
+    """
+
+    def __init__(self, url: str, prefix: str = "hmo-chatbot:answer:"):
+        import redis.asyncio as redis  # optional dependency, only needed for this backend
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+# --- Near-duplicate index ---
+class MinHashIndex:
+    """
+    Locality-sensitive index over character 3-gram MinHash signatures, used to
+    find previously answered questions that differ only in wording.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, max_entries: int = 10000):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        # Fixed seed so signatures are identical across workers and restarts
+        rng = random.Random(20240601)
+        self._params = [(rng.randrange(1, self._PRIME), rng.randrange(0, self._PRIME)) for _ in range(num_perm)]
+        # key -> (scope, signature, critical words)
+        self._entries: "OrderedDict[str, Tuple[Scope, Tuple[int, ...], FrozenSet[str]]]" = OrderedDict()
+        self._buckets: Dict[Tuple[Scope, int, Tuple[int, ...]], List[str]] = {}
+        self._lock = threading.Lock()
+
+    def signature(self, normalized: str) -> Tuple[int, ...]:
+        text = f" {normalized} "
+        shingles = {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+                  for s in shingles]
+        return tuple(
+            min((a * h + b) % self._PRIME for h in hashes)
+            for a, b in self._params
+        )
+
+    def _bands(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, key: str, scope: Scope, normalized: str) -> None:
+        signature = self.signature(normalized)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (scope, signature, _critical(normalized))
+            for band, rows in self._bands(signature):
+                self._buckets.setdefault((scope, band, rows), []).append(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (old_scope, old_signature, _) = self._entries.popitem(last=False)
+                for band, rows in self._bands(old_signature):
+                    bucket = self._buckets.get((old_scope, band, rows))
+                    if bucket and old_key in bucket:
+                        bucket.remove(old_key)
+                        if not bucket:
+                            del self._buckets[(old_scope, band, rows)]
+
+    def query(self, scope: Scope, normalized: str, threshold: float) -> Optional[str]:
+        signature = self.signature(normalized)
+        critical = _critical(normalized)
+        best_key, best_score = None, threshold
+        with self._lock:
+            candidates = set()
+            for band, rows in self._bands(signature):
+                candidates.update(self._buckets.get((scope, band, rows), ()))
+            for key in candidates:
+                _, other, other_critical = self._entries[key]
+                if other_critical != critical:
+                    continue
+                score = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+                if score >= best_score:
+                    best_key, best_score = key, score
+        return best_key
+
+
+class ResponseCache:
+    """
+    Two-tier cache for /ask answers: an exact tier keyed on the normalized
+    question plus (hmo, tier, language, kb version, topic), and an optional
+    near-duplicate tier that maps a new wording onto a cached exact key. Only
+    questions with a topic use the near-duplicate tier, and only within that
+    topic, since a few changed letters can name another service.
+    """
+
+    def __init__(self, backend, ttl: float = 3600, near_duplicates: bool = True,
+                 near_threshold: float = 0.8, max_entries: int = 10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.near_threshold = near_threshold
+        self.near_index = MinHashIndex(max_entries=max_entries) if near_duplicates else None
+        self.stats = {"exact_hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "skipped": 0}
+
+    @staticmethod
+    def make_key(scope: Scope, normalized: str) -> str:
+        return hashlib.sha256("\0".join(scope + (normalized,)).encode("utf-8")).hexdigest()
+
+    async def get(self, scope: Scope, question: str, in_context: bool = False) -> Optional[str]:
+        if not is_cacheable(question, scope[-1], in_context):
+            self.stats["skipped"] += 1
+            return None
+        normalized = normalize_question(question)
+        try:
+            answer = await self.backend.get(self.make_key(scope, normalized))
+            if answer is not None:
+                self.stats["exact_hits"] += 1
+                return answer
+            if self.near_index is not None and scope[-1]:
+                near_key = self.near_index.query(scope, normalized, self.near_threshold)
+                if near_key is not None:
+                    answer = await self.backend.get(near_key)
+                    if answer is not None:
+                        self.stats["near_hits"] += 1
+                        return answer
+        except Exception as e:
+            # A cache outage must never fail the request
+            logger.warning("Response cache lookup failed: %s", e)
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, scope: Scope, question: str, answer: str, in_context: bool = False) -> None:
+        if not is_cacheable(question, scope[-1], in_context) or not answer:
+            return
+        normalized = normalize_question(question)
+        key = self.make_key(scope, normalized)
+        try:
+            await self.backend.set(key, answer, self.ttl)
+        except Exception as e:
+            logger.warning("Response cache store failed: %s", e)
+            return
+        if self.near_index is not None and scope[-1]:
+            self.near_index.add(key, scope, normalized)
+        self.stats["stores"] += 1
+
+    def snapshot_stats(self) -> Dict[str, float]:
+        stats = dict(self.stats)
+        lookups = stats["exact_hits"] + stats["near_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["exact_hits"] + stats["near_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def create_response_cache(kind: str, ttl: float, max_entries: int, near_duplicates: bool,
+                          near_threshold: float, redis_url: str) -> Optional[ResponseCache]:
+    if kind == "off":
+        return None
+    if kind == "redis":
+        try:
+            backend = RedisBackend(redis_url)
+        except ImportError:
+            logger.error("RESPONSE_CACHE=redis requires the 'redis' package; falling back to the in-memory cache")
+            backend = InMemoryBackend(max_entries)
+    else:
+        backend = InMemoryBackend(max_entries)
+    return ResponseCache(backend, ttl=ttl, near_duplicates=near_duplicates,
+                         near_threshold=near_threshold, max_entries=max_entries)
@@ -0,0 +1,215 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+from benefits import BenefitIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".kb_index")
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_NIQQUD = re.compile(r"[֑-ׇ]")
+# Single-letter Hebrew prefixes (and, the, in, to, from, that, as)
+_HEBREW_PREFIXES = "והבלמשכ"
+# Plural and construct-state endings, longest first
+_HEBREW_SUFFIXES = ("יים", "ים", "ות", "י")
+
+# English query terms mapped to the Hebrew vocabulary of the knowledge base,
+# so English questions can still be matched lexically against Hebrew chunks.
+QUERY_SYNONYMS: Dict[str, str] = {
+    "alternative": "רפואה משלימה", "complementary": "רפואה משלימה",
+    "acupuncture": "דיקור סיני אקופונקטורה", "shiatsu": "שיאצו",
+    "reflexology": "רפלקסולוגיה", "naturopathy": "נטורופתיה",
+    "homeopathy": "הומאופתיה", "chiropractic": "כירופרקטיקה", "chiropractor": "כירופרקטיקה",
+    "communication": "מרפאות תקשורת", "speech": "דיבור שפה", "language": "שפה",
+    "stuttering": "גמגום", "voice": "קול", "swallowing": "בליעה",
+    "developmental": "עיכוב התפתחותי", "hearing": "שמיעה",
+    "dental": "שיניים", "dentist": "שיניים", "teeth": "שיניים", "tooth": "שיניים",
+    "cleaning": "ניקוי", "cleanings": "ניקוי", "checkup": "בדיקות", "fillings": "סתימות", "filling": "סתימות",
+    "exam": "בדיקות", "exams": "בדיקות", "test": "בדיקות", "tests": "בדיקות",
+    "crown": "כתרים", "crowns": "כתרים", "cosmetic": "קוסמטיים",
+    "root": "טיפולי שורש", "canal": "טיפולי שורש", "extraction": "עקירות",
+    "orthodontics": "יישור שיניים", "braces": "יישור שיניים",
+    "implant": "שתלים", "implants": "שתלים", "whitening": "הלבנת",
+    "optometry": "אופטומטריה", "eye": "ראייה עיניים", "eyes": "ראייה עיניים",
+    "vision": "ראייה", "glasses": "משקפי ראייה", "eyeglasses": "משקפי ראייה",
+    "lenses": "עדשות מגע", "lens": "עדשות מגע",
+    "laser": "לייזר", "children": "ילדים", "kids": "ילדים", "child": "ילדים",
+    "pregnancy": "הריון", "pregnant": "הריון", "prenatal": "הריון",
+    "genetic": "גנטיות", "screening": "סקר", "ultrasound": "סקירות מערכות",
+    "birth": "לידה", "childbirth": "לידה", "nutrition": "תזונה", "diet": "תזונה",
+    "complications": "סיבוכי", "workshop": "סדנאות", "workshops": "סדנאות",
+    "smoking": "עישון", "quit": "הפסקת", "exercise": "פעילות גופנית",
+    "physical": "פעילות גופנית", "stress": "מתח", "diabetes": "סוכרת",
+    "phone": "טלפון", "telephone": "טלפון",
+}
+
+
+def _is_hebrew(token: str) -> bool:
+    return "א" <= token[0] <= "ת"
+
+
+def _strip_suffix(token: str) -> str:
+    for suffix in _HEBREW_SUFFIXES:
+        if len(token) - len(suffix) >= 3 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens with Hebrew niqqud removed. Hebrew words are also
+    emitted without a leading one-letter prefix and without a plural/construct
+    suffix, so "למשקפיים", "משקפיים" and "משקפי" share a token.
+    """
+    tokens = []
+    for token in _TOKEN.findall(_NIQQUD.sub("", text.lower())):
+        tokens.append(token)
+        if not _is_hebrew(token):
+            continue
+        variants = {token}
+        stripped = token
+        for _ in range(2):
+            if len(stripped) > 3 and stripped[0] in _HEBREW_PREFIXES:
+                stripped = stripped[1:]
+                variants.add(stripped)
+        variants |= {_strip_suffix(v) for v in variants}
+        variants.discard(token)
+        tokens.extend(sorted(variants))
+    return tokens
+
+
+def expand_query(query: str) -> List[str]:
+    tokens = tokenize(query)
+    expanded = list(tokens)
+    for token in tokens:
+        synonym = QUERY_SYNONYMS.get(token)
+        if synonym:
+            expanded.extend(tokenize(synonym))
+    return expanded
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """A retrievable unit: one service row, or a category overview when `service` is empty."""
+    category: str
+    service: str
+    text: str
+
+
+class RetrievalIndex:
+    """BM25 index over knowledge base chunks, built from a BenefitIndex."""
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, version: str, chunks: List[Chunk],
+                 postings: Optional[Dict[str, List[Tuple[int, int]]]] = None,
+                 doc_lengths: Optional[List[int]] = None):
+        self.version = version
+        self.chunks = chunks
+        if postings is None or doc_lengths is None:
+            postings, doc_lengths = {}, []
+            for doc_id, chunk in enumerate(chunks):
+                counts = Counter(tokenize(chunk.text))
+                doc_lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    postings.setdefault(term, []).append((doc_id, tf))
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if chunks else 0.0
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @classmethod
+    def from_benefits(cls, version: str, benefits: BenefitIndex) -> "RetrievalIndex":
+        chunks = []
+        for category in benefits.categories:
+            contacts = " ".join(line for lines in category.contacts.values() for line in lines)
+            chunks.append(Chunk(category.name, "", f"{category.name}\n{category.intro}\n{contacts}"))
+            for service in category.services:
+                rows = [b.text for b in benefits.entries.values()
+                        if b.category == category.name and b.service == service]
+                description = category.descriptions.get(service, "")
+                chunks.append(Chunk(category.name, service, "\n".join([category.name, service, description] + rows)))
+        return cls(version, chunks)
+
+    def search(self, query: str, k: int = 6) -> List[Tuple[Chunk, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(expand_query(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in docs:
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.chunks[doc_id], score) for doc_id, score in ranked]
+
+    def save(self, index_dir: str = DEFAULT_INDEX_DIR) -> str:
+        os.makedirs(index_dir, exist_ok=True)
+        path = os.path.join(index_dir, f"retrieval-{self.version}.json")
+        # Workers without preload may build the same version at once; each writes its own file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": self.version,
+                    "chunks": [asdict(c) for c in self.chunks],
+                    "postings": self.postings,
+                    "doc_lengths": self.doc_lengths,
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        # Indexes for older knowledge base versions are never read again
+        for name in os.listdir(index_dir):
+            if name.startswith("retrieval-") and name.endswith(".json") and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(index_dir, name))
+                except OSError:
+                    pass
+        return path
+
+    @classmethod
+    def load(cls, version: str, index_dir: str = DEFAULT_INDEX_DIR) -> Optional["RetrievalIndex"]:
+        path = os.path.join(index_dir, f"retrieval-{version}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        postings = {term: [tuple(p) for p in docs] for term, docs in data["postings"].items()}
+        return cls(data["version"], [Chunk(**c) for c in data["chunks"]], postings, data["doc_lengths"])
+
+
+def load_or_build(version: str, benefits: BenefitIndex, index_dir: str = DEFAULT_INDEX_DIR) -> RetrievalIndex:
+    """Reuse the index persisted for this knowledge base version, or build and persist it."""
+    index = RetrievalIndex.load(version, index_dir)
+    if index is not None:
+        logger.info("Loaded retrieval index for version %s from disk", version)
+        return index
+    index = RetrievalIndex.from_benefits(version, benefits)
+    try:
+        index.save(index_dir)
+    except OSError as e:
+        logger.warning("Could not persist retrieval index: %s", e)
+    return index
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Session:
+    """Server-side state of one conversation, so clients only send the new message each turn."""
+    id: str
+    language: str = "en"
+    phase: str = "collecting"
+    history: List[Dict[str, str]] = field(default_factory=list)
+    # Details shown to the user for confirmation, and the confirmed ones
+    pending_info: Optional[Dict[str, Any]] = None
+    user_info: Optional[Dict[str, Any]] = None
+    # Number of saves; a save only succeeds if the stored session still has the version it was loaded with
+    version: int = 0
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str) -> "Session":
+        return cls(**json.loads(data))
+
+
+class SessionConflict(Exception):
+    """The session was saved by another request (or deleted) after it was loaded."""
+
+
+def _version(data: Optional[str]) -> int:
+    """Version of a stored session; 0 when there is none, like a session that was never saved."""
+    return 0 if data is None else json.loads(data).get("version", 0)
+
+
+# --- Storage backends ---
+# `set` is a compare-and-set: it only writes if the stored session's version equals `expected`,
+# and returns whether it did, so two requests for one session cannot overwrite each other's turn
+class InMemorySessionBackend:
+    """Per-process LRU with a sliding TTL. Sessions are lost on restart and not shared between workers."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: str, ttl: float, expected: int) -> bool:
+        with self._lock:
+            now = time.time()
+            item = self._data.get(key)
+            if _version(item[1] if item is not None and item[0] >= now else None) != expected:
+                return False
+            self._data[key] = (now + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    async def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteSessionBackend:
+    """
+    Sessions in a local SQLite file (WAL mode), shared by all workers on one
+    host. Queries run in a thread so they never block the event loop.
+
+    The connection is opened on first use in each process: a connection must
+    not be carried across `fork()`, and the app is imported in the gunicorn
+    master before the workers are forked.
+    """
+
+    # Expired rows are purged after this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._inherited = None
+        self._pid = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @property
+    def _db(self):
+        """This process's connection; use with the lock held."""
+        if self._conn is None or self._pid != os.getpid():
+            import sqlite3  # only needed for this backend
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            # A connection inherited from the parent process is kept referenced (closing it counts as using it)
+            self._inherited, self._conn, self._pid = self._conn, conn, os.getpid()
+        return self._conn
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE id = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: float, expected: int) -> bool:
+        now = time.time()
+        with self._lock:
+            db = self._db
+            # BEGIN IMMEDIATE takes the write lock, so no other worker can save between the read and the write
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT data FROM sessions WHERE id = ? AND expires_at >= ?", (key, now)).fetchone()
+                if _version(row[0] if row else None) != expected:
+                    db.execute("ROLLBACK")
+                    return False
+                db.execute(
+                    "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)", (key, value, now + ttl)
+                )
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    db.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return True
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (key,))
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float, expected: int) -> bool:
+        return await asyncio.to_thread(self._set, key, value, ttl, expected)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+class RedisSessionBackend:
+    """Sessions in Redis (or a Redis-compatible server), shared between workers and hosts."""
+
+    def __init__(self, url: str, prefix: str = "hmo-chatbot:session:"):
+        import redis.asyncio as redis  # optional dependency, only needed for this backend
+        from redis.exceptions import WatchError
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+        self._watch_error = WatchError
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: float, expected: int) -> bool:
+        key = self.prefix + key
+        # WATCH makes the transaction fail if another client writes the key after it was read
+        async with self._client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if _version(await pipe.get(key)) != expected:
+                    return False
+                pipe.multi()
+                pipe.set(key, value, ex=max(1, int(ttl)))
+                await pipe.execute()
+            except self._watch_error:
+                return False
+        return True
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self.prefix + key)
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+class SessionStore:
+    """
+    Conversation state keyed by an unguessable session ID. The TTL is sliding:
+    every save extends the session's lifetime. Saves are optimistic: `save`
+    raises `SessionConflict` if the session changed since it was loaded.
+    """
+
+    def __init__(self, backend, ttl: float = 3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {"created": 0, "loaded": 0, "missing": 0, "saved": 0, "conflicts": 0, "deleted": 0}
+
+    async def create(self, language: str = "en") -> Session:
+        session = Session(id=secrets.token_urlsafe(24), language=language)
+        await self.save(session)
+        self.stats["created"] += 1
+        return session
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        data = await self.backend.get(session_id)
+        if data is None:
+            self.stats["missing"] += 1
+            return None
+        self.stats["loaded"] += 1
+        return Session.from_json(data)
+
+    async def save(self, session: Session) -> None:
+        expected = session.version
+        session.version += 1
+        if not await self.backend.set(session.id, session.to_json(), self.ttl, expected):
+            session.version = expected
+            self.stats["conflicts"] += 1
+            raise SessionConflict(session.id)
+        self.stats["saved"] += 1
+
+    async def delete(self, session_id: str) -> None:
+        await self.backend.delete(session_id)
+        self.stats["deleted"] += 1
+
+    def snapshot_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def create_session_store(kind: str, ttl: float, max_entries: int, sqlite_path: str, redis_url: str) -> SessionStore:
+    if kind == "redis":
+        try:
+            backend = RedisSessionBackend(redis_url)
+        except ImportError:
+            logger.error("SESSION_STORE=redis requires the 'redis' package; falling back to the in-memory store")
+            backend = InMemorySessionBackend(max_entries)
+    elif kind == "sqlite":
+        backend = SQLiteSessionBackend(sqlite_path)
+    else:
+        backend = InMemorySessionBackend(max_entries)
+    return SessionStore(backend, ttl=ttl)
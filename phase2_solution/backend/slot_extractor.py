@@ -0,0 +1,345 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+FIELDS = ("first_name", "last_name", "id_number", "gender", "age", "hmo", "card_number", "tier")
+
+# Keywords in an assistant message that show which field it is asking for
+_ASK_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "first_name": ("first name", "name", "שם פרטי", "שם מלא", "שמך", "השם שלך", "שם"),
+    "last_name": ("last name", "surname", "family name", "name", "שם משפחה", "שם מלא", "שמך", "שם"),
+    "id_number": ("id number", "id", "identity", "תעודת זהות", "ת.ז", "ת\"ז", "מספר זהות"),
+    "gender": ("gender", "sex", "מגדר", "מין"),
+    "age": ("age", "how old", "גיל", "בן כמה", "בת כמה"),
+    "hmo": ("hmo", "health fund", "health maintenance", "קופת חולים", "קופת החולים", "קופה"),
+    "card_number": ("card number", "card", "מספר כרטיס", "כרטיס"),
+    "tier": ("tier", "plan", "insurance level", "membership level", "רובד", "מסלול", "דרגת"),
+}
+
+_HMO_VALUES = {
+    "מכבי": "מכבי", "maccabi": "מכבי", "makabi": "מכבי",
+    "מאוחדת": "מאוחדת", "meuhedet": "מאוחדת", "meuchedet": "מאוחדת",
+    "כללית": "כללית", "clalit": "כללית", "klalit": "כללית",
+}
+_TIER_VALUES = {
+    "זהב": "זהב", "gold": "זהב", "golden": "זהב",
+    "כסף": "כסף", "silver": "כסף",
+    "ארד": "ארד", "bronze": "ארד",
+}
+# Values that are distinctive enough to accept even when the field was not asked for
+_GENDER_STRONG = {"male": "male", "female": "female", "זכר": "male", "נקבה": "female"}
+_GENDER_WEAK = {
+    "man": "male", "boy": "male", "גבר": "male", "בן": "male",
+    "woman": "female", "girl": "female", "אישה": "female", "אשה": "female", "בת": "female",
+    "other": "other", "אחר": "other", "אחרת": "other",
+}
+
+_WORD = re.compile(r"[\w\"'׳״.-]+", re.UNICODE)
+_NINE_DIGITS = re.compile(r"(?<!\d)\d{9}(?!\d)")
+_NUMBER = re.compile(r"(?<!\d)\d{1,3}(?!\d)")
+_AGE_PATTERNS = (
+    re.compile(r"(\d{1,3})\s*(?:years? old|yo\b|y/o)", re.IGNORECASE),
+    re.compile(r"(?:age|aged|גיל|גילי|בן|בת)\s*(?:is|:|-)?\s*(\d{1,3})(?!\d)", re.IGNORECASE),
+    re.compile(r"(?:i'm|i am|im)\s+(\d{1,3})(?!\d)", re.IGNORECASE),
+)
+_NAME_PATTERNS = (
+    re.compile(r"(?:my name is|my name's|call me|name:)\s+(.+)", re.IGNORECASE),
+    re.compile(r"(?:שמי|קוראים לי|השם שלי(?: הוא)?)\s+(.+)"),
+)
+_FIRST_NAME = re.compile(r"(?:first name(?: is)?|שם פרטי)\s*:?\s*([^\s,.;]+)", re.IGNORECASE)
+_LAST_NAME = re.compile(r"(?:last name(?: is)?|surname(?: is)?|family name(?: is)?|שם משפחה)\s*:?\s*([^\s,.;]+)", re.IGNORECASE)
+_CARD_LABEL = re.compile(r"(card|כרטיס)", re.IGNORECASE)
+_ID_LABEL = re.compile(r"(\bid\b|identity|זהות|ת\.ז|ת\"ז|ת״ז)", re.IGNORECASE)
+_NAME_END = re.compile(r"[,;.!?\d]|\band\b|\s+ו(?=[א-ת])")
+_HEBREW_PREFIX = "[והבלמש]{0,2}"
+# Words dropped from a bare reply before it is read as a name ("Actually Dana", "I'm Dana")
+_FILLERS = {
+    "hi", "hello", "hey", "sure", "ok", "okay", "yes", "it's", "its", "i'm", "im", "i", "am", "it", "is",
+    "actually", "well", "so", "oh", "um", "uh", "my", "name",
+    "היי", "שלום", "כן", "בטח", "זה", "אני", "בעצם", "אז", "אממ",
+}
+# Words that mean a bare reply is not a name at all ("im fine thanks", "why do you need it")
+_NOT_NAMES = {
+    "fine", "good", "great", "thanks", "thank", "you", "no", "not", "nope", "sorry", "please", "later",
+    "why", "what", "how", "who", "where", "when", "don't", "dont", "want", "need", "tell", "know", "skip",
+    "the", "a", "an", "this", "that", "for", "to", "do", "are", "was", "me", "your", "of", "and", "or",
+    "תודה", "בסדר", "טוב", "לא", "למה", "מה", "איך", "מי", "איפה", "מתי", "סליחה", "רוצה", "יודע", "יודעת",
+    "צריך", "צריכה", "אחר", "כך", "את", "של", "הכל", "מצוין",
+}
+
+
+@dataclass(frozen=True)
+class SlotState:
+    """What is known about the user after reading a prefix of the conversation."""
+    values: Dict[str, Any] = field(default_factory=dict)
+    # Fields the user was asked for but whose answer could not be parsed locally
+    unresolved: FrozenSet[str] = frozenset()
+    # Set when a message held values that could not be assigned unambiguously
+    conflict: bool = False
+    asked: FrozenSet[str] = frozenset()
+    # Free-text fields read from an unlabelled reply only because of the question before it (a bare
+    # "Dana Cohen" after "what is your name?"); the LLM extractor checks these before confirmation
+    guessed: FrozenSet[str] = frozenset()
+    # The last user message filled none of the missing fields: it may hold a value the parser cannot
+    # read (a name given unprompted, an age in words, "the first one"), so the LLM extractor reads it
+    stalled: bool = False
+
+    @property
+    def missing(self) -> List[str]:
+        return [name for name in FIELDS if name not in self.values]
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+    @property
+    def ambiguous(self) -> bool:
+        """True when the LLM extractor should be consulted."""
+        return self.conflict or self.stalled or bool(self.unresolved - set(self.values))
+
+
+def asked_fields(text: str) -> FrozenSet[str]:
+    lowered = text.lower()
+    asked = set()
+    for name, keywords in _ASK_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword.isascii():
+                pattern = rf"\b{re.escape(keyword)}\b"
+            else:
+                # Whole Hebrew words only, allowing one-letter prefixes ("לגיל", "הקופה")
+                pattern = rf"(?<![א-ת]){_HEBREW_PREFIX}{re.escape(keyword)}(?![א-ת])"
+            if re.search(pattern, lowered):
+                asked.add(name)
+                break
+    # "card" questions mention "number"/"מספר" too; do not read them as ID questions
+    if "card_number" in asked and not re.search(r"\bid\b|identity|זהות|ת\.ז|ת\"ז", lowered):
+        asked.discard("id_number")
+    return frozenset(asked)
+
+
+def _words(text: str) -> List[str]:
+    return [w.strip(".,;:!?\"'") for w in _WORD.findall(text)]
+
+
+def _lookup_words(words: List[str], table: Dict[str, str]) -> List[str]:
+    found = []
+    for word in words:
+        value = table.get(word.lower())
+        if value and value not in found:
+            found.append(value)
+    return found
+
+
+def _looks_like_name(words: List[str]) -> bool:
+    if not 1 <= len(words) <= 3:
+        return False
+    for word in words:
+        lowered = word.lower()
+        if not word.replace("-", "").replace("'", "").isalpha():
+            return False
+        if lowered in _FILLERS or lowered in _NOT_NAMES or lowered in _HMO_VALUES or lowered in _TIER_VALUES \
+                or lowered in _GENDER_STRONG or lowered in _GENDER_WEAK:
+            return False
+    return True
+
+
+def _last_label_end(label: re.Pattern, text: str) -> int:
+    """Where the last match of `label` in `text` ends, or -1."""
+    end = -1
+    for match in label.finditer(text):
+        end = match.end()
+    return end
+
+
+def parse_message(text: str, asked: FrozenSet[str]) -> Tuple[Dict[str, Any], bool, FrozenSet[str]]:
+    """
+    Parse one user message. Returns the values found, whether the message
+    contained something that could not be assigned to a field unambiguously,
+    and which of the values were guessed from the question asked rather than
+    read from a label or a fixed format.
+    """
+    values: Dict[str, Any] = {}
+    conflict = False
+    guessed = set()
+    words = _words(text)
+    lowered = text.lower()
+
+    # 9-digit numbers: ID or HMO card, told apart by labels or by the question asked
+    compact = re.sub(r"(?<=\d)[- ](?=\d)", "", text)
+    numbers = _NINE_DIGITS.findall(compact)
+    previous_end = 0
+    for match in _NINE_DIGITS.finditer(compact):
+        # The label nearest the number wins; an earlier number ends the window
+        before = compact[max(previous_end, match.start() - 25):match.start()]
+        previous_end = match.end()
+        card = _last_label_end(_CARD_LABEL, before)
+        id_ = _last_label_end(_ID_LABEL, before)
+        if card == id_:
+            if card >= 0:
+                conflict = True
+            continue
+        slot = "card_number" if card > id_ else "id_number"
+        if values.get(slot, match.group()) != match.group():
+            conflict = True
+        values[slot] = match.group()
+    unlabeled = [n for n in numbers if n not in (values.get("card_number"), values.get("id_number"))]
+    if unlabeled:
+        open_slots = [name for name in ("id_number", "card_number") if name in asked and name not in values]
+        if len(unlabeled) == 1 and len(open_slots) == 1:
+            values[open_slots[0]] = unlabeled[0]
+        elif len(unlabeled) == len(open_slots) == 2:
+            # Asked for both in one question: answers follow the usual ID-then-card order
+            values["id_number"], values["card_number"] = unlabeled
+        else:
+            conflict = True
+
+    # Age
+    for pattern in _AGE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            values["age"] = int(match.group(1))
+            break
+    else:
+        if "age" in asked:
+            small = [int(n) for n in _NUMBER.findall(compact) if int(n) <= 120]
+            if len(small) == 1:
+                values["age"] = small[0]
+            elif len(small) > 1:
+                conflict = True
+
+    # Enumerated values
+    hmos = _lookup_words(words, _HMO_VALUES)
+    if len(hmos) == 1:
+        values["hmo"] = hmos[0]
+    elif len(hmos) > 1:
+        conflict = True
+
+    if "tier" in asked or re.search(r"\btier\b|רובד|מסלול", lowered) or any(
+            w.lower() in ("gold", "silver", "bronze") for w in words):
+        tiers = _lookup_words(words, _TIER_VALUES)
+        if len(tiers) == 1:
+            values["tier"] = tiers[0]
+        elif len(tiers) > 1:
+            conflict = True
+
+    genders = _lookup_words(words, _GENDER_STRONG)
+    if not genders and "gender" in asked:
+        genders = _lookup_words(words, _GENDER_WEAK)
+        if genders:
+            guessed.add("gender")
+    if len(genders) == 1:
+        values["gender"] = genders[0]
+    elif len(genders) > 1:
+        conflict = True
+
+    # Names
+    first = _FIRST_NAME.search(text)
+    last = _LAST_NAME.search(text)
+    if first:
+        values["first_name"] = first.group(1)
+    if last:
+        values["last_name"] = last.group(1)
+    if not first and not last:
+        name_words = None
+        for pattern in _NAME_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                name_words = _words(_NAME_END.split(match.group(1))[0])
+                break
+        bare = name_words is None
+        if bare and asked & {"first_name", "last_name"} and not values:
+            name_words = [w for w in words if w.lower() not in _FILLERS]
+        if name_words and _looks_like_name(name_words):
+            if len(name_words) == 1:
+                slot = "last_name" if asked & {"first_name", "last_name"} == {"last_name"} else "first_name"
+                values[slot] = name_words[0]
+            else:
+                values["first_name"] = name_words[0]
+                values["last_name"] = " ".join(name_words[1:])
+            if bare:
+                guessed.update(name for name in ("first_name", "last_name") if name in values)
+
+    return values, conflict, frozenset(guessed)
+
+
+def _chain_key(previous: str, role: str, content: str) -> str:
+    digest = hashlib.sha1(previous.encode("utf-8"))
+    digest.update(role.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SlotExtractor:
+    """
+    Deterministic, incremental slot filling for the information-collection phase.
+
+    The state after every conversation prefix is memoized under a hash chain of
+    its messages, so each /chat turn only parses the messages that are new
+    since the previous turn.
+    """
+
+    def __init__(self, max_cached: int = 10000):
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, SlotState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[SlotState]:
+        with self._lock:
+            state = self._cache.get(key)
+            if state is not None:
+                self._cache.move_to_end(key)
+            return state
+
+    def _put(self, key: str, state: SlotState) -> None:
+        with self._lock:
+            self._cache[key] = state
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def extract(self, history: List[Dict]) -> SlotState:
+        keys = []
+        key = ""
+        for msg in history:
+            key = _chain_key(key, msg["role"], msg["content"])
+            keys.append(key)
+
+        # Resume from the longest prefix that has already been parsed
+        state = SlotState()
+        start = 0
+        for index in range(len(keys) - 1, -1, -1):
+            cached = self._get(keys[index])
+            if cached is not None:
+                state, start = cached, index + 1
+                break
+
+        for index in range(start, len(history)):
+            state = self._step(state, history[index])
+            self._put(keys[index], state)
+        return state
+
+    @staticmethod
+    def _step(state: SlotState, msg: Dict) -> SlotState:
+        if msg["role"] == "assistant":
+            return replace(state, asked=asked_fields(msg["content"]), conflict=False)
+        if msg["role"] != "user":
+            return state
+
+        found, conflict, guessed = parse_message(msg["content"], state.asked)
+        values = dict(state.values)
+        # Later answers override earlier ones, so corrections win
+        values.update(found)
+        unresolved = set(state.unresolved) | (set(state.asked) - set(found))
+        unresolved -= set(values)
+        return SlotState(
+            values=values,
+            unresolved=frozenset(unresolved),
+            conflict=conflict,
+            asked=frozenset(),
+            guessed=(state.guessed - set(found)) | guessed,
+            stalled=not set(found) - set(state.values),
+        )
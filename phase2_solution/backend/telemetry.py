@@ -0,0 +1,58 @@
+"""
+Per-stage timing and token metrics, exported in the Prometheus text format,
+with optional OpenTelemetry tracing.
+
+`span("stage")` times a block of work: the duration goes into the
+`chatbot_stage_seconds` histogram and, when TRACING=otel, into an
+OpenTelemetry span exported to a local collector over OTLP. With metrics and
+tracing both off, `span` returns a shared no-op object.
+
+The metric types are shared with the Phase 1 extractor (`shared/telemetry.py`
+at the repository root). With METRICS_DIR set, as gunicorn.conf.py does for
+several workers, each worker publishes its metrics there and `/metrics` sums
+all workers.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from shared.telemetry import Registry, Tracer
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+# "off" or "otel" (needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http)
+TRACING = os.getenv("TRACING", "off")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "hmo-chatbot")
+# Directory the worker processes publish their metrics to ("" keeps them in this process only)
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+# Seconds between publications; another worker's values on /metrics are at most this old
+METRICS_SHARE_INTERVAL = float(os.getenv("METRICS_SHARE_INTERVAL", "5"))
+
+registry = Registry(enabled=METRICS_ENABLED, share_dir=METRICS_DIR if METRICS_ENABLED else "")
+
+STAGE_SECONDS = registry.histogram(
+    "chatbot_stage_seconds", "Time spent in each stage of handling a request", ("stage",))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "chatbot_http_request_seconds", "Time to produce the response (streamed bodies excluded)",
+    ("method", "route", "status"))
+LLM_CALL_SECONDS = registry.histogram(
+    "chatbot_llm_call_seconds", "Upstream LLM calls: full response, or the whole stream", ("model", "kind", "outcome"))
+LLM_FIRST_TOKEN_SECONDS = registry.histogram(
+    "chatbot_llm_first_token_seconds", "Time to the first token of streamed completions", ("model",))
+LLM_TOKENS = registry.counter(
+    "chatbot_llm_tokens_total", "Tokens reported by the provider (type: prompt, cached, completion)",
+    ("model", "type"))
+LLM_RETRIES = registry.counter(
+    "chatbot_llm_retries_total", "Upstream LLM requests that were retries of an earlier attempt", ())
+LLM_HEDGES = registry.counter(
+    "chatbot_llm_hedges_total", "Slow calls that were sent twice, by which copy answered first", ("model", "winner"))
+LLM_FALLBACKS = registry.counter(
+    "chatbot_llm_fallbacks_total", "Calls moved to the fallback deployment", ("model", "fallback"))
+WORKER_STARTUP_SECONDS = registry.histogram(
+    "chatbot_worker_startup_seconds", "Time from the start (or fork) of a worker until it was ready to serve")
+
+tracer = Tracer(TRACING, OTEL_SERVICE_NAME, STAGE_SECONDS, setting="TRACING")
+init_tracing = tracer.init
+shutdown_tracing = tracer.shutdown
+span = tracer.span
+trace = tracer.trace
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# The backend modules are imported flat, as uvicorn does from the backend directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Keep test runs from writing log files or watching the knowledge base
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("LOG_CONSOLE", "0")
+os.environ.setdefault("KB_POLL_INTERVAL", "0")
+
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    # The upstream scheduler is built on asyncio
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def benefit_index():
+    """The benefit tables parsed from the shipped knowledge base."""
+    from benefits import BenefitIndex
+    from kb_store import load_snapshot
+    return BenefitIndex.from_files(load_snapshot().files)
+
+
+@pytest.fixture(scope="session")
+def matcher(benefit_index):
+    from fast_path import FastPathMatcher
+    return FastPathMatcher(benefit_index)
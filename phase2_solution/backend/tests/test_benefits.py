@@ -0,0 +1,59 @@
+import pytest
+
+from benefits import HMOS, TIERS, BenefitIndex
+
+DENTAL = "מרפאות שיניים"
+
+
+def test_every_shipped_table_is_parsed(benefit_index):
+    assert len(benefit_index.categories) == 6
+    for category in benefit_index.categories:
+        assert len(category.services) == 6, category.source
+        assert category.intro
+        assert set(category.contacts) == set(HMOS)
+    # One row per service, HMO and tier
+    assert len(benefit_index) == 6 * 6 * len(HMOS) * len(TIERS)
+
+
+@pytest.mark.parametrize("hmo, tier, text", [
+    ("מכבי", "זהב", "80% הנחה, חומרים מתקדמים"),
+    ("מאוחדת", "כסף", "45% הנחה"),
+    ("כללית", "ארד", "20% הנחה"),
+])
+def test_cells_are_split_by_tier(benefit_index, hmo, tier, text):
+    assert benefit_index.lookup(DENTAL, "סתימות", hmo, tier).text == text
+
+
+def test_service_descriptions_come_from_the_list_above_the_table(benefit_index):
+    dental = next(c for c in benefit_index.categories if c.name == DENTAL)
+    assert dental.source == "dentel_services.html"
+    assert dental.descriptions["סתימות"] == "טיפול בעששת ושחזור שיניים"
+    assert dental.contacts["מכבי"][0] == "3555* או 1-700-50-53-53 שלוחה 1"
+
+
+def test_render_holds_only_the_members_rows(benefit_index):
+    text = benefit_index.render("מאוחדת", "כסף")
+    assert text.startswith("HMO: מאוחדת | Tier: כסף")
+    assert "- סתימות: 45% הנחה" in text
+    assert "80% הנחה, חומרים מתקדמים" not in text
+    assert "1-222-3833" in text and "1-700-50-53-53" not in text
+
+
+def test_render_hmo_lists_every_tier(benefit_index):
+    text = benefit_index.render_hmo("כללית")
+    assert "- סתימות\n  זהב: 70% הנחה, טכנולוגיה מתקדמת\n  כסף: 40% הנחה\n  ארד: 20% הנחה" in text
+
+
+def test_render_selection_keeps_the_chosen_services(benefit_index):
+    text = benefit_index.render_selection("מכבי", "זהב", [(DENTAL, "סתימות")])
+    assert "- סתימות:" in text
+    assert "- טיפולי שורש:" not in text
+    assert "## אופטומטריה" not in text
+
+
+def test_unparseable_file_is_skipped():
+    html = "<h2>Test</h2><table><tr><th>שירות</th><th>מכבי</th></tr>" \
+           "<tr><td>בדיקה</td><td><strong>זהב:</strong> חינם</td></tr></table>"
+    index = BenefitIndex.from_files({"broken.html": None, "test.html": html})
+    assert [c.source for c in index.categories] == ["test.html"]
+    assert index.lookup("Test", "בדיקה", "מכבי", "זהב").text == "חינם"
@@ -0,0 +1,76 @@
+import pytest
+
+from fast_path import to_english
+
+
+@pytest.mark.parametrize("question", [
+    "is acupuncture dangerous",
+    "how do I book acupuncture",
+    "where is the nearest acupuncture clinic",
+    "can I get acupuncture at home",
+    "האם דיקור סיני מסוכן",
+    "what do I get for glasses",
+])
+def test_questions_without_lookup_intent_go_to_the_llm(matcher, question):
+    assert matcher.match(question, "מכבי", "זהב") == (None, "no_intent")
+
+
+@pytest.mark.parametrize("question, service", [
+    ("What discount do I get on glasses?", "משקפי ראייה"),
+    ("How much does acupuncture cost?", "דיקור סיני (אקופונקטורה)"),
+    ("Is acupuncture covered?", "דיקור סיני (אקופונקטורה)"),
+    ("כמה הנחה מגיעה לי על משקפיים", "משקפי ראייה"),
+    ("מה ההנחה על דיקור סיני", "דיקור סיני (אקופונקטורה)"),
+    ("glasses", "משקפי ראייה"),
+    ("דיקור סיני", "דיקור סיני (אקופונקטורה)"),
+])
+def test_lookups_and_bare_service_names_match_one_row(matcher, question, service):
+    match, outcome = matcher.match(question, "מכבי", "זהב")
+    assert outcome == "hit"
+    assert match.service == service
+    assert (match.benefit.hmo, match.benefit.tier) == ("מכבי", "זהב")
+
+
+@pytest.mark.parametrize("question, outcome", [
+    ("What discount do I get on glasses on the silver plan?", "unsupported"),
+    ("How much do glasses cost at Clalit?", "unsupported"),
+    ("Which is better, glasses or lenses?", "unsupported"),
+    ("What discount do I get on glasses for kids?", "off_topic"),
+    ("How much does it cost?", "no_match"),
+])
+def test_other_plans_comparisons_and_mixed_services_go_to_the_llm(matcher, question, outcome):
+    assert matcher.match(question, "מכבי", "זהב") == (None, outcome)
+
+
+@pytest.mark.parametrize("question", [
+    "how much do glasses cost without insurance?",
+    "do I pay for glasses if I lose them?",
+    "how much does a root canal cost at a private clinic?",
+    "what is not covered for braces?",
+    "how much do glasses cost not on my plan but on my wife's plan",
+    "כמה עולים משקפיים ללא ביטוח",
+    "כמה עולה טיפול שורש במרפאה פרטית",
+])
+def test_conditions_the_table_does_not_cover_go_to_the_llm(matcher, question):
+    assert matcher.match(question, "מכבי", "זהב") == (None, "no_intent")
+
+
+def test_follow_ups_that_refer_back_go_to_the_llm(matcher):
+    question = "How much do glasses cost for those?"
+    assert matcher.match(question, "מכבי", "זהב")[1] == "hit"
+    assert matcher.match(question, "מכבי", "זהב", in_context=True) == (None, "context")
+    assert matcher.match("How much do glasses cost?", "מכבי", "זהב", in_context=True)[1] == "hit"
+
+
+def test_rendered_answers(matcher):
+    match, _ = matcher.match("How much does acupuncture cost?", "מכבי", "זהב")
+    hebrew = matcher.render(match, "מכבי", "זהב", "he")
+    assert match.benefit.text in hebrew and "מכבי" in hebrew
+    english = matcher.render(match, "מכבי", "זהב", "en")
+    assert english.startswith("Acupuncture (דיקור סיני (אקופונקטורה)) for Maccabi Gold members:")
+    assert to_english(match.benefit.text) in english
+
+
+def test_translation_gives_up_on_unknown_phrases():
+    assert to_english("70% הנחה, עד 20 טיפולים בשנה") == "70% discount, up to 20 treatments a year"
+    assert to_english("הנחה מיוחדת לחברי מועדון") is None
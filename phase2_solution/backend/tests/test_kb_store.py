@@ -0,0 +1,33 @@
+import pytest
+
+from kb_store import KnowledgeBaseStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / "dental.html").write_text("<h2>Dental</h2>", encoding="utf-8")
+    store = KnowledgeBaseStore(str(tmp_path), poll_interval=0)
+    store.reload()
+    return store
+
+
+def test_listeners_see_the_new_version_in_the_store(store, tmp_path):
+    seen = []
+    store.subscribe(lambda snapshot: seen.append((snapshot.version, store.version)))
+    (tmp_path / "dental.html").write_text("<h2>Dental care</h2>", encoding="utf-8")
+    snapshot = store.reload()
+    assert seen[-1] == (snapshot.version, snapshot.version)
+
+
+def test_failed_listener_keeps_the_previous_snapshot(store, tmp_path):
+    previous = store.version
+
+    def fail(snapshot):
+        if snapshot.version != previous:
+            raise ValueError("bad table")
+
+    store.subscribe(fail)
+    (tmp_path / "dental.html").write_text("<h2>Dental care</h2>", encoding="utf-8")
+    with pytest.raises(ValueError):
+        store.reload()
+    assert store.version == previous
@@ -0,0 +1,21 @@
+import logging
+
+from logging_config import SamplingFilter
+
+
+def record(msg, *args):
+    return logging.LogRecord("app", logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_sampling_counts_message_templates():
+    sampler = SamplingFilter(0.5)
+    kept = [sampler.filter(record("Validated user info: %s", n)) for n in range(4)]
+    assert kept == [True, False, True, False]
+
+
+def test_sampling_keeps_a_bounded_number_of_templates():
+    sampler = SamplingFilter(0.5, max_keys=3)
+    for n in range(100):
+        sampler.filter(record(f"Validated user info: {n}"))
+    assert len(sampler._seen) == 3
+    assert ("app", "Validated user info: 99") in sampler._seen
@@ -0,0 +1,44 @@
+import pytest
+
+import app
+
+USER = app.UserInfo(first_name="Dana", last_name="Levi", id_number="123456782", gender="female",
+                    age=34, hmo="מכבי", card_number="987654321", tier="זהב")
+
+
+@pytest.fixture(autouse=True)
+def tables(monkeypatch, benefit_index):
+    monkeypatch.setattr(app, "benefit_index", benefit_index)
+    monkeypatch.setattr(app, "qa_prefixes", {})
+    monkeypatch.setattr(app, "QA_KB_CONTEXT", "tier")
+
+
+def test_default_prefix_holds_only_the_members_tier(benefit_index):
+    prefix = app.build_qa_system_prefix(USER, [], "How much is acupuncture?")
+    assert prefix == app.qa_system_prefix(benefit_index.render("מכבי", "זהב"))
+    # Long enough for the provider's prefix cache (1024 tokens at ~4 bytes each)
+    assert len(prefix.encode("utf-8")) >= 4096
+
+
+def test_same_prefix_is_reused_across_questions():
+    first = app.build_qa_system_prefix(USER, [], "How much is acupuncture?")
+    second = app.build_qa_system_prefix(USER, [], "Is there a dental discount?")
+    assert first is second
+
+
+@pytest.mark.parametrize("question", ["and on silver?", "מה מקבלים בכסף?"])
+def test_other_tier_switches_to_the_hmo_wide_prefix(benefit_index, question):
+    prefix = app.build_qa_system_prefix(USER, [], question)
+    assert prefix == app.qa_system_prefix(benefit_index.render_hmo("מכבי"))
+
+
+def test_other_tier_earlier_in_the_conversation_keeps_the_hmo_wide_prefix(benefit_index):
+    history = [{"role": "user", "content": "What does bronze cover for acupuncture?"},
+               {"role": "assistant", "content": "..."}]
+    prefix = app.build_qa_system_prefix(USER, history, "and what about dental?")
+    assert prefix == app.qa_system_prefix(benefit_index.render_hmo("מכבי"))
+
+
+def test_members_own_tier_keeps_the_tier_prefix(benefit_index):
+    prefix = app.build_qa_system_prefix(USER, [], "What does gold cover for acupuncture?")
+    assert prefix == app.qa_system_prefix(benefit_index.render("מכבי", "זהב"))
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import upstream  # puts the repository root on sys.path
+from shared.rate_limits import RateBudgets, retry_after
+
+PATH = "/openai/deployments/gpt-4o/chat/completions"
+
+
+def test_retry_after_prefers_milliseconds():
+    assert retry_after({"retry-after-ms": "250", "retry-after": "3"}) == 0.25
+    assert retry_after({"retry-after": "3"}) == 3.0
+    assert retry_after({"retry-after": "soon"}) == 0.0
+    assert retry_after(None) == 0.0
+
+
+def test_headers_lower_the_budget():
+    budgets = RateBudgets()
+    assert budgets.observe(PATH, 200, {"x-ratelimit-remaining-requests": "0",
+                                       "x-ratelimit-remaining-tokens": "5000"})
+    budget = budgets.budget("gpt-4o")
+    assert budget.rpm == 1
+    assert budget.delay(100) > 0
+
+
+def test_429_pauses_only_that_deployment():
+    budgets = RateBudgets()
+    budgets.observe(PATH, 429, {"retry-after": "30"})
+    assert budgets.budget("gpt-4o").delay(1) > 29
+    assert budgets.choose("gpt-4o", 1, fallback="gpt-4o-mini") == "gpt-4o-mini"
+    assert budgets.choose("gpt-4o-mini", 1, fallback="gpt-4o") == "gpt-4o-mini"
+
+
+def test_responses_without_a_deployment_are_ignored():
+    budgets = RateBudgets()
+    assert not budgets.observe("/openai/models", 429, {})
+    assert budgets.snapshot() == {}
+
+
+def test_both_schedulers_share_the_budgets():
+    scheduler = upstream.UpstreamScheduler(max_concurrency=1, queue_timeout=1)
+    assert isinstance(scheduler, RateBudgets)
+    scheduler.observe(PATH, 429, {"retry-after-ms": "500"})
+    assert 0 < scheduler.snapshot()["gpt-4o"]["paused_s"] <= 0.5
+
+
+@pytest.mark.anyio
+async def test_a_paused_primary_does_not_hold_back_its_fallback():
+    scheduler = upstream.UpstreamScheduler(max_concurrency=4, queue_timeout=1)
+    scheduler.observe(PATH, 429, {"retry-after": "30"})
+    primary = asyncio.ensure_future(scheduler.acquire("gpt-4o", 10))
+    await asyncio.sleep(0)
+    assert scheduler.waiting == 1
+    # Queued behind the paused primary, a call to the fallback still goes out at once
+    await asyncio.wait_for(scheduler.acquire("gpt-4o-mini", 10, priority=upstream.PRIORITY_BACKGROUND), 0.1)
+    assert scheduler.in_flight == 1 and scheduler.waiting == 1
+    primary.cancel()
@@ -0,0 +1,77 @@
+import pytest
+
+from response_cache import InMemoryBackend, ResponseCache, is_cacheable
+
+
+def scope(matcher, question, hmo="מכבי", tier="זהב", language="en"):
+    return (hmo, tier, language, "v1", matcher.topic(question))
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(InMemoryBackend(), near_threshold=0.8)
+
+
+@pytest.mark.parametrize("question", [
+    "how many treatments do I get",
+    "is it covered for kids",
+    "what is the discount for that",
+    "and what about silver?",
+])
+def test_context_dependent_questions_are_not_shared_within_a_conversation(matcher, question):
+    assert not is_cacheable(question, matcher.topic(question), in_context=True)
+
+
+@pytest.mark.parametrize("question", [
+    "What discount do I get on glasses?",
+    "How much does acupuncture cost?",
+    "כמה עולה דיקור סיני במסלול שלי",
+])
+def test_questions_that_name_a_service_are_shared(matcher, question):
+    assert matcher.topic(question)
+    assert is_cacheable(question, matcher.topic(question), in_context=True)
+
+
+def test_first_question_is_cacheable_without_a_topic():
+    assert is_cacheable("how many treatments do I get", "", in_context=False)
+    assert not is_cacheable("glasses?", "", in_context=False)
+
+
+@pytest.mark.anyio
+async def test_answer_given_in_context_is_not_served_to_another_member(matcher, cache):
+    question = "how many treatments do I get"
+    # Asked after a conversation about acupuncture: not stored
+    await cache.set(scope(matcher, question), question, "Up to 20 acupuncture treatments.", in_context=True)
+    assert await cache.get(scope(matcher, question), question, in_context=True) is None
+    assert await cache.get(scope(matcher, question), question, in_context=False) is None
+
+
+@pytest.mark.anyio
+async def test_near_duplicates_stay_within_their_service(matcher, cache):
+    template = "How much of a discount does my insurance plan give me on {} this year?"
+    glasses = template.format("glasses")
+    await cache.set(scope(matcher, glasses), glasses, "glasses answer")
+    reworded = "how much of a discount does my insurance plan give me for glasses this year"
+    assert await cache.get(scope(matcher, reworded), reworded) == "glasses answer"
+    # Over 0.85 estimated similarity to the glasses question, but about other services
+    for service in ("lenses", "fillings", "crowns"):
+        other = template.format(service)
+        assert matcher.topic(other) not in ("", matcher.topic(glasses))
+        assert await cache.get(scope(matcher, other), other) is None
+    assert cache.stats["near_hits"] == 1
+
+
+@pytest.mark.anyio
+async def test_questions_without_a_topic_only_hit_exactly(cache):
+    question = "how many treatments do I get per year"
+    await cache.set(("מכבי", "זהב", "en", "v1", ""), question, "answer")
+    assert await cache.get(("מכבי", "זהב", "en", "v1", ""), question) == "answer"
+    assert await cache.get(("מכבי", "זהב", "en", "v1", ""), "how many treatments do I get a year") is None
+
+
+@pytest.mark.anyio
+async def test_scope_separates_members(matcher, cache):
+    question = "What discount do I get on glasses?"
+    await cache.set(scope(matcher, question), question, "gold answer")
+    assert await cache.get(scope(matcher, question, tier="כסף"), question) is None
+    assert await cache.get(scope(matcher, question, language="he"), question) is None
@@ -0,0 +1,14 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from retrieval import RetrievalIndex
+
+
+def test_concurrent_saves_of_one_version_do_not_collide(benefit_index, tmp_path):
+    index = RetrievalIndex.from_benefits("v1", benefit_index)
+    with ThreadPoolExecutor(8) as pool:
+        paths = list(pool.map(lambda _: index.save(str(tmp_path)), range(16)))
+    assert set(paths) == {str(tmp_path / "retrieval-v1.json")}
+    assert os.listdir(tmp_path) == ["retrieval-v1.json"]
+    loaded = RetrievalIndex.load("v1", str(tmp_path))
+    assert len(loaded.chunks) == len(index.chunks)
@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app
+from session_store import (InMemorySessionBackend, Session, SessionConflict, SessionStore,
+                           SQLiteSessionBackend)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        backend = InMemorySessionBackend()
+    else:
+        backend = SQLiteSessionBackend(str(tmp_path / "sessions.sqlite3"))
+    return SessionStore(backend, ttl=60)
+
+
+@pytest.mark.anyio
+async def test_later_save_of_a_stale_session_conflicts(store):
+    created = await store.create()
+    first, second = await store.get(created.id), await store.get(created.id)
+    first.history.append({"role": "user", "content": "first"})
+    await store.save(first)
+    second.history.append({"role": "user", "content": "second"})
+    with pytest.raises(SessionConflict):
+        await store.save(second)
+    assert [m["content"] for m in (await store.get(created.id)).history] == ["first"]
+    assert store.stats["conflicts"] == 1
+
+
+@pytest.mark.anyio
+async def test_sequential_saves_succeed(store):
+    session = await store.create()
+    for turn in range(3):
+        session = await store.get(session.id)
+        session.history.append({"role": "user", "content": str(turn)})
+        await store.save(session)
+    assert (await store.get(session.id)).version == 4
+
+
+@pytest.mark.anyio
+async def test_saving_a_deleted_session_conflicts(store):
+    session = await store.get((await store.create()).id)
+    await store.delete(session.id)
+    with pytest.raises(SessionConflict):
+        await store.save(session)
+
+
+@pytest.mark.anyio
+async def test_sessions_stored_without_a_version_still_save(store):
+    await store.backend.set("old", '{"id":"old","language":"he"}', 60, 0)
+    session = await store.get("old")
+    session.phase = "qa"
+    await store.save(session)
+    assert (await store.get("old")).phase == "qa"
+
+
+@pytest.mark.anyio
+async def test_concurrent_turns_on_one_session(monkeypatch):
+    """Two messages sent at once: one is stored, the other gets 409 instead of overwriting it."""
+    monkeypatch.setattr(app, "session_store", SessionStore(InMemorySessionBackend(), ttl=60))
+    planned, both_planned = [], asyncio.Event()
+
+    async def plan_chat_reply(history, lang):
+        # Both requests have loaded the session before either one saves
+        planned.append(history)
+        if len(planned) == 2:
+            both_planned.set()
+        await both_planned.wait()
+        return "collecting", None, []
+
+    async def get_llm_response(messages):
+        return "reply"
+
+    monkeypatch.setattr(app, "plan_chat_reply", plan_chat_reply)
+    monkeypatch.setattr(app, "get_llm_response", get_llm_response)
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = (await client.post("/sessions", json={"language": "en"})).json()["session_id"]
+        responses = await asyncio.gather(*(
+            client.post(f"/sessions/{session_id}/chat", json={"message": text}) for text in ("one", "two")
+        ))
+        stored = (await client.get(f"/sessions/{session_id}")).json()
+    assert sorted(r.status_code for r in responses) == [200, 409]
+    assert len(stored["history"]) == 2
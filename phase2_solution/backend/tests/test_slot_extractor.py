@@ -0,0 +1,163 @@
+import pytest
+
+from slot_extractor import SlotExtractor, asked_fields, parse_message
+
+NAME = asked_fields("What is your first and last name?")
+NOTHING = frozenset()
+
+
+def conversation(*turns):
+    """Alternate assistant questions and user replies, starting with the assistant."""
+    roles = ("assistant", "user")
+    return [{"role": roles[i % 2], "content": text} for i, text in enumerate(turns)]
+
+
+@pytest.mark.parametrize("text, asked", [
+    ("im fine thanks", NOTHING),
+    ("im fine thanks", NAME),
+    ("I'm good, how are you?", NAME),
+    ("why do you need my name", NAME),
+    ("לא רוצה להגיד", NAME),
+    ("I am tired", NOTHING),
+])
+def test_small_talk_is_not_a_name(text, asked):
+    values, _, _ = parse_message(text, asked)
+    assert "first_name" not in values and "last_name" not in values
+
+
+@pytest.mark.parametrize("text, first, last", [
+    ("Actually Dana", "Dana", None),
+    ("I'm Dana Cohen", "Dana", "Cohen"),
+    ("Dana Cohen", "Dana", "Cohen"),
+    ("אני דנה כהן", "דנה", "כהן"),
+])
+def test_bare_names_are_guessed(text, first, last):
+    values, conflict, guessed = parse_message(text, NAME)
+    assert values.get("first_name") == first
+    assert values.get("last_name") == last
+    assert not conflict
+    assert "first_name" in guessed
+
+
+@pytest.mark.parametrize("text", ["My name is Dana Cohen", "שמי דנה כהן", "first name Dana, last name Cohen"])
+def test_labelled_names_are_not_guessed(text):
+    values, _, guessed = parse_message(text, NOTHING)
+    assert values["last_name"] in ("Cohen", "כהן")
+    assert not guessed
+
+
+def test_nine_digit_numbers_follow_labels_and_questions():
+    values, conflict, _ = parse_message("ID 123456782 and card number 987654321", NOTHING)
+    assert values == {"id_number": "123456782", "card_number": "987654321"}
+    assert not conflict
+    values, _, _ = parse_message("123456782", asked_fields("What is your ID number?"))
+    assert values == {"id_number": "123456782"}
+    # Two unlabelled numbers without a question cannot be told apart
+    _, conflict, _ = parse_message("123456782, 987654321", NOTHING)
+    assert conflict
+
+
+@pytest.mark.parametrize("text", ["my card is 111111111 and id 222222222", "card 111111111, id 222222222"])
+def test_each_number_takes_its_nearest_label(text):
+    values, conflict, _ = parse_message(text, NOTHING)
+    assert values == {"card_number": "111111111", "id_number": "222222222"}
+    assert not conflict
+
+
+def test_enumerated_values():
+    values, _, guessed = parse_message("I'm 34 years old, male, Maccabi gold", NOTHING)
+    assert values == {"age": 34, "gender": "male", "hmo": "מכבי", "tier": "זהב"}
+    assert not guessed
+    values, _, guessed = parse_message("בן", asked_fields("מה המגדר שלך?"))
+    assert values == {"gender": "male"} and guessed == {"gender"}
+
+
+FULL = conversation(
+    "Hi! What is your first and last name?", "Dana Cohen",
+    "Thanks! What is your ID number?", "123456782",
+    "What is your gender and age?", "female, 34",
+    "Which HMO are you a member of?", "Clalit",
+    "What is your HMO card number?", "987654321",
+    "And your insurance tier?", "silver",
+)
+
+
+def test_full_conversation_is_complete_but_names_need_checking():
+    state = SlotExtractor().extract(FULL)
+    assert state.complete
+    assert state.values == {
+        "first_name": "Dana", "last_name": "Cohen", "id_number": "123456782", "gender": "female",
+        "age": 34, "hmo": "כללית", "card_number": "987654321", "tier": "כסף",
+    }
+    assert state.guessed == {"first_name", "last_name"}
+
+
+def test_labelled_correction_clears_guess():
+    history = FULL + conversation("Please confirm your details.", "my name is Dana Levi")[1:]
+    state = SlotExtractor().extract(history)
+    assert state.values["last_name"] == "Levi"
+    assert not state.guessed
+
+
+def test_incremental_extraction_matches_full_parse():
+    extractor = SlotExtractor()
+    for end in range(1, len(FULL) + 1):
+        incremental = extractor.extract(FULL[:end])
+    assert incremental == SlotExtractor().extract(FULL)
+
+
+@pytest.fixture
+def extractor_calls(monkeypatch):
+    import app
+    calls = []
+
+    async def fake_llm(messages, **kwargs):
+        calls.append(messages)
+        return '{"first_name": "Dana", "last_name": "Cohen", "id_number": "123456782", "gender": "female", ' \
+               '"age": 34, "hmo": "כללית", "card_number": "987654321", "tier": "כסף"}'
+
+    monkeypatch.setattr(app, "get_llm_response", fake_llm)
+    return app, calls
+
+
+@pytest.mark.anyio
+async def test_guessed_names_are_checked_by_the_llm(extractor_calls):
+    app, calls = extractor_calls
+    phase, user_info, _ = await app.plan_chat_reply(FULL, "en")
+    assert phase == "confirming" and user_info.last_name == "Cohen"
+    assert len(calls) == 1
+    assert "check each one" in calls[0][1]["content"]
+
+
+@pytest.mark.anyio
+async def test_labelled_details_skip_the_llm(extractor_calls):
+    app, calls = extractor_calls
+    history = conversation(
+        "Hi! Please tell me about yourself.",
+        "My name is Dana Cohen, ID 123456782, female, 34 years old, Clalit silver, card number 987654321",
+    )
+    phase, user_info, _ = await app.plan_chat_reply(history, "en")
+    assert phase == "confirming" and user_info.tier == "כסף"
+    assert calls == []
+
+
+@pytest.mark.anyio
+async def test_values_the_parser_cannot_read_reach_the_llm(extractor_calls):
+    app, calls = extractor_calls
+    history = conversation(
+        "Hi! Please tell me about yourself.",
+        "My name is Dana Cohen, ID 123456782, female, thirty four years old, Clalit silver, card number 987654321",
+    )
+    # The message filled most of the fields, so the missing age is asked for locally first
+    phase, _, _ = await app.plan_chat_reply(history, "en")
+    assert phase == "collecting" and calls == []
+    # A reply that fills nothing new may hold what the parser missed
+    history += conversation("Thanks! Anything else?", "no, I already told you everything")
+    phase, user_info, _ = await app.plan_chat_reply(history, "en")
+    assert phase == "confirming" and user_info.age == 34
+    assert len(calls) == 1
+
+
+def test_unprompted_free_form_reply_is_left_to_the_llm():
+    state = SlotExtractor().extract(conversation("Hi! How can I help?", "hey, Dana Cohen here"))
+    assert not state.values and state.ambiguous
@@ -0,0 +1,93 @@
+import gc
+from types import SimpleNamespace
+
+import pytest
+
+import app
+import llm
+
+
+class FakeStream:
+    """Stands in for the SDK's AsyncStream of chat completion chunks."""
+
+    def __init__(self, deltas):
+        self._chunks = iter([SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=d))])
+                             for d in deltas])
+        self.closed = False
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    streams = []
+
+    async def create(**kwargs):
+        streams.append(FakeStream(["Hello", " there"]))
+        return streams[-1]
+
+    completions = SimpleNamespace(create=create)
+    monkeypatch.setattr(llm, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    yield streams
+    assert llm.scheduler.in_flight == 0
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.mark.anyio
+async def test_full_stream_releases_slot(upstream):
+    stream = await llm.stream_llm_response(MESSAGES)
+    assert llm.scheduler.in_flight == 1
+    events = [event async for event in app.stream_events(stream, {})]
+    assert events[0].startswith("event: meta")
+    assert events[-1].startswith("event: done")
+    assert upstream[0].closed
+
+
+@pytest.mark.anyio
+async def test_closing_events_after_meta_releases_slot(upstream):
+    stream = await llm.stream_llm_response(MESSAGES)
+    events = app.stream_events(stream, {})
+    assert (await events.__anext__()).startswith("event: meta")
+    await events.aclose()
+    assert llm.scheduler.in_flight == 0
+    assert upstream[0].closed
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"])
+async def test_response_closes_stream_that_was_never_iterated(upstream, spec_version):
+    stream = await llm.stream_llm_response(MESSAGES)
+    # The cache wrapper is a generator that never starts, so only the response can close the stream
+    deltas = app.cache_when_complete(stream, ("מכבי", "זהב", "en", "", ""), "q", False)
+    response = app.event_stream_response(app.stream_events(deltas, {}), stream)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client went away")
+
+    try:
+        await response({"type": "http", "asgi": {"spec_version": spec_version}}, receive, send)
+    except Exception:
+        pass
+    assert llm.scheduler.in_flight == 0
+    assert upstream[0].closed
+
+
+@pytest.mark.anyio
+async def test_abandoned_stream_releases_slot(upstream):
+    stream = await llm.stream_llm_response(MESSAGES)
+    assert llm.scheduler.in_flight == 1
+    del stream
+    gc.collect()
+    assert llm.scheduler.in_flight == 0
@@ -0,0 +1,75 @@
+import os
+
+import telemetry  # puts the repository root on sys.path
+from shared.telemetry import Registry
+
+
+def make_registry(share_dir=""):
+    registry = Registry(share_dir=share_dir)
+    return registry, registry.counter("calls_total", "Calls", ("model",)), registry.histogram("call_seconds", "Calls")
+
+
+def test_render_without_sharing():
+    registry, calls, seconds = make_registry()
+    calls.inc(model="gpt-4o")
+    seconds.observe(0.2)
+    text = registry.render()
+    assert 'calls_total{model="gpt-4o"} 1' in text
+    assert 'call_seconds_bucket{le="0.25"} 1' in text
+
+
+def test_render_sums_every_worker(tmp_path):
+    registry, calls, seconds = make_registry(str(tmp_path))
+    calls.inc(model="gpt-4o")
+    seconds.observe(0.2)
+
+    pid = os.fork()
+    if pid == 0:
+        # A forked worker starts from zero and publishes its own values
+        try:
+            calls.inc(2, model="gpt-4o")
+            calls.inc(model="gpt-4o-mini")
+            seconds.observe(3.0)
+            registry.write()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    text = registry.render()
+    assert 'calls_total{model="gpt-4o"} 3' in text
+    assert 'calls_total{model="gpt-4o-mini"} 1' in text
+    assert 'call_seconds_bucket{le="0.25"} 1' in text
+    assert 'call_seconds_bucket{le="5"} 2' in text
+    assert "call_seconds_count 2" in text
+
+
+def test_unreadable_worker_file_is_skipped(tmp_path):
+    registry, calls, _ = make_registry(str(tmp_path))
+    calls.inc(model="gpt-4o")
+    (tmp_path / "1.json").write_text("{not json")
+    assert 'calls_total{model="gpt-4o"} 1' in registry.render()
+
+
+def test_stage_span_records_into_the_stage_histogram():
+    before = telemetry.STAGE_SECONDS.snapshot().get(("test_stage",), [[], 0.0, 0])[2]
+    with telemetry.span("test_stage"):
+        pass
+    assert telemetry.STAGE_SECONDS.snapshot()[("test_stage",)][2] == before + 1
+
+
+def test_retired_workers_are_folded_into_one_file(tmp_path):
+    registry, calls, _ = make_registry(str(tmp_path))
+    for count in (2, 3):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                calls.inc(count, model="gpt-4o")
+                registry.write()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        registry.retire(pid)
+
+    assert os.listdir(tmp_path) == ["retired.json"]
+    calls.inc(model="gpt-4o")
+    assert 'calls_total{model="gpt-4o"} 6' in registry.render()
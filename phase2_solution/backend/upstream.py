@@ -0,0 +1,140 @@
+"""
+Scheduling of upstream Azure OpenAI requests.
+
+Every call waits here for a concurrency slot and for room in its deployment's
+requests-per-minute and tokens-per-minute budgets. The budgets themselves
+(refill, header corrections, 429 pauses) live in `shared/rate_limits.py`,
+shared with the Phase 1 extractor; this module only adds the asyncio queue.
+Waiting requests are served by priority (interactive before background work),
+then in arrival order; a request whose deployment has no budget yet does not
+hold back requests to other deployments.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import sys
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from shared.rate_limits import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RateBudgets, backoff
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(messages: List[dict], completion_tokens: int) -> int:
+    """Tokens a request counts against TPM: the prompt (about 4 UTF-8 bytes per token) plus the expected completion."""
+    prompt = sum(len(str(message.get("content", "")).encode("utf-8")) // 4 + 4 for message in messages)
+    return prompt + completion_tokens
+
+
+class UpstreamScheduler(RateBudgets):
+    """Admits upstream calls by priority while respecting the concurrency limit and each deployment's budget."""
+
+    def __init__(self, max_concurrency: int, queue_timeout: float, rpm: float = 0, tpm: float = 0):
+        super().__init__(rpm, tpm)
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # (priority, arrival, model, tokens, future) of the waiting calls, in the order they are served
+        self._queue: List[Tuple[int, int, str, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Recent successful call latencies per deployment, for adaptive hedging
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for entry in self._queue if not entry[4].done())
+
+    def _can_start(self, model: str, tokens: int) -> bool:
+        return self.in_flight < self.max_concurrency and self.budget(model).delay(tokens) == 0
+
+    def _start(self, model: str, tokens: int) -> None:
+        self.in_flight += 1
+        self.budget(model).take(tokens)
+
+    async def acquire(self, model: str, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait for a slot; raises 503 after `queue_timeout`. Every acquire must be paired with `release()`."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((priority, next(self._arrivals), model, tokens, future))
+        self._dispatch()
+        if future.done():
+            return
+        try:
+            done, _ = await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        if not done:
+            self._abandon(future)
+            logger.warning("Timed out waiting for a free LLM slot")
+            raise HTTPException(status_code=503, detail="The assistant is busy, please try again shortly.")
+
+    def try_acquire(self, model: str, tokens: int) -> bool:
+        """Take a slot only if one is free right now and nobody is waiting (used for hedged requests)."""
+        if self.waiting or not self._can_start(model, tokens):
+            return False
+        self._start(model, tokens)
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        # The slot may have been granted just as the caller gave up
+        if future.done() and not future.cancelled():
+            self.release()
+        else:
+            future.cancel()
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Serve by priority, skipping deployments that have no budget yet: a call to a paused
+        # deployment must not hold back one queued for its fallback
+        self._queue = sorted(entry for entry in self._queue if not entry[4].done())
+        blocked = set()
+        wait = None
+        for _, _, model, tokens, future in self._queue:
+            if self.in_flight >= self.max_concurrency:
+                break
+            if model in blocked:
+                continue
+            delay = self.budget(model).delay(tokens)
+            if delay > 0:
+                # Later calls to the same deployment stay behind this one
+                blocked.add(model)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            self._start(model, tokens)
+            future.set_result(None)
+        self._queue = [entry for entry in self._queue if not entry[4].done()]
+        if wait is not None:
+            self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+
+    async def observe_response(self, response: httpx.Response) -> None:
+        """httpx response hook: update the deployment's budget, and pause it on a 429."""
+        if self.observe(response.request.url.path, response.status_code, response.headers):
+            self._dispatch()
+
+    def record_latency(self, model: str, seconds: float) -> None:
+        samples = self._latencies.get(model)
+        if samples is None:
+            samples = self._latencies[model] = deque(maxlen=200)
+        samples.append(seconds)
+
+    def latency_quantile(self, model: str, quantile: float, min_samples: int = 20) -> Optional[float]:
+        samples = self._latencies.get(model)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * quantile))]
@@ -23,10 +23,10 @@ TEXTS = {
     "spinner_thinking": {"en": "Thinking...", "he": "חושב..."},
     "welcome_qa": {"en": "Welcome, {name}! You can now ask questions about your HMO plan.", "he": "ברוך/ה הבא/ה, {name}! כעת ניתן לשאול שאלות על תוכנית הבריאות שלך."},
     "chat_input_qa": {"en": "Ask a question about your health services...", "he": "שאל/י שאלה על שירותי הבריאות שלך..."},
-    "spinner_searching": {"en": "Searching for an answer...", "he": "מחפש תשובה..."},
     "error_backend_connection": {"en": "Could not connect to the backend: {e}", "he": "לא ניתן היה להתחבר לשרת: {e}"},
     "error_backend_response": {"en": "Received an invalid response from the backend.", "he": "התקבלה תגובה לא תקינה מהשרת."},
     "error_unexpected": {"en": "An unexpected error occurred: {e}", "he": "אירעה שגיאה בלתי צפויה: {e}"},
+    "error_session_expired": {"en": "Your session has expired. Please start again.", "he": "פג תוקף השיחה. אנא התחל/י מחדש."},
 }
 
 # --- Language and Layout Setup ---
@@ -36,7 +36,8 @@ selected_lang_name = st.sidebar.radio("", list(lang_options.keys()))
 
 if "lang" not in st.session_state or st.session_state.lang != lang_options[selected_lang_name]:
     st.session_state.lang = lang_options[selected_lang_name]
-    # Reset history on language change to avoid confusion
+    # Reset history on language change to avoid confusion; the backend session is per language
+    st.session_state.session_id = None
     st.session_state.history = []
     st.session_state.phase = "collecting"
     st.session_state.user_info = None
@@ -64,10 +65,59 @@ if "history" not in st.session_state: st.session_state.history = []
 if "user_info" not in st.session_state: st.session_state.user_info = None 
 if "pending_info" not in st.session_state: st.session_state.pending_info = None
 if "show_welcome" not in st.session_state: st.session_state.show_welcome = False
+if "session_id" not in st.session_state: st.session_state.session_id = None
 
 API_URL = "http://localhost:8000"
 LANG = st.session_state.lang
 
+def session_path(endpoint):
+    """
+    Path of a session endpoint. The backend keeps the history and user info of the
+    session, so each request only carries the new message.
+    """
+    if st.session_state.session_id is None:
+        res = requests.post(f"{API_URL}/sessions", json={"language": LANG})
+        res.raise_for_status()
+        st.session_state.session_id = res.json()["session_id"]
+    return f"/sessions/{st.session_state.session_id}/{endpoint}"
+
+def restart_if_expired(e):
+    """Start over when the backend no longer has the session (expired or restarted)."""
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code == 404:
+        st.session_state.session_id = None
+        st.session_state.history = []
+        st.session_state.phase = "collecting"
+        st.session_state.user_info = None
+        st.session_state.pending_info = None
+        st.error(TEXTS["error_session_expired"][LANG])
+        return True
+    return False
+
+def stream_reply(path, payload, meta):
+    """
+    Yield the assistant's reply as it is generated by a streaming backend endpoint.
+    The Server-Sent Events `meta` event (phase, user_info) is copied into `meta`.
+    """
+    with requests.post(f"{API_URL}{path}", json=payload, stream=True) as res:
+        res.raise_for_status()
+        res.encoding = "utf-8"
+        event = "message"
+        for line in res.iter_lines(decode_unicode=True):
+            if not line:
+                event = "message"
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):].strip())
+                if event == "meta":
+                    meta.update(data)
+                elif event == "error":
+                    raise RuntimeError(data.get("detail"))
+                elif event == "done":
+                    return
+                else:
+                    yield data["delta"]
+
 # --- UI Rendering ---
 st.title(TEXTS["page_title"][LANG])
 
@@ -81,40 +131,52 @@ if st.session_state.phase in ["collecting", "confirming"]:
         st.info(TEXTS["confirm_info"][LANG])
         col1, col2 = st.columns(2)
         if col1.button(TEXTS["confirm_yes"][LANG], use_container_width=True):
-            st.session_state.user_info = st.session_state.pending_info
-            st.session_state.phase = "qa"
-            st.session_state.show_welcome = True  # Show welcome message when entering QA phase
-            st.session_state.history.append({"role": "user", "content": TEXTS["user_confirmed"][LANG]})
-            st.session_state.history.append({"role": "assistant", "content": TEXTS["assistant_confirmed"][LANG]})
-            st.rerun()
+            messages = [
+                {"role": "user", "content": TEXTS["user_confirmed"][LANG]},
+                {"role": "assistant", "content": TEXTS["assistant_confirmed"][LANG]},
+            ]
+            try:
+                res = requests.post(f"{API_URL}{session_path('confirm')}", json={"messages": messages})
+                res.raise_for_status()
+                st.session_state.user_info = res.json()["user_info"]
+                st.session_state.phase = "qa"
+                st.session_state.show_welcome = True  # Show welcome message when entering QA phase
+                st.session_state.history.extend(messages)
+                st.rerun()
+            except requests.exceptions.RequestException as e:
+                if not restart_if_expired(e): st.error(TEXTS["error_backend_connection"][LANG].format(e=e))
 
         if col2.button(TEXTS["confirm_no"][LANG], use_container_width=True):
             st.session_state.phase = "collecting"
             st.session_state.pending_info = None
             st.session_state.history.append({"role": "user", "content": TEXTS["user_corrected"][LANG]})
-            with st.spinner(TEXTS["spinner_thinking"][LANG]):
-                response = requests.post(f"{API_URL}/chat", json={"history": st.session_state.history, "language": LANG}).json()
-                st.session_state.history.append({"role": "assistant", "content": response["assistant"]})
-            st.rerun()
+            try:
+                with st.spinner(TEXTS["spinner_thinking"][LANG]):
+                    res = requests.post(f"{API_URL}{session_path('chat')}", json={"message": TEXTS["user_corrected"][LANG]})
+                    res.raise_for_status()
+                    st.session_state.history.append({"role": "assistant", "content": res.json()["assistant"]})
+                st.rerun()
+            except requests.exceptions.RequestException as e:
+                if not restart_if_expired(e): st.error(TEXTS["error_backend_connection"][LANG].format(e=e))
 
     if prompt := st.chat_input(TEXTS["chat_input_collect"][LANG]):
         st.session_state.history.append({"role": "user", "content": prompt})
         with st.chat_message("user"): st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner(TEXTS["spinner_thinking"][LANG]):
-                try:
-                    payload = {"history": st.session_state.history, "language": LANG}
-                    res = requests.post(f"{API_URL}/chat", json=payload)
-                    res.raise_for_status()
-                    response_data = res.json()
-                    st.session_state.history.append({"role": "assistant", "content": response_data["assistant"]})
-                    if response_data.get("phase") == "confirming":
-                        st.session_state.phase = "confirming"
-                        st.session_state.pending_info = response_data.get("user_info")
-                    st.rerun()
-                except requests.exceptions.RequestException as e: st.error(TEXTS["error_backend_connection"][LANG].format(e=e))
-                except json.JSONDecodeError: st.error(TEXTS["error_backend_response"][LANG])
+            try:
+                meta = {}
+                # Render the reply token by token as the backend streams it
+                reply = st.write_stream(stream_reply(session_path("chat/stream"), {"message": prompt}, meta))
+                st.session_state.history.append({"role": "assistant", "content": reply})
+                if meta.get("phase") == "confirming":
+                    st.session_state.phase = "confirming"
+                    st.session_state.pending_info = meta.get("user_info")
+                st.rerun()
+            except requests.exceptions.RequestException as e:
+                if not restart_if_expired(e): st.error(TEXTS["error_backend_connection"][LANG].format(e=e))
+            except (json.JSONDecodeError, KeyError): st.error(TEXTS["error_backend_response"][LANG])
+            except RuntimeError as e: st.error(TEXTS["error_unexpected"][LANG].format(e=e))
 
 elif st.session_state.phase == "qa":
     # Only show welcome message if show_welcome is True
@@ -129,18 +191,10 @@ elif st.session_state.phase == "qa":
         with st.chat_message("user"): st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner(TEXTS["spinner_searching"][LANG]):
-                try:
-                    payload = {
-                        "user_info": st.session_state.user_info,
-                        "history": st.session_state.history[:-1],
-                        "new_message": prompt,
-                        "language": LANG
-                    }
-                    res = requests.post(f"{API_URL}/ask", json=payload)
-                    res.raise_for_status()
-                    response_data = res.json()
-                    st.session_state.history.append({"role": "assistant", "content": response_data["assistant"]})
-                    st.markdown(response_data["assistant"])
-                except requests.exceptions.RequestException as e: st.error(TEXTS["error_backend_connection"][LANG].format(e=e))
-                except Exception as e: st.error(TEXTS["error_unexpected"][LANG].format(e=e))
\ No newline at end of file
+            try:
+                # Render the answer token by token as the backend streams it
+                answer = st.write_stream(stream_reply(session_path("ask/stream"), {"message": prompt}, {}))
+                st.session_state.history.append({"role": "assistant", "content": answer})
+            except requests.exceptions.RequestException as e:
+                if not restart_if_expired(e): st.error(TEXTS["error_backend_connection"][LANG].format(e=e))
+            except Exception as e: st.error(TEXTS["error_unexpected"][LANG].format(e=e))
\ No newline at end of file
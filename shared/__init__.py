@@ -0,0 +1,6 @@
+"""
+Code shared by the Phase 1 form extractor and the Phase 2 chatbot backend.
+
+Both run from their own directory with flat imports; their `telemetry.py` and
+`upstream.py` put the repository root on `sys.path` to import this package.
+"""
@@ -0,0 +1,160 @@
+"""
+Rate-limit bookkeeping for Azure OpenAI deployments, shared by the Phase 1
+extractor's thread-based scheduler and the Phase 2 backend's asyncio one.
+
+`RateBudgets` keeps one `RateBudget` per deployment: the requests and tokens
+it may still use, refilled continuously at the per-minute limits and corrected
+from the `x-ratelimit-remaining-*` headers of each response; a 429 pauses the
+deployment for its `retry-after`. It does no locking or waiting of its own.
+The admission wrappers in each phase's `upstream.py` decide when a call may go.
+"""
+import math
+import random
+import re
+import time
+from typing import Dict, Mapping, Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_BATCH = 2
+
+_DEPLOYMENT_PATH = re.compile(r"/deployments/([^/]+)/")
+
+
+def header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def retry_after(headers: Optional[Mapping[str, str]]) -> float:
+    """Seconds the provider asked us to wait, from `retry-after-ms` or `retry-after` (0 if absent)."""
+    if not headers:
+        return 0.0
+    milliseconds = header_float(headers, "retry-after-ms")
+    if milliseconds is not None:
+        return milliseconds / 1000
+    return header_float(headers, "retry-after") or 0.0
+
+
+def backoff(attempt: int, base: float, cap: float, hint: float = 0.0) -> float:
+    """Full-jitter exponential backoff, but never shorter than the provider's retry hint."""
+    return max(hint, random.uniform(0, min(cap, base * (2 ** attempt))))
+
+
+class RateBudget:
+    """Requests and tokens one deployment may still use, refilled continuously at its per-minute limits."""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        # A limit of 0 is unknown: nothing is held back until the headers report one
+        self.rpm = rpm
+        self.tpm = tpm
+        self._configured = (bool(rpm), bool(tpm))
+        self.requests = rpm or math.inf
+        self.tokens = tpm or math.inf
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def delay(self, tokens: int) -> float:
+        """Seconds until a request of `tokens` fits in the budget; 0 when it can be sent now."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.rpm and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+        if self.tpm:
+            # A request larger than the whole budget goes out once the budget is full
+            needed = min(tokens, self.tpm)
+            if self.tokens < needed:
+                wait = max(wait, (needed - self.tokens) * 60 / self.tpm)
+        return wait
+
+    def take(self, tokens: int) -> None:
+        self.requests -= 1
+        self.tokens -= tokens
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """
+        Correct the budget from the headers of a response. The provider's count
+        does not yet include requests still in flight, so it only ever lowers
+        our own estimate; time refills it.
+        """
+        self._refill(time.monotonic())
+        remaining = header_float(headers, "x-ratelimit-remaining-requests")
+        if remaining is not None:
+            limit = header_float(headers, "x-ratelimit-limit-requests")
+            if limit:
+                self.rpm = limit
+            elif not self._configured[0]:
+                # Azure does not send the limit; the most ever left (after this request) is a lower bound
+                self.rpm = max(self.rpm, remaining + 1)
+            self.requests = min(self.requests, remaining)
+        remaining = header_float(headers, "x-ratelimit-remaining-tokens")
+        if remaining is not None:
+            limit = header_float(headers, "x-ratelimit-limit-tokens")
+            if limit:
+                self.tpm = limit
+            elif not self._configured[1]:
+                self.tpm = max(self.tpm, remaining)
+            self.tokens = min(self.tokens, remaining)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        self._refill(time.monotonic())
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "remaining_requests": round(self.requests, 1) if self.rpm else None,
+            "remaining_tokens": round(self.tokens) if self.tpm else None,
+            "paused_s": round(max(0.0, self.paused_until - time.monotonic()), 3),
+        }
+
+
+class RateBudgets:
+    """The budget of every deployment seen so far, created with the configured limits."""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._budgets: Dict[str, RateBudget] = {}
+
+    def budget(self, model: str) -> RateBudget:
+        budget = self._budgets.get(model)
+        if budget is None:
+            budget = self._budgets[model] = RateBudget(self.rpm, self.tpm)
+        return budget
+
+    def choose(self, model: str, tokens: int, fallback: Optional[str] = None) -> str:
+        """The deployment to use: `fallback` when `model` is throttled and the fallback is not."""
+        if fallback and fallback != model and self.budget(model).delay(tokens) > 0 \
+                and self.budget(fallback).delay(tokens) == 0:
+            return fallback
+        return model
+
+    def observe(self, path: str, status_code: int, headers: Mapping[str, str]) -> bool:
+        """Update the budget of the deployment in a response's URL path, pausing it on a 429; False if none."""
+        match = _DEPLOYMENT_PATH.search(path)
+        if match is None:
+            return False
+        budget = self.budget(match.group(1))
+        budget.observe(headers)
+        if status_code == 429:
+            budget.pause(retry_after(headers) or 1.0)
+        return True
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {model: budget.snapshot() for model, budget in self._budgets.items()}
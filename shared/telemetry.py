@@ -0,0 +1,392 @@
+"""
+Prometheus metric types and OpenTelemetry stage spans, without the
+prometheus_client dependency.
+
+A `Registry` holds counters and histograms and renders them in the Prometheus
+text format. Given a `share_dir`, every process that uses the registry
+publishes its values there (see `Registry.share`), and `render` sums the
+values of all of them, so one scrape of any gunicorn worker covers the whole
+server. A `Tracer` times `span("stage")` blocks into a stage histogram and,
+when tracing is set to `otel`, into OpenTelemetry spans.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers cache hits (sub-millisecond) up to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+# Values of exited processes, summed. `_pids` lists a process whose own file is being removed,
+# and `_generation` changes with every write, so a reader can tell that it raced a removal
+_RETIRED = "retired.json"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), enabled: bool = True):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.enabled = enabled
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def reset(self) -> None:
+        self._values, self._lock = {}, threading.Lock()
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total: Dict[LabelValues, float], values: Dict[LabelValues, float]) -> None:
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def render(self, values: Optional[Dict[LabelValues, float]] = None) -> List[str]:
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS, enabled: bool = True):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = enabled
+        # label values -> [bucket counts, sum, count]
+        self._values: Dict[LabelValues, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def reset(self) -> None:
+        self._values, self._lock = {}, threading.Lock()
+
+    def snapshot(self) -> Dict[LabelValues, List]:
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def merge(total: Dict[LabelValues, List], values: Dict[LabelValues, List]) -> None:
+        for key, (counts, value_sum, count) in values.items():
+            state = total.get(key)
+            if state is None:
+                total[key] = [list(counts), value_sum, count]
+            else:
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += value_sum
+                state[2] += count
+
+    def render(self, values: Optional[Dict[LabelValues, List]] = None) -> List[str]:
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _labels(self.labelnames, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of one process. With `share_dir`, each process writes its values
+    to `<share_dir>/<pid>.json` and `render` adds up every file in the directory.
+    The values of an exited process are folded into `retired.json` (see
+    `retire`), so counters never go backwards when a worker is replaced and
+    the directory does not grow with every replacement.
+    """
+
+    def __init__(self, enabled: bool = True, buckets: Iterable[float] = DEFAULT_BUCKETS, share_dir: str = ""):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.share_dir = share_dir
+        self._metrics: List = []
+        self._sharing = False
+        if share_dir:
+            os.makedirs(share_dir, exist_ok=True)
+            # A forked worker starts from zero: the parent's values are already in the parent's file
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames, enabled=self.enabled)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Optional[Iterable[float]] = None) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets or self.buckets, enabled=self.enabled)
+        self._metrics.append(metric)
+        return metric
+
+    def _after_fork(self) -> None:
+        for metric in self._metrics:
+            metric.reset()
+        self._sharing = False
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.share_dir, f"{pid}.json")
+
+    @staticmethod
+    def _encode(values: Dict[LabelValues, object]) -> List:
+        return [[list(key), value] for key, value in values.items()]
+
+    @staticmethod
+    def _read(path: str) -> Optional[dict]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _dump(path: str, data: dict) -> None:
+        temp = f"{path}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp, path)
+
+    def write(self) -> None:
+        """Publish this process's values to the share directory."""
+        if not self.share_dir:
+            return
+        data = {metric.name: self._encode(metric.snapshot()) for metric in self._metrics}
+        path = self._path(os.getpid())
+        try:
+            self._dump(path, data)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {path}: {e}")
+
+    def retire(self, pid: int) -> None:
+        """
+        Fold the last values written by the exited process `pid` into the
+        retired totals and remove its file. Only one process (the gunicorn
+        master) may call this.
+        """
+        if not self.share_dir:
+            return
+        path = self._path(pid)
+        data = self._read(path)
+        if data is None:
+            return
+        retired_path = os.path.join(self.share_dir, _RETIRED)
+        retired = self._read(retired_path) or {}
+        totals = {}
+        for metric in self._metrics:
+            values: Dict = {}
+            for source in (retired, data):
+                metric.merge(values, {tuple(key): value for key, value in source.get(metric.name, [])})
+            totals[metric.name] = self._encode(values)
+        generation = retired.get("_generation", 0)
+        try:
+            # Readers skip the file of the listed process, so its values are counted once while it is removed
+            self._dump(retired_path, {**totals, "_pids": [pid], "_generation": generation + 1})
+            os.remove(path)
+            # A new process may reuse the pid from here on
+            self._dump(retired_path, {**totals, "_generation": generation + 2})
+        except OSError as e:
+            logger.warning(f"Could not retire the metrics of process {pid}: {e}")
+
+    def share(self, interval: float) -> None:
+        """Write this process's values now, every `interval` seconds, and at exit. Call once per process."""
+        if not self.share_dir or self._sharing:
+            return
+        self._sharing = True
+        pid = os.getpid()
+        self.write()
+        atexit.register(self.write)
+
+        def run() -> None:
+            while self._sharing and os.getpid() == pid:
+                time.sleep(interval)
+                self.write()
+
+        threading.Thread(target=run, name="metrics-share", daemon=True).start()
+
+    def _collect(self) -> Dict[str, Dict]:
+        """Values of every process: this one live, the others as last written."""
+        totals = {metric.name: metric.snapshot() for metric in self._metrics}
+        if not self.share_dir:
+            return totals
+        retired_path = os.path.join(self.share_dir, _RETIRED)
+        for _ in range(3):
+            retired = self._read(retired_path) or {}
+            skip = {f"{os.getpid()}.json", _RETIRED} | {f"{pid}.json" for pid in retired.get("_pids", [])}
+            sources = [retired]
+            for name in os.listdir(self.share_dir):
+                if not name.endswith(".json") or name in skip:
+                    continue
+                data = self._read(os.path.join(self.share_dir, name))
+                if data is not None:
+                    sources.append(data)
+            # A process retired meanwhile may have been read both in its own file and in the totals
+            if (self._read(retired_path) or {}).get("_generation") == retired.get("_generation"):
+                break
+        for data in sources:
+            for metric in self._metrics:
+                values = {tuple(key): value for key, value in data.get(metric.name, [])}
+                metric.merge(totals[metric.name], values)
+        return totals
+
+    def render(self) -> str:
+        totals = self._collect()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(totals[metric.name]))
+        return "\n".join(lines) + "\n"
+
+
+# --- Tracing ---
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "histogram", "attributes", "tracer", "_started", "_otel", "_otel_cm")
+
+    def __init__(self, stage: str, histogram: Optional[Histogram], attributes: dict, tracer):
+        self.stage = stage
+        self.histogram = histogram
+        self.attributes = attributes
+        self.tracer = tracer
+        self._otel = None
+        self._otel_cm = None
+
+    def __enter__(self):
+        if self.tracer is not None:
+            self._otel_cm = self.tracer.start_as_current_span(self.stage, attributes=self.attributes or None)
+            self._otel = self._otel_cm.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        if self.histogram is not None:
+            self.histogram.observe(elapsed, stage=self.stage)
+        if self._otel_cm is not None:
+            if exc is not None:
+                self._otel.record_exception(exc)
+            self._otel_cm.__exit__(exc_type, exc, tb)
+        return False
+
+    def set(self, **attributes) -> None:
+        """Attach attributes known only after the work started (token counts, outcome)."""
+        if self._otel is not None:
+            for key, value in attributes.items():
+                if value is not None:
+                    self._otel.set_attribute(key, value)
+
+
+class Tracer:
+    """
+    Stage timers. `mode` is "off" or "otel" (needs opentelemetry-sdk and
+    opentelemetry-exporter-otlp-proto-http); `setting` names the variable that
+    chose it, for the error message when the packages are missing.
+    """
+
+    def __init__(self, mode: str, service_name: str, stages: Histogram, setting: str = "TRACING"):
+        self.mode = mode
+        self.service_name = service_name
+        self.stages = stages
+        self.setting = setting
+        self._tracer = None
+
+    def init(self) -> None:
+        """Set up OpenTelemetry when tracing is `otel`; the exporter reads the standard OTEL_EXPORTER_OTLP_* variables."""
+        if self.mode != "otel" or self._tracer is not None:
+            return
+        try:
+            from opentelemetry import trace  # optional dependency
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError:
+            logger.error(f"{self.setting}=otel requires opentelemetry-sdk and "
+                         "opentelemetry-exporter-otlp-proto-http; tracing is disabled")
+            return
+        provider = TracerProvider(resource=Resource.create({"service.name": self.service_name}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        self._tracer = trace.get_tracer(self.service_name)
+        logger.info("OpenTelemetry tracing enabled")
+
+    def shutdown(self) -> None:
+        if self._tracer is None:
+            return
+        from opentelemetry import trace
+        provider = trace.get_tracer_provider()
+        if hasattr(provider, "shutdown"):
+            provider.shutdown()
+        self._tracer = None
+
+    def span(self, stage: str, **attributes):
+        """Time a stage of work; use as `with span("prompt_build"): ...`."""
+        if not self.stages.enabled and self._tracer is None:
+            return _NOOP
+        return _Span(stage, self.stages if self.stages.enabled else None, attributes, self._tracer)
+
+    def trace(self, name: str, **attributes):
+        """An OpenTelemetry span only (no histogram), e.g. the root span of a request or document."""
+        if self._tracer is None:
+            return _NOOP
+        return _Span(name, None, attributes, self._tracer)